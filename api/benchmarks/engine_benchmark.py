@@ -0,0 +1,101 @@
+""" Benchmark of the compact engine state against the pydantic models
+
+Compares the memory of a dealt hand and the time to play a full hand with
+HandManager and with engine.state.HandState. The live hands are still the
+pydantic Hand, that HandManager.play_card plays on the engine state: the
+memory is the one of a hand read from the journal or SQLite, whose cards are
+the shared instances.
+
+Usage (from the api folder):
+    python -m benchmarks.engine_benchmark
+"""
+import random
+import time
+import tracemalloc
+
+from engine.cards import to_index
+from engine.state import from_hand
+from models.models import Game, Hand, Player
+from services.hand_manager import HandManager
+from repositories.repository import InMemoryGameRepository, InMemoryHandRepository, InMemoryPlayersRepository
+
+HANDS = 2_000
+PLAYERS = ['player1', 'player2']
+
+
+def new_hand_manager():
+    """ A HandManager with a dealt hand of a 2 players game """
+    players = InMemoryPlayersRepository()
+    games = InMemoryGameRepository()
+    game = Game(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+    game.id = 'game'
+    for id in PLAYERS:
+        player = Player()
+        player.id = id
+        players.save(player)
+        game.players.append(player)
+    games.save(game)
+
+    hand_manager = HandManager(hands=InMemoryHandRepository(), players=players, games=games)
+    hand_manager.new_hand(game_id='game')
+    hand_manager.initialize_hand(hand_id='game')
+    hand = hand_manager.get_hand(id='game')
+    hand_manager.deal_cards(hand_id='game', player_id=hand.player_dealer)
+    return hand_manager, hand
+
+
+def measure_memory(build) -> float:
+    """ Average bytes allocated by each object returned by build """
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    objects = [build() for _ in range(200)]
+    end = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in end.compare_to(start, 'filename'))
+    return total / len(objects)
+
+
+def play_with_hand_manager() -> float:
+    elapsed = 0.0
+    for _ in range(HANDS):
+        hand_manager, hand = new_hand_manager()
+        start = time.perf_counter()
+        while hand.winner is None:
+            player = hand.player_turn
+            played = {to_index(card) for round in hand.rounds for card in round.cards_played.values() if card}
+            card = next(card for card in hand.cards_dealed[player] if to_index(card) not in played)
+            hand_manager.play_card(hand_id='game', player_id=player, rank=card.rank, suit=card.suit)
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def play_with_engine() -> float:
+    elapsed = 0.0
+    for _ in range(HANDS):
+        _, hand = new_hand_manager()
+        state = from_hand(hand, players=PLAYERS)
+        start = time.perf_counter()
+        while state.winner() is None:
+            seat = state.turn
+            mask = state.cards[seat]
+            state.play(seat=seat, card=(mask & -mask).bit_length() - 1)
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def main():
+    random.seed(0)
+    _, hand = new_hand_manager()
+    pydantic_bytes = measure_memory(lambda: Hand.parse_raw(hand.json()))
+    engine_bytes = measure_memory(lambda: from_hand(hand, players=PLAYERS))
+
+    pydantic_time = play_with_hand_manager()
+    engine_time = play_with_engine()
+
+    print(f"{'':>10} {'bytes/hand':>12} {'us/hand played':>16}")
+    print(f"{'pydantic':>10} {pydantic_bytes:>12.0f} {pydantic_time / HANDS * 1e6:>16.1f}")
+    print(f"{'engine':>10} {engine_bytes:>12.0f} {engine_time / HANDS * 1e6:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+""" Benchmark of the in memory repositories
+
+Measures the cost of the lookups done while handling a socket event with an
+increasing number of live games. The cost per operation should stay flat.
+
+Usage (from the api folder):
+    python -m benchmarks.repository_benchmark
+"""
+import timeit
+import uuid
+
+from models.models import Game, Hand, Player, Score
+from repositories.repository import (
+        InMemoryGameRepository, InMemoryHandRepository, InMemoryScoreRepository
+)
+
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+OPEN_GAMES = 10  # Partidas esperando jugadores, el resto ya empezó
+REPEAT = 20_000
+
+
+def fill(size: int):
+    games = InMemoryGameRepository()
+    hands = InMemoryHandRepository()
+    scores = InMemoryScoreRepository()
+    ids = []
+
+    for i in range(size):
+        game = Game(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+        game.id = str(uuid.uuid4())
+        if i >= OPEN_GAMES:
+            game.players = [Player(), Player()]
+            game.status = 'STARTED'
+        games.save(game)
+        hands.save(Hand(id=game.id))
+        score = Score()
+        score.id = game.id
+        scores.save(score)
+        ids.append(game.id)
+
+    return games, hands, scores, ids
+
+
+def measure(size: int) -> dict:
+    games, hands, scores, ids = fill(size)
+    # La última partida creada es el peor caso para una búsqueda lineal
+    game_id = ids[-1]
+    game = games.get_by_id(id=game_id)
+    hand = hands.get_by_id(id=game_id)
+
+    def per_op(stmt) -> float:
+        return min(timeit.repeat(stmt, number=REPEAT, repeat=3)) / REPEAT * 1e9
+
+    return {
+        'get_by_id': per_op(lambda: games.get_by_id(id=game_id)),
+        'update': per_op(lambda: games.update(game)),
+        'hand update': per_op(lambda: hands.update(hand)),
+        'score lookup': per_op(lambda: scores.get_by_id(id=game_id)),
+        'avaliable_games': per_op(games.avaliable_games),
+    }
+
+
+def main():
+    results = {size: measure(size) for size in SIZES}
+    operations = list(results[SIZES[0]].keys())
+
+    print(f"{'games':>8} " + ' '.join(f'{op:>16}' for op in operations) + '  (ns/op)')
+    for size, timings in results.items():
+        print(f'{size:>8} ' + ' '.join(f'{timings[op]:>16.0f}' for op in operations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+""" Throughput of the headless simulator
+
+Usage (from the api folder):
+    python -m benchmarks.simulator_benchmark
+"""
+import random
+import time
+
+from engine.simulator import Simulator, RandomPolicy, GreedyPolicy
+
+GAMES = 2_000
+
+
+def main():
+    rng = random.Random(0)
+    for name, policies in [('greedy', [GreedyPolicy(), GreedyPolicy()]),
+                           ('random', [RandomPolicy(rng), RandomPolicy(rng)])]:
+        simulator = Simulator(policies=policies, rng=rng)
+        start = time.perf_counter()
+        hands = sum(len(simulator.play_game().hands) for _ in range(GAMES))
+        elapsed = time.perf_counter() - start
+        print(f'{name:>8}: {hands / elapsed * 60:>12,.0f} hands/min ({hands / GAMES:.1f} hands/game)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+""" Benchmark of the SQLite repositories
+
+Measures the writes of a playCard event that finishes a hand (hand update,
+score update, game update and the hand initialization) in a unit of work,
+that writes each object once in one transaction, against writing and
+committing every update on its own.
+
+Usage (from the api folder):
+    python -m benchmarks.sqlite_benchmark
+"""
+import os
+import tempfile
+import timeit
+
+from models.models import Game, Hand, Player, Score, Round
+from repositories.sqlite_repository import (
+        Database, SqliteGameRepository, SqliteHandRepository, SqliteScoreRepository
+)
+
+REPEAT = 2_000
+
+
+def setup(path: str):
+    database = Database(path)
+    games, hands, scores = SqliteGameRepository(database), SqliteHandRepository(database), SqliteScoreRepository(database)
+    players = [Player(), Player()]
+    game = Game(rules={'num_players': 2, 'max_score': 15, 'flor': False}, players=players, status='STARTED')
+    game.id = 'game'
+    games.save(game)
+    hand = Hand(id=game.id, rounds=[Round(cards_played={player.id: None for player in players})])
+    hands.save(hand)
+    score = Score(score={player.id: 0 for player in players})
+    score.id = game.id
+    scores.save(score)
+    return database, games, hands, scores, game, hand, score
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        database, games, hands, scores, game, hand, score = setup(os.path.join(directory, 'truco.db'))
+
+        def event():
+            hands.update(hand)
+            scores.update(score)
+            games.update(game)
+            hands.update(hand)
+
+        def event_in_unit_of_work():
+            with database.unit_of_work.begin():
+                event()
+
+        for name, stmt in [('commit per write', event), ('unit of work', event_in_unit_of_work)]:
+            seconds = min(timeit.repeat(stmt, number=REPEAT, repeat=3)) / REPEAT
+            print(f'{name:>20}: {seconds * 1e6:8.1f} µs/event')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+""" Runs batches of simulated games across processes.
+
+The games are split in one chunk per worker, and every worker plays its
+chunk with its own random generator seeded from the batch seed and the
+worker number. The statistics of the workers are merged in worker order,
+so a batch is reproducible for the same seed and number of workers.
+
+Usage (from the api folder):
+    python -m engine.batch --games 100000 --workers 8 --seed 1 --policies greedy random
+"""
+import argparse
+import json
+import random
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List
+
+from engine.simulator import Simulator, Policy, GameResult, RandomPolicy, GreedyPolicy
+
+# Las políticas se pasan por nombre a los workers, para no tener que serializarlas
+POLICIES: Dict[str, Callable[[random.Random], Policy]] = {
+    'random': lambda rng: RandomPolicy(rng),
+    'greedy': lambda rng: GreedyPolicy(),
+}
+
+
+@dataclass
+class BatchStats:
+    """ Statistics of a batch of simulated games """
+    games: int = 0
+    hands: int = 0
+    game_wins: List[int] = field(default_factory=lambda: [0, 0])
+    hand_wins: List[int] = field(default_factory=lambda: [0, 0])
+    mano_hand_wins: int = 0
+    envido_chanted: int = 0
+    envido_accepted: int = 0
+    envido_wins: List[int] = field(default_factory=lambda: [0, 0])
+    envido_points: int = 0
+    truco_levels: Dict[int, int] = field(default_factory=dict)  # Nivel final de truco -> manos
+    truco_declined: int = 0
+    game_lengths: Dict[int, int] = field(default_factory=dict)  # Manos por partida -> partidas
+
+    def add_game(self, result: GameResult) -> None:
+        self.games += 1
+        self.game_wins[result.winner] += 1
+        self.game_lengths[len(result.hands)] = self.game_lengths.get(len(result.hands), 0) + 1
+
+        for hand in result.hands:
+            self.hands += 1
+            if hand.winner is not None:
+                self.hand_wins[hand.winner] += 1
+                self.mano_hand_wins += hand.winner == hand.mano
+                self.truco_levels[hand.truco] = self.truco_levels.get(hand.truco, 0) + 1
+                self.truco_declined += hand.truco_declined
+            if hand.envido_chanted:
+                self.envido_chanted += 1
+                self.envido_accepted += hand.envido_accepted
+                self.envido_wins[hand.envido_winner] += 1
+                self.envido_points += hand.envido_points
+
+    def merge(self, other: 'BatchStats') -> None:
+        """ Adds the statistics of another batch """
+        self.games += other.games
+        self.hands += other.hands
+        self.mano_hand_wins += other.mano_hand_wins
+        self.envido_chanted += other.envido_chanted
+        self.envido_accepted += other.envido_accepted
+        self.envido_points += other.envido_points
+        self.truco_declined += other.truco_declined
+        for seat in range(2):
+            self.game_wins[seat] += other.game_wins[seat]
+            self.hand_wins[seat] += other.hand_wins[seat]
+            self.envido_wins[seat] += other.envido_wins[seat]
+        for level, count in other.truco_levels.items():
+            self.truco_levels[level] = self.truco_levels.get(level, 0) + count
+        for length, count in other.game_lengths.items():
+            self.game_lengths[length] = self.game_lengths.get(length, 0) + count
+
+    def summary(self) -> Dict:
+        """ The statistics with the rates already calculated """
+        finished_hands = sum(self.hand_wins)
+        return {
+            **asdict(self),
+            'truco_levels': dict(sorted(self.truco_levels.items())),
+            'game_lengths': dict(sorted(self.game_lengths.items())),
+            'game_win_rate': [wins / self.games for wins in self.game_wins] if self.games else None,
+            'hand_win_rate': [wins / finished_hands for wins in self.hand_wins] if finished_hands else None,
+            'mano_hand_win_rate': self.mano_hand_wins / finished_hands if finished_hands else None,
+            'envido_accept_rate': self.envido_accepted / self.envido_chanted if self.envido_chanted else None,
+            'truco_level_frequency': {level: count / finished_hands for level, count in sorted(self.truco_levels.items())}
+            if finished_hands else None,
+            'mean_game_length': self.hands / self.games if self.games else None,
+        }
+
+
+def worker_seed(seed: int, worker: int) -> str:
+    """ The seed of the random generator of a worker """
+    # Random con un str es determinístico (no depende de PYTHONHASHSEED)
+    return f'{seed}:{worker}'
+
+
+def run_chunk(games: int, seed: int, worker: int, policies: List[str], max_score: int) -> BatchStats:
+    """ Plays a chunk of games in a worker process """
+    rng = random.Random(worker_seed(seed, worker))
+    simulator = Simulator(policies=[POLICIES[name](rng) for name in policies], rng=rng, max_score=max_score)
+    stats = BatchStats()
+    for _ in range(games):
+        stats.add_game(simulator.play_game())
+    return stats
+
+
+def run_batch(games: int, workers: int, seed: int, policies: List[str], max_score: int = 15) -> BatchStats:
+    """ Plays the games splitted across worker processes and merges the statistics """
+    chunks = [games * (worker + 1) // workers - games * worker // workers for worker in range(workers)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_chunk, chunk, seed, worker, policies, max_score)
+                   for worker, chunk in enumerate(chunks)]
+        # Se combinan en el orden de los workers, no en el que terminan
+        results = [future.result() for future in futures]
+
+    stats = BatchStats()
+    for result in results:
+        stats.merge(result)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs simulated games of truco')
+    parser.add_argument('--games', type=int, default=10_000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-score', type=int, default=15)
+    parser.add_argument('--policies', nargs=2, default=['greedy', 'greedy'], choices=list(POLICIES))
+    args = parser.parse_args()
+
+    stats = run_batch(games=args.games, workers=args.workers, seed=args.seed,
+                      policies=args.policies, max_score=args.max_score)
+    print(json.dumps(stats.summary(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
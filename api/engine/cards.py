@@ -0,0 +1,81 @@
+""" Compact representation of the cards used by the game engine.
+
+A card is its index in the deck (0 to 39, see models.DECK), a set of cards
+is a bitmask of those indexes. The pydantic Card is only used at the API
+boundary, with to_card/to_index.
+"""
+from typing import Dict, Iterable, List, Tuple
+
+from models.models import Card, Rank, Suit, DECK, CARD_INDEX, SHARED_CARDS, TRUCO_VALUES, ENVIDO_VALUES, CARD_SUITS
+
+NUM_CARDS = len(DECK)
+NO_CARD = -1
+
+# Una instancia de Card por carta, se reutilizan en vez de crear nuevas
+CARDS: List[Card] = SHARED_CARDS
+
+VALUES = TRUCO_VALUES
+ENVIDO = ENVIDO_VALUES
+SUITS = CARD_SUITS
+
+
+def to_index(card: Card) -> int:
+    """ Returns the index of a pydantic Card """
+    return card._index
+
+
+def index_of(rank: str, suit: str) -> int:
+    """ Returns the index of the card with the rank and suit passed.
+
+    Raises:
+        ValueError: if the rank or suit are not valid
+    """
+    return CARD_INDEX[(Rank(rank), Suit(suit))]
+
+
+def to_card(index: int) -> Card:
+    """ Returns the pydantic Card of an index """
+    return CARDS[index]
+
+
+def to_mask(indexes: Iterable[int]) -> int:
+    """ Returns the bitmask of a set of card indexes """
+    mask = 0
+    for index in indexes:
+        mask |= 1 << index
+    return mask
+
+
+# Las manos tienen a lo sumo 3 cartas, así que hay pocas máscaras distintas
+_mask_cache: Dict[int, Tuple[int, ...]] = {}
+
+
+def from_mask(mask: int) -> Tuple[int, ...]:
+    """ Returns the card indexes of a bitmask, in increasing order """
+    indexes = _mask_cache.get(mask)
+    if indexes is None:
+        bits = []
+        remaining = mask
+        while remaining:
+            lowest = remaining & -remaining
+            bits.append(lowest.bit_length() - 1)
+            remaining ^= lowest
+        indexes = tuple(bits)
+        if len(indexes) <= 3:
+            _mask_cache[mask] = indexes
+    return indexes
+
+
+def best_envido_cards(cards: Iterable[int]) -> List[int]:
+    """ The cards to play for the best envido: the 2 best cards of the same
+    suit, or the highest card if all the suits are different
+    """
+    cards = list(cards)
+    best = [max(cards, key=ENVIDO.__getitem__)]
+    best_score = ENVIDO[best[0]]
+    for i in range(len(cards)):
+        for j in range(i + 1, len(cards)):
+            if SUITS[cards[i]] == SUITS[cards[j]] and 20 + ENVIDO[cards[i]] + ENVIDO[cards[j]] > best_score:
+                best = [cards[i], cards[j]]
+                best_score = 20 + ENVIDO[cards[i]] + ENVIDO[cards[j]]
+    return best
@@ -0,0 +1,133 @@
+""" Time budgeted Monte Carlo search over the unseen cards.
+
+A seat only knows its own cards, the cards on the table and the ones that
+the opponent showed in the envido. The search samples the rest of the cards
+of the opponent from the unseen cards (a determinization) and plays the hand
+until the end with a simple rollout policy, as many times as the time budget
+allows.
+
+The functions only use ints and picklable objects, so they can run in a
+process pool. The deadline is a time.monotonic() value, so a search that
+starts late (because the pool was busy) returns as soon as possible.
+"""
+import random
+import time
+
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from engine.cards import NUM_CARDS, VALUES, from_mask
+from engine.state import HandState
+from models.models import BEST_ENVIDO
+
+# Cantidad de simulaciones entre cada control del tiempo
+BATCH_SIZE = 16
+
+
+@dataclass
+class Observation:
+    """ What a seat knows of a hand. The opponent's cards in state only
+    include the ones known (shown in the envido and not played yet)
+    """
+    state: HandState
+    seat: int
+    unseen: Tuple[int, ...]  # Cartas que puede tener el rival
+    hidden: int  # Cantidad de cartas desconocidas que le quedan al rival
+
+
+def _played_by(state: HandState, seat: int) -> List[int]:
+    """ The cards already played by a seat """
+    return [card for card in state.played[seat::state.num_players] if card >= 0]
+
+
+def determinize(observation: Observation, rng: random.Random) -> HandState:
+    """ A copy of the state with the unknown cards of the opponent sampled """
+    state = observation.state.copy()
+    opponent = 1 - observation.seat
+    for card in rng.sample(observation.unseen, observation.hidden):
+        state.cards[opponent] |= 1 << card
+    return state
+
+
+def rollout_card(state: HandState, seat: int) -> int:
+    """ The card of the rollout policy: the lowest card that beats the card
+    on the table, or the highest card if the seat starts the round
+    """
+    cards = sorted(from_mask(state.cards[seat]), key=VALUES.__getitem__)
+    opponent = state.played[state.round * state.num_players + 1 - seat]
+    if opponent < 0:
+        return cards[-1]
+    for card in cards:
+        if VALUES[card] > VALUES[opponent]:
+            return card
+    return cards[0]
+
+
+def rollout(state: HandState) -> int:
+    """ Plays the hand until the end with the rollout policy, returns the winner """
+    while True:
+        seat = state.turn
+        if state.play(seat, rollout_card(state, seat)):
+            winner = state.winner()
+            if winner is not None:
+                return winner
+
+
+def best_card(observation: Observation, deadline: float, seed: int) -> int:
+    """ The card with more hands won in the simulations """
+    rng = random.Random(seed)
+    seat = observation.seat
+    candidates = from_mask(observation.state.cards[seat])
+    if len(candidates) == 1:
+        return candidates[0]
+
+    wins: Dict[int, int] = {card: 0 for card in candidates}
+    simulations = 0
+    while simulations == 0 or time.monotonic() < deadline:
+        for _ in range(BATCH_SIZE):
+            sampled = determinize(observation, rng)
+            # Todas las cartas se prueban contra las mismas cartas del rival
+            for card in candidates:
+                state = sampled.copy()
+                winner = state.winner() if state.play(seat, card) else None
+                wins[card] += (winner if winner is not None else rollout(state)) == seat
+            simulations += 1
+
+    # Ante un empate se guarda la carta más alta
+    return max(candidates, key=lambda card: (wins[card], -VALUES[card]))
+
+
+def hand_win_probability(observation: Observation, deadline: float, seed: int) -> float:
+    """ The probability of winning the hand from the current state """
+    rng = random.Random(seed)
+    wins = simulations = 0
+    while simulations == 0 or time.monotonic() < deadline:
+        for _ in range(BATCH_SIZE):
+            wins += rollout(determinize(observation, rng)) == observation.seat
+            simulations += 1
+    return wins / simulations
+
+
+def envido_win_probability(observation: Observation, deadline: float, seed: int) -> float:
+    """ The probability of winning the envido, with the best envido of each
+    seat and the mano winning the ties
+    """
+    rng = random.Random(seed)
+    seat, state = observation.seat, observation.state
+    mine = sorted(from_mask(state.cards[seat]) + tuple(_played_by(state, seat)))
+    envido = BEST_ENVIDO[mine[0] * 1600 + mine[1] * 40 + mine[2]]
+
+    wins = simulations = 0
+    while simulations == 0 or time.monotonic() < deadline:
+        for _ in range(BATCH_SIZE):
+            sampled = determinize(observation, rng)
+            a, b, c = sorted(from_mask(sampled.cards[1 - seat]) + tuple(_played_by(sampled, 1 - seat)))
+            opponent = BEST_ENVIDO[a * 1600 + b * 40 + c]
+            wins += envido > opponent or (envido == opponent and state.mano == seat)
+            simulations += 1
+    return wins / simulations
+
+
+def unseen_cards(known: int) -> Tuple[int, ...]:
+    """ The cards that are not in the bitmask of known cards """
+    return tuple(card for card in range(NUM_CARDS) if not known >> card & 1)
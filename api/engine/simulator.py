@@ -0,0 +1,328 @@
+""" Headless simulation of games of truco.
+
+Plays 2 players games in memory, without repositories nor sockets, using
+the compact engine state. The decisions of each player are taken by a
+Policy. The rules are the ones of HandManager, TrucoManager, EnvidoManager
+and ScoreManager, including who wins a declined chant (the player whose
+turn is to play a card) and the chant turn handling.
+"""
+import abc
+import random
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Union
+
+from engine.cards import NUM_CARDS, VALUES, from_mask
+from engine.state import HandState
+from models.models import BEST_ENVIDO, EnvidoLevels, Truco
+
+NUM_PLAYERS = 2
+MAX_ENVIDO_CHANTS = 4  # El server no tiene límite para envido-envido, se corta acá
+
+ACCEPT = 'ACCEPT'
+DECLINE = 'DECLINE'
+RAISE = 'RAISE'
+
+
+class Table:
+    """ What the players can see of a hand being simulated """
+    __slots__ = ('state', 'scores', 'max_score', 'dealt', 'envido', 'chant_turn',
+                 'truco', 'truco_pending', 'envido_chanted', 'envido_finished')
+
+    state: HandState
+    scores: List[int]
+    max_score: int
+    dealt: List[int]  # Bitmask de las cartas repartidas a cada jugador
+    envido: List[int]  # Mejor envido de cada jugador
+    chant_turn: int
+    truco: int  # Nivel de truco aceptado
+    truco_pending: int  # Nivel de truco cantado y todavía no respondido
+    envido_chanted: List[int]
+    envido_finished: bool
+
+    def __init__(self, dealt: List[int], mano: int, scores: List[int], max_score: int):
+        self.state = HandState(cards=dealt, mano=mano)
+        self.scores = scores
+        self.max_score = max_score
+        self.dealt = list(dealt)
+        self.envido = []
+        for mask in dealt:
+            a, b, c = from_mask(mask)
+            self.envido.append(BEST_ENVIDO[a * 1600 + b * 40 + c])
+        self.chant_turn = mano
+        self.truco = Truco.NO_CANTADO
+        self.truco_pending = Truco.NO_CANTADO
+        self.envido_chanted = []
+        self.envido_finished = False
+
+    def cards(self, seat: int) -> Tuple[int, ...]:
+        """ The cards that the seat has not played yet """
+        return from_mask(self.state.cards[seat])
+
+    def table_card(self, seat: int) -> Optional[int]:
+        """ The card played by the seat in the current round """
+        card = self.state.played[self.state.round * self.state.num_players + seat]
+        return card if card >= 0 else None
+
+    def envido_raises(self) -> List[EnvidoLevels]:
+        """ The envido levels that can be chanted as a response """
+        if len(self.envido_chanted) >= MAX_ENVIDO_CHANTS:
+            return []
+        last = self.envido_chanted[-1]
+        return [level for level in EnvidoLevels if last == EnvidoLevels.ENVIDO or level > last]
+
+
+class Policy(abc.ABC):
+    """ Takes the decisions of a player during a simulated hand """
+
+    def chant_envido(self, table: Table, seat: int) -> Optional[EnvidoLevels]:
+        """ The level of envido to chant, None to not chant """
+        return None
+
+    def respond_envido(self, table: Table, seat: int) -> Union[str, EnvidoLevels]:
+        """ ACCEPT, DECLINE or a level from table.envido_raises() """
+        return ACCEPT
+
+    def chant_truco(self, table: Table, seat: int) -> bool:
+        """ If the player chants the next level of truco """
+        return False
+
+    def respond_truco(self, table: Table, seat: int) -> str:
+        """ ACCEPT, DECLINE or RAISE (only if table.truco_pending < VALE_CUATRO) """
+        return ACCEPT
+
+    @abc.abstractmethod
+    def play_card(self, table: Table, seat: int) -> int:
+        """ The card to play, one of table.cards(seat) """
+        raise NotImplementedError
+
+
+class RandomPolicy(Policy):
+    """ Takes random legal decisions """
+    def __init__(self, rng: random.Random, chant_probability: float = 0.2):
+        self._rng = rng
+        self._chant_probability = chant_probability
+
+    def chant_envido(self, table: Table, seat: int) -> Optional[EnvidoLevels]:
+        if self._rng.random() < self._chant_probability:
+            return self._rng.choice(list(EnvidoLevels))
+        return None
+
+    def respond_envido(self, table: Table, seat: int) -> Union[str, EnvidoLevels]:
+        return self._rng.choice([ACCEPT, DECLINE] + table.envido_raises())
+
+    def chant_truco(self, table: Table, seat: int) -> bool:
+        return self._rng.random() < self._chant_probability
+
+    def respond_truco(self, table: Table, seat: int) -> str:
+        options = [ACCEPT, DECLINE] + ([RAISE] if table.truco_pending < Truco.VALE_CUATRO else [])
+        return self._rng.choice(options)
+
+    def play_card(self, table: Table, seat: int) -> int:
+        return self._rng.choice(table.cards(seat))
+
+
+class GreedyPolicy(Policy):
+    """ Simple heuristic player: chants with good cards and plays the lowest
+    card that wins the round
+    """
+    def chant_envido(self, table: Table, seat: int) -> Optional[EnvidoLevels]:
+        return EnvidoLevels.ENVIDO if table.envido[seat] >= 27 else None
+
+    def respond_envido(self, table: Table, seat: int) -> Union[str, EnvidoLevels]:
+        return ACCEPT if table.envido[seat] >= 26 else DECLINE
+
+    def chant_truco(self, table: Table, seat: int) -> bool:
+        return max(VALUES[card] for card in table.cards(seat)) >= 10
+
+    def respond_truco(self, table: Table, seat: int) -> str:
+        return ACCEPT if max((VALUES[card] for card in table.cards(seat)), default=-1) >= 9 else DECLINE
+
+    def play_card(self, table: Table, seat: int) -> int:
+        cards = sorted(table.cards(seat), key=VALUES.__getitem__)
+        opponent = table.table_card(1 - seat)
+        if opponent is None:
+            return cards[-1]
+        winning = [card for card in cards if VALUES[card] > VALUES[opponent]]
+        return winning[0] if winning else cards[0]
+
+
+@dataclass
+class HandResult:
+    """ The outcome of a simulated hand """
+    mano: int
+    dealt: List[int]
+    winner: Optional[int] = None  # None si la partida terminó con el envido
+    points: int = 0
+    truco: int = Truco.NO_CANTADO
+    truco_declined: bool = False
+    envido_chanted: List[int] = field(default_factory=list)
+    envido_accepted: bool = False
+    envido_winner: Optional[int] = None
+    envido_points: int = 0
+    actions: Optional[List[Tuple]] = None  # Acciones en el formato de los eventos del socket
+
+
+@dataclass
+class GameResult:
+    """ The outcome of a simulated game """
+    winner: int
+    scores: List[int]
+    hands: List[HandResult]
+
+
+class Simulator:
+    """ Plays games of truco between two policies """
+    def __init__(self, policies: List[Policy], rng: random.Random, max_score: int = 15, record: bool = False):
+        self.policies = policies
+        self.rng = rng
+        self.max_score = max_score
+        self.record = record  # Guarda las acciones de cada mano, para verificarlas contra los managers
+
+    def play_game(self) -> GameResult:
+        scores = [0] * NUM_PLAYERS
+        hands = []
+        while max(scores) < self.max_score:
+            hands.append(self.play_hand(scores))
+
+        winner = 0 if scores[0] >= self.max_score else 1
+        return GameResult(winner=winner, scores=scores, hands=hands)
+
+    def play_hand(self, scores: List[int]) -> HandResult:
+        """ Plays a hand, updating the scores passed """
+        rng = self.rng
+        # Igual que HandManager.initialize_hand y deal_cards
+        dealer = rng.choice(range(NUM_PLAYERS))
+        mano = 1 - dealer
+        deal = rng.sample(range(NUM_CARDS), NUM_PLAYERS * 3)
+        dealt = [0] * NUM_PLAYERS
+        for seat in range(NUM_PLAYERS):
+            for _ in range(3):
+                dealt[seat] |= 1 << deal.pop()
+
+        table = Table(dealt=dealt, mano=mano, scores=scores, max_score=self.max_score)
+        state = table.state
+        result = HandResult(mano=mano, dealt=table.dealt, actions=[] if self.record else None)
+
+        while True:
+            seat = state.turn
+            policy = self.policies[seat]
+
+            if state.round == 0 and not table.envido_finished and table.chant_turn == seat:
+                level = policy.chant_envido(table, seat)
+                if level is not None and self._envido(table, result, seat, level):
+                    return result
+
+            if table.truco < Truco.VALE_CUATRO and table.chant_turn == seat and policy.chant_truco(table, seat):
+                if self._truco(table, result, seat):
+                    break
+
+            card = policy.play_card(table, seat)
+            round_finished = state.play(seat, card)
+            table.chant_turn = state.turn
+            if result.actions is not None:
+                result.actions.append(('playCard', seat, card))
+
+            # Sólo puede haber ganador cuando termina una ronda
+            if round_finished:
+                winner = state.winner()
+                if winner is not None:
+                    result.winner = winner
+                    break
+
+        result.truco = table.truco
+        result.points = table.truco
+        scores[result.winner] += table.truco
+        return result
+
+    def _envido(self, table: Table, result: HandResult, seat: int, level: EnvidoLevels) -> bool:
+        """ Resolves an envido chanted by seat
+
+        Returns:
+            bool: True if the game finished with the envido points
+        """
+        actions = result.actions
+        chanted = table.envido_chanted
+        chanted.append(level)
+        table.chant_turn = 1 - seat
+        if actions is not None:
+            actions.append(('chantEnvido', seat, int(level)))
+
+        while True:
+            responder = table.chant_turn
+            response = self.policies[responder].respond_envido(table, responder)
+            table.chant_turn = 1 - responder
+
+            if response == ACCEPT:
+                if actions is not None:
+                    actions.append(('acceptEnvido', responder))
+                points = sum(chanted)
+                envidos = table.envido
+                if envidos[0] == envidos[1]:
+                    winner = table.state.mano
+                else:
+                    winner = 0 if envidos[0] > envidos[1] else 1
+                # Cada jugador canta su envido, y el turno de canto avanza con cada uno
+                if actions is not None:
+                    actions.append(('playEnvido', table.state.mano))
+                    actions.append(('playEnvido', 1 - table.state.mano))
+                result.envido_accepted = True
+                break
+            elif response == DECLINE:
+                if actions is not None:
+                    actions.append(('declineEnvido', responder))
+                points = sum(chanted[:-1]) + 1
+                # Como en EnvidoManager.decline_envido gana el que tiene el turno de tirar carta
+                winner = table.state.turn
+                break
+            elif response in table.envido_raises():
+                chanted.append(response)
+                if actions is not None:
+                    actions.append(('responseToEnvido', responder, int(response)))
+            else:
+                raise ValueError(f'Respuesta de envido inválida: {response}')
+
+        table.envido_finished = True
+        result.envido_chanted = [int(level) for level in chanted]
+        result.envido_winner = winner
+        result.envido_points = points
+        table.scores[winner] += points
+        return table.scores[winner] >= table.max_score
+
+    def _truco(self, table: Table, result: HandResult, seat: int) -> bool:
+        """ Resolves a truco chanted by seat
+
+        Returns:
+            bool: True if the truco was declined and the hand finished
+        """
+        actions = result.actions
+        table.truco_pending = table.truco + 1
+        table.chant_turn = 1 - seat
+        if actions is not None:
+            actions.append(('chantTruco', seat, table.truco_pending))
+
+        while True:
+            responder = table.chant_turn
+            response = self.policies[responder].respond_truco(table, responder)
+
+            if response == ACCEPT:
+                if actions is not None:
+                    actions.append(('responseToTruco', responder, table.truco_pending))
+                table.truco = table.truco_pending
+                table.chant_turn = 1 - responder
+                return False
+            elif response == DECLINE:
+                if actions is not None:
+                    actions.append(('responseToTruco', responder, table.truco_pending - 1))
+                table.truco = table.truco_pending - 1
+                # Como en TrucoManager.response_to_truco gana el que tiene el turno de tirar carta
+                result.winner = table.state.turn
+                result.truco_declined = True
+                return True
+            elif response == RAISE and table.truco_pending < Truco.VALE_CUATRO:
+                table.truco_pending += 1
+                table.chant_turn = 1 - responder
+                if actions is not None:
+                    actions.append(('responseToTruco', responder, table.truco_pending))
+            else:
+                raise ValueError(f'Respuesta de truco inválida: {response}')
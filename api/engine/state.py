@@ -0,0 +1,131 @@
+""" Compact state of a hand of truco for the game engine.
+
+Players are seats (0 to num_players - 1), the cards of each seat are a
+bitmask and the cards played are a fixed size array of 3 rounds. The rules
+are the same as Hand.check_winner and HandManager.play_card.
+"""
+from typing import List, Optional
+
+from engine.cards import NO_CARD, VALUES, to_index, to_mask
+from models.models import Hand
+
+MAX_ROUNDS = 3
+
+
+class HandState:
+    """ A hand of truco using only ints """
+    __slots__ = ('num_players', 'cards', 'played', 'round', 'turn', 'mano')
+
+    num_players: int
+    cards: List[int]  # Bitmask de las cartas que le quedan a cada jugador
+    played: List[int]  # Carta jugada por cada jugador en cada ronda: round * num_players + seat
+    round: int  # Ronda actual (0 a 2)
+    turn: int  # Jugador al que le toca tirar carta
+    mano: int  # Jugador que es mano
+
+    def __init__(self, cards: List[int], mano: int):
+        self.num_players = len(cards)
+        self.cards = list(cards)
+        self.played = [NO_CARD] * (MAX_ROUNDS * self.num_players)
+        self.round = 0
+        self.turn = mano
+        self.mano = mano
+
+    def copy(self) -> 'HandState':
+        state = HandState.__new__(HandState)
+        state.num_players = self.num_players
+        state.cards = list(self.cards)
+        state.played = list(self.played)
+        state.round = self.round
+        state.turn = self.turn
+        state.mano = self.mano
+        return state
+
+    def round_finished(self, round: int) -> bool:
+        start = round * self.num_players
+        return NO_CARD not in self.played[start:start + self.num_players]
+
+    def round_winners(self, round: int) -> Optional[List[int]]:
+        """ The seats that played the highest card in the round, None if not finished """
+        start = round * self.num_players
+        cards = self.played[start:start + self.num_players]
+        if NO_CARD in cards:
+            return None
+
+        highest = max(VALUES[card] for card in cards)
+        return [seat for seat, card in enumerate(cards) if VALUES[card] == highest]
+
+    def play(self, seat: int, card: int) -> bool:
+        """ Plays a card of the seat and advances the turn
+
+        Returns:
+            bool: True if the card finished the round
+
+        Raises:
+            ValueError: if it's not the turn of the seat or the seat doesn't have the card
+        """
+        if seat != self.turn:
+            raise ValueError('No es tu turno')
+        if not self.cards[seat] >> card & 1:
+            raise ValueError('No tienes ésa carta')
+
+        self.cards[seat] ^= 1 << card
+        self.played[self.round * self.num_players + seat] = card
+
+        winners = self.round_winners(self.round)
+        if winners is None:
+            self.turn = (seat + 1) % self.num_players
+            return False
+
+        # Empieza el que ganó la ronda, si es parda el último de la lista
+        self.turn = winners[-1]
+        if self.round < MAX_ROUNDS - 1:
+            self.round += 1
+        return True
+
+    def winner(self) -> Optional[int]:
+        """ The seat that won the hand, with the same rules as Hand.check_winner """
+        wins = [0] * self.num_players
+        rounds = 0
+        last_round_finished = False
+        for round in range(self.round + 1):
+            winners = self.round_winners(round)
+            rounds += 1
+            last_round_finished = winners is not None
+            if winners is None:
+                continue
+            for seat in winners:
+                wins[seat] += 1
+
+        winned_2_rounds = [seat for seat, count in enumerate(wins) if count == 2]
+        winned_3_rounds = [seat for seat, count in enumerate(wins) if count == 3]
+
+        if len(winned_2_rounds) == 1 and len(winned_3_rounds) == 0:
+            return winned_2_rounds[0]
+        elif len(winned_3_rounds) == 1:
+            return winned_3_rounds[0]
+        elif rounds == MAX_ROUNDS and last_round_finished:
+            return self.mano
+
+        return None
+
+
+def from_hand(hand: Hand, players: List[str]) -> HandState:
+    """ Builds the engine state of a pydantic Hand. The seats follow the order
+    of the players passed
+    """
+    seats = {player: seat for seat, player in enumerate(players)}
+    played_cards = {to_index(card) for round in hand.rounds for card in round.cards_played.values() if card}
+    cards = [to_mask(to_index(card) for card in hand.cards_dealed.get(player, [])
+                     if to_index(card) not in played_cards)
+             for player in players]
+
+    state = HandState(cards=cards, mano=seats[hand.player_hand])
+    for round, round_played in enumerate(hand.rounds):
+        for player, card in round_played.cards_played.items():
+            if card is not None:
+                state.played[round * state.num_players + seats[player]] = to_index(card)
+    state.round = max(len(hand.rounds) - 1, 0)
+    if hand.player_turn is not None:
+        state.turn = seats[hand.player_turn]
+    return state
@@ -0,0 +1,175 @@
+""" Precomputed strength of every 3 cards hand.
+
+For the C(40, 3) = 9880 possible hands there are arrays with the cards, the
+best envido, the truco values sorted from highest to lowest and the equity
+against a uniformly random opponent hand (made of the other 37 cards).
+
+Hands are identified by their combinatorial index (see hand_index), so a
+lookup is a single array access. The tables are computed with NumPy and
+saved to a .npz file, that is loaded on the next runs.
+
+The equity assumes that both players play their cards from the highest to
+the lowest, and the winner of the hand is decided round by round with the
+rules of Hand.check_winner: the hand is over as soon as a player won 2
+rounds, a tied round counts for both players and the mano wins if the third
+round doesn't define a winner. It's the mean of the equity being mano and not
+being mano, with the hands decided by the mano counted as half a win.
+
+Usage (from the api folder), to build the cache file:
+    python -m engine.strength
+"""
+import os
+
+from itertools import combinations
+from math import comb
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from engine.cards import NUM_CARDS, VALUES, ENVIDO, SUITS
+
+HAND_SIZE = 3
+NUM_HANDS = comb(NUM_CARDS, HAND_SIZE)
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'strength.npz')
+
+# Cantidad de manos propias que se comparan a la vez contra todas las del rival
+CHUNK_SIZE = 256
+
+
+def hand_index(cards: Iterable[int]) -> int:
+    """ The combinatorial index of a hand of 3 different card indexes, in any order """
+    a, b, c = sorted(cards)
+    return a + b * (b - 1) // 2 + c * (c - 1) * (c - 2) // 6
+
+
+def hand_indexes(cards: np.ndarray) -> np.ndarray:
+    """ The combinatorial indexes of an array of hands of shape (n, 3) """
+    cards = np.sort(np.asarray(cards, dtype=np.int64), axis=1)
+    a, b, c = cards[:, 0], cards[:, 1], cards[:, 2]
+    return a + b * (b - 1) // 2 + c * (c - 1) * (c - 2) // 6
+
+
+def hand_cards() -> np.ndarray:
+    """ The cards of every hand, in increasing order, indexed by hand_index """
+    hands = np.array(list(combinations(range(NUM_CARDS), HAND_SIZE)), dtype=np.int8)
+    cards = np.empty_like(hands)
+    cards[hand_indexes(hands)] = hands
+    return cards
+
+
+def best_envido(cards: np.ndarray) -> np.ndarray:
+    """ The best envido of each hand of an array of shape (n, 3) """
+    envido = np.asarray(ENVIDO, dtype=np.int8)[cards]
+    suits = np.asarray(SUITS, dtype=np.int8)[cards]
+
+    best = envido.max(axis=1)
+    for i, j in combinations(range(HAND_SIZE), 2):
+        same_suit = np.where(suits[:, i] == suits[:, j], 20 + envido[:, i] + envido[:, j], 0)
+        best = np.maximum(best, same_suit)
+    return best.astype(np.int8)
+
+
+def sorted_truco_values(cards: np.ndarray) -> np.ndarray:
+    """ The truco values of each hand of an array of shape (n, 3), from highest to lowest """
+    values = np.asarray(VALUES, dtype=np.int8)[cards]
+    return np.sort(values, axis=-1)[..., ::-1]
+
+
+def outcomes(mine: np.ndarray, theirs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Compares hands round by round, with the cards of each round in the last axis.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: if the first hand wins and if the second
+                                       hand wins. When both are False the
+                                       mano wins the hand
+    """
+    mine = mine.astype(np.int16)
+    theirs = theirs.astype(np.int16)
+    # Una ronda parda cuenta como ganada para los dos
+    mine_rounds = mine >= theirs
+    theirs_rounds = mine <= theirs
+
+    mine_two = mine_rounds[..., 0].astype(np.int8) + mine_rounds[..., 1]
+    theirs_two = theirs_rounds[..., 0].astype(np.int8) + theirs_rounds[..., 1]
+    # Con 2 rondas ganadas por uno solo se termina la mano
+    mine_wins = (mine_two == 2) & (theirs_two < 2)
+    theirs_wins = (theirs_two == 2) & (mine_two < 2)
+
+    mine_three = mine_two + mine_rounds[..., 2]
+    theirs_three = theirs_two + theirs_rounds[..., 2]
+    undecided = ~(mine_wins | theirs_wins)
+    mine_wins |= undecided & (((mine_three == 3) & (theirs_three < 3)) | ((mine_three == 2) & (theirs_three < 2)))
+    theirs_wins |= undecided & (((theirs_three == 3) & (mine_three < 3)) | ((theirs_three == 2) & (mine_three < 2)))
+    return mine_wins, theirs_wins
+
+
+class HandStrength:
+    """ The strength tables of all the hands, indexed by hand_index """
+    cards: np.ndarray  # (NUM_HANDS, 3) índices de las cartas
+    envido: np.ndarray  # (NUM_HANDS,) mejor envido
+    truco: np.ndarray  # (NUM_HANDS, 3) valores de truco de mayor a menor
+    equity_mano: np.ndarray  # (NUM_HANDS,) siendo mano
+    equity_pie: np.ndarray  # (NUM_HANDS,) sin ser mano
+    equity: np.ndarray  # (NUM_HANDS,) promedio de las dos
+
+    def __init__(self, cards: np.ndarray, envido: np.ndarray, truco: np.ndarray,
+                 equity_mano: np.ndarray, equity_pie: np.ndarray):
+        self.cards = cards
+        self.envido = envido
+        self.truco = truco
+        self.equity_mano = equity_mano
+        self.equity_pie = equity_pie
+        self.equity = (equity_mano + equity_pie) / 2
+
+    def save(self, path: str = DEFAULT_PATH) -> None:
+        # Se escribe en otro archivo y se reemplaza, para no dejar uno a medias
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, cards=self.cards, envido=self.envido, truco=self.truco,
+                     equity_mano=self.equity_mano, equity_pie=self.equity_pie)
+        os.replace(tmp_path, path)
+
+
+def compute(chunk_size: int = CHUNK_SIZE) -> HandStrength:
+    """ Computes the strength tables of all the hands """
+    cards = hand_cards()
+    truco = sorted_truco_values(cards)
+    masks = (np.uint64(1) << cards.astype(np.uint64)).sum(axis=1, dtype=np.uint64)
+
+    wins = np.zeros(NUM_HANDS, dtype=np.int64)
+    losses = np.zeros(NUM_HANDS, dtype=np.int64)
+    for start in range(0, NUM_HANDS, chunk_size):
+        end = min(start + chunk_size, NUM_HANDS)
+        # Sólo cuentan las manos del rival que no comparten cartas
+        valid = (masks[start:end, None] & masks[None, :]) == 0
+        mine_wins, theirs_wins = outcomes(truco[start:end, None, :], truco[None, :, :])
+        wins[start:end] = (mine_wins & valid).sum(axis=1)
+        losses[start:end] = (theirs_wins & valid).sum(axis=1)
+
+    opponents = comb(NUM_CARDS - HAND_SIZE, HAND_SIZE)
+    ties = opponents - wins - losses
+    return HandStrength(
+        cards=cards,
+        envido=best_envido(cards),
+        truco=truco,
+        equity_mano=(wins + ties) / opponents,
+        equity_pie=wins / opponents,
+    )
+
+
+def load(path: Optional[str] = DEFAULT_PATH) -> HandStrength:
+    """ Loads the strength tables, computing and saving them if there is no file.
+    With path None they are always computed
+    """
+    if path is not None and os.path.exists(path):
+        with np.load(path) as tables:
+            return HandStrength(**{name: tables[name] for name in tables.files})
+
+    strength = compute()
+    if path is not None:
+        strength.save(path)
+    return strength
+
+
+if __name__ == '__main__':
+    compute().save()
@@ -0,0 +1,113 @@
+""" The events that the clients can send to the SocketController.
+
+Every event is registered with the schema of its payload, and the payload
+is validated against it before the event touches any manager: an event that
+is not in the table, or whose payload doesn't match (missing fields, wrong
+types, unknown fields), is rejected right away. The methods used to notify
+the players (handUpdate, gameUpdate, ...) are not registered, so a client
+can't call them.
+"""
+from typing import Callable, Dict, List, Optional, Tuple, Type
+from pydantic import BaseModel, Extra, ValidationError
+from models.models import Card, Rank, Suit
+from services.exceptions import GameException
+
+
+class EventPayload(BaseModel):
+    """ Base schema of the payloads, the fields not declared are rejected """
+    class Config:
+        extra = Extra.forbid
+
+
+class PlayerPayload(EventPayload):
+    playerId: str
+
+
+class GamePayload(PlayerPayload):
+    gameId: str
+
+
+class HandPayload(PlayerPayload):
+    handId: str
+
+
+class MessagePayload(PlayerPayload):
+    message: str
+
+
+class SyncHandPayload(HandPayload):
+    revision: Optional[int] = None
+
+
+class CardPayload(HandPayload):
+    rank: Rank
+    suit: Suit
+
+
+class LevelPayload(HandPayload):
+    level: int
+
+
+class EnvidoCardsPayload(HandPayload):
+    cards: List[Card]
+
+
+class EventCost:
+    """ What an event costed the server since it started """
+    calls: int  # Veces que se ejecutó
+    rejected: int  # Veces que se rechazó por su payload
+    errors: int  # Veces que falló al ejecutarse
+    seconds: float  # Tiempo total de ejecución, sin la espera del lock
+
+    def __init__(self):
+        self.calls = 0
+        self.rejected = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def dict(self) -> Dict:
+        return {'calls': self.calls, 'rejected': self.rejected, 'errors': self.errors, 'seconds': self.seconds}
+
+
+class EventTable:
+    """ Registry of the events, by name, with the schema of their payload """
+    _events: Dict[str, Tuple[Type[EventPayload], Callable]]
+
+    def __init__(self):
+        self._events = {}
+
+    def register(self, schema: Type[EventPayload]) -> Callable[[Callable], Callable]:
+        """ Decorator that registers a method as the event of the same name """
+        def decorator(method: Callable) -> Callable:
+            self._events[method.__name__] = (schema, method)
+            return method
+        return decorator
+
+    def names(self) -> List[str]:
+        return list(self._events)
+
+    def parse(self, event: str, payload) -> Tuple[Callable, Dict]:
+        """ Validates an event sent by a client.
+
+        Returns:
+            Tuple[Callable, Dict]: the method of the event and its arguments
+
+        Raises:
+            GameException: if the event doesn't exist or its payload is malformed
+        """
+        registered = self._events.get(event) if isinstance(event, str) else None
+        if registered is None:
+            raise GameException('Evento desconocido')
+        schema, method = registered
+        if not isinstance(payload, dict):
+            raise GameException('Evento inválido')
+        try:
+            arguments = schema.parse_obj(payload)
+        except ValidationError as e:
+            fields = ', '.join('.'.join(str(part) for part in error['loc']) for error in e.errors())
+            raise GameException(f'Evento inválido: {fields}')
+        return method, arguments.dict()
+
+
+# Los eventos que pueden enviar los clientes, los registra SocketController
+client_events = EventTable()
@@ -0,0 +1,140 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _escape(key: str) -> str:
+    """ Escapes a key to be used in a json pointer """
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def diff(old: Any, new: Any, path: str = '') -> List[Dict]:
+    """ Returns the JSON-patch (RFC 6902) operations to go from old to new.
+    Only 'add', 'remove' and 'replace' operations are used.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        operations = []
+        for key in old:
+            if key not in new:
+                operations.append({'op': 'remove', 'path': f'{path}/{_escape(key)}'})
+        for key, value in new.items():
+            if key not in old:
+                operations.append({'op': 'add', 'path': f'{path}/{_escape(key)}', 'value': value})
+            else:
+                operations += diff(old[key], value, f'{path}/{_escape(key)}')
+        return operations
+
+    if isinstance(old, list) and isinstance(new, list):
+        common = min(len(old), len(new))
+        operations = []
+        for i in range(common):
+            operations += diff(old[i], new[i], f'{path}/{i}')
+        for i in range(common, len(new)):
+            operations.append({'op': 'add', 'path': f'{path}/{i}', 'value': new[i]})
+        # Se borra desde el final para que no cambien los índices
+        for i in reversed(range(common, len(old))):
+            operations.append({'op': 'remove', 'path': f'{path}/{i}'})
+        return operations
+
+    if old != new or type(old) != type(new):
+        return [{'op': 'replace', 'path': path, 'value': new}]
+
+    return []
+
+
+class HandSync:
+    """ Versioned state sync of hands.
+
+    Each hand has a revision that is increased on every update. For the
+    players that subscribed to the sync mode, the last states sent are kept,
+    so the next updates are sent as patches against the revision that the
+    player has. When the revision of the player is unknown (reconnection or
+    mismatch) a full snapshot is sent instead.
+
+    The patches assume that every message reaches the player. The connections
+    never discard them (see SlowConsumerPolicy): a player that can't keep up
+    is disconnected and unsubscribed, so it gets a snapshot when it resumes.
+    """
+    _revisions: Dict[str, int]  # hand_id -> revisión actual
+    _history: Dict[str, Tuple[str, Dict[int, Dict]]]  # player_id -> (hand_id, {revisión: estado})
+    history_size: int
+
+    def __init__(self, history_size: int = 8):
+        self._revisions = {}
+        self._history = {}
+        self.history_size = history_size
+
+    def is_subscribed(self, player_id: str) -> bool:
+        return player_id in self._history
+
+    def subscribe(self, player_id: str, hand_id: str, revision: Optional[int]) -> Optional[int]:
+        """ Subscribes the player to the patches of a hand.
+
+        Returns:
+            Optional[int]: the revision to use as base of the next message, or
+                           None if a snapshot has to be sent
+        """
+        hand, states = self._history.get(player_id, (hand_id, {}))
+        if hand != hand_id or revision not in states:
+            states = {}
+
+        # Se descartan las revisiones que el jugador ya no tiene
+        self._history[player_id] = (hand_id, {rev: state for rev, state in states.items() if rev == revision})
+        return revision if states else None
+
+    def unsubscribe(self, player_id: str) -> None:
+        self._history.pop(player_id, None)
+
+    def forget_hand(self, hand_id: str) -> None:
+        self._revisions.pop(hand_id, None)
+
+    def revision(self, hand_id: str) -> int:
+        return self._revisions.get(hand_id, 0)
+
+    def next_revision(self, hand_id: str) -> int:
+        """ Increases the revision of the hand """
+        self._revisions[hand_id] = self.revision(hand_id) + 1
+        return self._revisions[hand_id]
+
+    def message(self, player_id: str, hand_id: str, state: Dict, base: Optional[int] = None) -> str:
+        """ Returns the message to sync the state of the hand of a subscribed player.
+
+        By default the patch is made against the last revision sent to the player.
+        """
+        return self.frame(player_id=player_id, hand_id=hand_id, state=state, base=base)[1]
+
+    def frame(self, player_id: str, hand_id: str, state: Dict, base: Optional[int] = None) -> Tuple[str, str]:
+        """ Like message, with the event of the message: handPatch or handSnapshot """
+        revision = self.revision(hand_id)
+        hand, states = self._history[player_id]
+
+        if hand != hand_id:
+            # El jugador pasó a otra partida
+            states = {}
+            self._history[player_id] = (hand_id, states)
+
+        if base is None and states:
+            base = max(states)
+
+        if base in states:
+            event = 'handPatch'
+            message = json.dumps({
+                'event': event,
+                'payload': {
+                    'handId': hand_id,
+                    'base': base,
+                    'revision': revision,
+                    'ops': diff(states[base], state)
+                    }
+                })
+        else:
+            event = 'handSnapshot'
+            message = json.dumps({
+                'event': event,
+                'payload': {'handId': hand_id, 'revision': revision, 'hand': state}
+                })
+
+        states[revision] = state
+        for old_revision in sorted(states)[:-self.history_size]:
+            del states[old_revision]
+
+        return event, message
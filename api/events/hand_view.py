@@ -0,0 +1,60 @@
+import json
+from typing import Dict, List, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from models.models import Hand, Card, HandStatus, Suit, Rank
+
+
+# Fragmentos JSON de cada carta, se codifican una sola vez
+_card_fragments: Dict[Tuple[Suit, Rank], str] = {}
+
+
+def _encode_cards(cards: List[Card]) -> str:
+    """ Encodes a list of cards reusing the fragment of each card """
+    fragments = []
+    for card in cards:
+        key = (card.suit, card.rank)
+        if key not in _card_fragments:
+            _card_fragments[key] = json.dumps(jsonable_encoder(card))
+        fragments.append(_card_fragments[key])
+
+    return '[' + ', '.join(fragments) + ']'
+
+
+class HandView:
+    """ The handUpdated message of a hand.
+
+    The part of the hand that is shared by all the players is encoded only
+    once, and for each player only the cards dealed to that player are spliced in
+    the message.
+    """
+    _head: str
+    _tail: str
+    _hand_status: Dict
+    _cards_dealed: Dict[str, List[Card]]
+
+    def __init__(self, hand: Hand):
+        hand_status = jsonable_encoder(hand, exclude={'cards_dealed'})
+        hand_status['winner'] = hand.check_winner
+
+        # Se respeta el orden de los campos del modelo, cards_dealed va en el medio
+        fields = list(hand.__fields__.keys())
+        split = fields.index('cards_dealed')
+        head = {field: hand_status[field] for field in fields[:split]}
+        tail = {field: hand_status[field] for field in fields[split + 1:]}
+        self._hand_status = {**head, 'cards_dealed': None, **tail}
+
+        self._head = '{"event": "handUpdated", "payload": {"hand": ' + json.dumps(head)[:-1]
+        self._tail = json.dumps(tail)[1:] + '}}'
+        self._cards_dealed = hand.cards_dealed if hand.status != HandStatus.NOT_STARTED else {}
+
+    def message(self, player_id: str) -> str:
+        """ Returns the serialized message for the passed player """
+        cards = _encode_cards(self._cards_dealed.get(player_id, []))
+        return f'{self._head}, "cards_dealed": {cards}, {self._tail}'
+
+    def state(self, player_id: str) -> Dict:
+        """ Returns the hand as seen by the passed player, as a json compatible dict """
+        state = dict(self._hand_status)
+        state['cards_dealed'] = jsonable_encoder(self._cards_dealed.get(player_id, []))
+        return state
@@ -1,15 +1,44 @@
 import json
+import time
 from datetime import datetime
-from typing import Dict, List
+from typing import TYPE_CHECKING, Callable, ContextManager, Dict, List, Optional, Tuple
 from fastapi.encoders import jsonable_encoder
 from models.models import Hand, Player, Score, Card, Game, EnvidoLevels, EnvidoStatus, Truco
-from services.connection_manager import ConnectionManager, dep_connection_manager
+from services.connection_manager import ConnectionManager, dep_connection_manager, game_room
 from services.game_manager import GameManager
 from services.hand_manager import HandManager
 from services.player_manager import PlayerManager
 from services.score_manager import ScoreManager
 from services.truco_manager import TrucoManager
 from services.envido_manager import EnvidoManager
+from services.lock_manager import GameLockManager, dep_lock_manager
+from services.bot_manager import BotManager, dep_bot_manager
+from services.reaper import GameReaper, dep_reaper
+from services.exceptions import GameException
+from services.metrics import dep_metrics
+from repositories.repository import dep_unit_of_work
+from events.hand_view import HandView
+from events.hand_sync import HandSync
+from events.event_table import (
+        client_events, EventCost, PlayerPayload, GamePayload, HandPayload, MessagePayload,
+        SyncHandPayload, CardPayload, LevelPayload, EnvidoCardsPayload
+)
+
+if TYPE_CHECKING:
+    from services.cluster import Cluster
+
+EVENT_SECONDS = dep_metrics().histogram(
+        'truco_event_seconds', 'Time handling the events of the clients, without the wait for the game lock', ('event',))
+SERIALIZATION_SECONDS = dep_metrics().histogram(
+        'truco_serialization_seconds', 'Time encoding the messages sent to the players', ('message',))
+
+
+def game_id_of(payload: Dict) -> Optional[str]:
+    """ Returns the id of the game that an event payload refers to, if any """
+    for key in ('gameId', 'handId', 'hand_id'):
+        if payload.get(key) is not None:
+            return payload[key]
+    return None
 
 
 class SocketController:
@@ -21,6 +50,14 @@ class SocketController:
     _score_manager: ScoreManager
     _truco_manager: TrucoManager
     _envido_manager: EnvidoManager
+    _lobby_cache: Optional[Tuple[Tuple, str]]  # (revisión, mensaje serializado)
+    _hand_sync: HandSync
+    _lock_manager: GameLockManager
+    _bot_manager: BotManager
+    _unit_of_work: Callable[[], ContextManager]
+    _reaper: GameReaper
+    event_costs: Dict[str, EventCost]  # Costo acumulado de cada evento de los clientes
+    cluster: Optional['Cluster'] = None  # En modo multi worker, rutea los eventos al dueño de la partida
 
     def __init__(
             self,
@@ -30,7 +67,12 @@ class SocketController:
             player_manager: PlayerManager = PlayerManager(),
             score_manager: ScoreManager = ScoreManager(),
             truco_manager: TrucoManager = TrucoManager(),
-            envido_manager: EnvidoManager = EnvidoManager()
+            envido_manager: EnvidoManager = EnvidoManager(),
+            hand_sync: HandSync = None,
+            lock_manager: GameLockManager = dep_lock_manager(),
+            bot_manager: BotManager = dep_bot_manager(),
+            unit_of_work: Callable[[], ContextManager] = dep_unit_of_work(),
+            reaper: GameReaper = dep_reaper()
             ):
         self._connection_manager = connection_manager
         self._game_manager = game_manager
@@ -39,14 +81,63 @@ class SocketController:
         self._score_manager = score_manager
         self._truco_manager = truco_manager
         self._envido_manager = envido_manager
+        self._lobby_cache = None
+        self._hand_sync = hand_sync if hand_sync is not None else HandSync()
+        self._lock_manager = lock_manager
+        self._bot_manager = bot_manager
+        self._unit_of_work = unit_of_work
+        self._reaper = reaper
+        self.event_costs = {event: EventCost() for event in client_events.names()}
 
     async def call_event(self, event: str, payload: Dict):
-        # Calls the method name by the event string passed as argument
-        if hasattr(self, event) and callable(func := getattr(self, event)):
-            await func(**payload)
-        else:
-            raise Exception('Method not exists')
+        """ Runs an event sent by a client.
+
+        Only the events registered in the event table can be called, and
+        their payload is validated against its schema before anything else,
+        so a malformed event doesn't wait for the lock nor reach the managers.
 
+        Raises:
+            GameException: if the event doesn't exist or its payload is malformed
+        """
+        try:
+            method, arguments = client_events.parse(event, payload)
+        except GameException:
+            if event in self.event_costs:
+                self.event_costs[event].rejected += 1
+            raise
+
+        game_id = game_id_of(arguments)
+        if self.cluster is not None:
+            if not self.cluster.is_local(game_id):
+                self.cluster.forward(event=event, payload=arguments, game_id=game_id)
+                return
+            # La partida puede estar migrando a este worker, ie. si el jugador está conectado acá
+            await self.cluster.wait_for_game(game_id)
+
+        self._reaper.touch(game_id)
+        # Los eventos de una misma partida se ejecutan de a uno
+        async with self._lock_manager.lock(game_id):
+            # La partida pudo migrar a otro worker mientras se esperaba el lock
+            if self.cluster is not None and not self.cluster.is_local(game_id):
+                self.cluster.forward(event=event, payload=arguments, game_id=game_id)
+                return
+
+            cost = self.event_costs[event]
+            start = time.perf_counter()
+            try:
+                # Cada objeto modificado en el evento se escribe una sola vez, al final
+                with self._unit_of_work():
+                    await method(self, **arguments)
+            except Exception:
+                cost.errors += 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                cost.calls += 1
+                cost.seconds += elapsed
+                EVENT_SECONDS.observe(elapsed, event)
+
+    @client_events.register(MessagePayload)
     async def message(self, playerId: str, message: str):
         """ Receives a message from a player and re sends it to all connected users
 
@@ -65,8 +156,9 @@ class SocketController:
                 }
             }
         })
-        await self._connection_manager.broadcast(json_string=data)
+        await self._connection_manager.broadcast(json_string=data, event='message')
 
+    @client_events.register(PlayerPayload)
     async def gamesUpdate(self, playerId: str = None):
         """ Sends an update of the current games avaliables in the server.
 
@@ -76,21 +168,54 @@ class SocketController:
         Args:
             playerId (str): the id of the player to send the update status of games.
         """
-        games_list = [game.dict(include={'id', 'name', 'players'})
-                      for game in self._game_manager.get_available_games()]
-        for game in games_list:
-            game['currentPlayers'] = len(game['players'])
-            del game['players']
-
-        message = json.dumps({
-                'event': 'gamesUpdate',
-                'payload': {'gamesList': games_list}
-        })
+        message = self._lobby_message()
 
         if playerId is not None:
-            await self._connection_manager.send(json_string=message, player_id=playerId)
+            await self._connection_manager.send(json_string=message, player_id=playerId, event='gamesUpdate')
         else:
-            await self._connection_manager.broadcast(json_string=message)
+            if self.cluster is not None:
+                self.cluster.announce_games(self.local_games())
+            await self._connection_manager.broadcast(json_string=message, event='gamesUpdate')
+
+    def _lobby_message(self) -> str:
+        """ Returns the serialized gamesUpdate message. It's only rebuilt when
+        the available games have changed since the last call
+        """
+        revision = (self._game_manager.get_available_games_revision(),
+                    self.cluster.games_revision if self.cluster is not None else 0)
+        if self._lobby_cache is not None and self._lobby_cache[0] == revision:
+            return self._lobby_cache[1]
+
+        with SERIALIZATION_SECONDS.time('gamesUpdate'):
+            games_list = self.local_games()
+            if self.cluster is not None:
+                games_list += self.cluster.remote_games()
+            message = json.dumps({
+                    'event': 'gamesUpdate',
+                    'payload': {'gamesList': games_list}
+            })
+        self._lobby_cache = (revision, message)
+        return message
+
+    def local_games(self) -> List[Dict]:
+        """ The available games of this server, as listed in the lobby """
+        return [{'id': game.id, 'name': game.name, 'currentPlayers': len(game.players)}
+                for game in self._game_manager.get_available_games()]
+
+    async def notifyPlayer(self, playerId: str, title: str, text: str, type: str):
+        """ Notifies a message to a single player, ie. the error of its last event
+
+        Args:
+            playerId (str): the id of the player to notify
+            title (str): the title of the message to be sent
+            text (str): the body of the message to be sent
+            type (str): type of the message (only 'INFO', 'ERROR')
+        """
+        message = json.dumps({
+                'event': 'notify',
+                'payload': {'type': type, 'title': title, 'text': text}
+        })
+        await self._connection_manager.send(json_string=message, player_id=playerId, event='notify')
 
     async def notifyPlayers(self, gameId: str, title: str, text: str, type: str):
         """ Notifies a message to all players in the game
@@ -101,14 +226,11 @@ class SocketController:
             message (str): the body of the message to be sent
             type (str): type of the message (only 'INFO', 'ERROR')
         """
-        game: Game = self._game_manager.get_game(id=gameId)
-
         message = json.dumps({
                 'event': 'notify',
                 'payload': {'type': type, 'title': title, 'text': text}
         })
-        for player in game.players:
-            await self._connection_manager.send(json_string=message, player_id=player.id)
+        await self._connection_manager.publish(room=game_room(gameId), json_string=message, event='notify')
 
     async def gameUpdate(self, gameId: str):
         """ Updates the game status to all players that joined that game
@@ -117,14 +239,15 @@ class SocketController:
             gameId (str): the id of the game to be updated to players
         """
         game: Game = self._game_manager.get_game(id=gameId)
+        await self._connection_manager.publish(room=game_room(gameId), json_string=self._game_message(game),
+                                               event='gameUpdate')
 
-        message = json.dumps({
-                'event': 'gameUpdate',
-                'payload': {'game': jsonable_encoder(game.dict(exclude={'current_hand'}))}
-        })
-
-        for player in game.players:
-            await self._connection_manager.send(json_string=message, player_id=player.id)
+    def _game_message(self, game: Game) -> str:
+        with SERIALIZATION_SECONDS.time('gameUpdate'):
+            return json.dumps({
+                    'event': 'gameUpdate',
+                    'payload': {'game': jsonable_encoder(game.dict(exclude={'current_hand'}))}
+            })
 
     async def handUpdate(self, hand_id: int):
         """ Updates the hand status to all players playing the hand
@@ -135,21 +258,88 @@ class SocketController:
         hand: Hand = self._hand_manager.get_hand(id=hand_id)
         players: List[Player] = self._game_manager.get_game(id=hand.id).players
 
-        for player in players:
-            hand_status = jsonable_encoder(hand)
-            # Manda sólo las cartas del jugador corriente
-            hand_status['cards_dealed'] = jsonable_encoder(hand.cards_dealed[player.id]) if hand.status != 'NOT_STARTED' else []
-            hand_status['winner'] = hand.check_winner
+        self._hand_sync.next_revision(hand_id=hand.id)
+        messages = {}
+        with SERIALIZATION_SECONDS.time('handUpdated'):
+            view = HandView(hand)
+            for player in players:
+                # Los jugadores suscriptos a syncHand reciben sólo los cambios
+                if self._hand_sync.is_subscribed(player.id):
+                    messages[player.id] = self._hand_sync.frame(player_id=player.id, hand_id=hand.id,
+                                                                state=view.state(player.id))
+                else:
+                    messages[player.id] = ('handUpdated', view.message(player.id))
+
+        for player_id, (event, message) in messages.items():
+            await self._connection_manager.send(json_string=message, player_id=player_id, event=event)
+
+    @client_events.register(SyncHandPayload)
+    async def syncHand(self, playerId: str, handId: str, revision: int = None):
+        """ Subscribes a player to the versioned updates of a hand
+
+        From now on the player receives 'handPatch' messages with the changes
+        since the last revision instead of the full hand. If the revision
+        passed is not the last known by the server a 'handSnapshot' with the
+        full hand is sent first.
 
-            data = json.dumps({
-                "event": "handUpdated",
-                "payload": {
-                    "hand": hand_status
-                    }
-                })
+        Args:
+            playerId (str): id of the player subscribing.
+            handId (str): id of the hand.
+            revision (int): last revision of the hand the player has, if any.
+        """
+        hand: Hand = self._hand_manager.get_hand(id=handId)
+        if hand is None:
+            raise GameException('La mano no existe')
+        # Sólo los jugadores de la partida ven la mano, como en resumeGame
+        game = self._game_manager.get_game(id=handId)
+        if game is None or all(player.id != playerId for player in game.players):
+            raise GameException('La mano no existe')
+        base = self._hand_sync.subscribe(player_id=playerId, hand_id=handId, revision=revision)
+        event, message = self._hand_sync.frame(player_id=playerId, hand_id=handId,
+                                               state=HandView(hand).state(playerId), base=base)
+
+        await self._connection_manager.send(json_string=message, player_id=playerId, event=event)
+
+    def forget_player(self, player_id: str) -> None:
+        """ Removes the sync state of a disconnected player """
+        self._hand_sync.unsubscribe(player_id=player_id)
+
+    async def forget_games(self, game_ids: List[str]) -> None:
+        """ Removes the sync state of the games removed by the reaper or moved
+        to another worker, and updates the list of games to all users
+        """
+        for game_id in game_ids:
+            self._hand_sync.forget_hand(hand_id=game_id)
+            self._connection_manager.close_room(room=game_room(game_id))
+        await self.gamesUpdate()
 
-            await self._connection_manager.send(json_string=data, player_id=player.id)
+    @client_events.register(GamePayload)
+    async def resumeGame(self, playerId: str, gameId: str):
+        """ Sends the current state of a game to a player that resumed its
+        session: the game, its hand and its score. Only the player gets the
+        snapshot, the others don't know it was disconnected
+
+        Args:
+            playerId (str): id of the player that reconnected.
+            gameId (str): id of the game the player was playing.
+        """
+        game: Game = self._game_manager.get_game(id=gameId)
+        if game is None or all(player.id != playerId for player in game.players):
+            raise GameException('La partida no existe')
+
+        self._connection_manager.subscribe(room=game_room(gameId), player_id=playerId)
+        await self._connection_manager.send(json_string=self._game_message(game), player_id=playerId,
+                                            event='gameUpdate')
+        hand: Hand = self._hand_manager.get_hand(id=gameId)
+        if game.status == 'STARTED' and hand is not None:
+            await self._connection_manager.send(json_string=HandView(hand).message(playerId), player_id=playerId,
+                                                event='handUpdated')
+        score: Score = self._score_manager.get_score(game_id=gameId)
+        if score is not None:
+            await self._connection_manager.send(json_string=self._score_message(score), player_id=playerId,
+                                                event='updateScore')
 
+    @client_events.register(GamePayload)
     async def joinGame(self, gameId: int, playerId: str):
         """ Joins a player to a hand
 
@@ -158,10 +348,12 @@ class SocketController:
             playerId (str): the id of the player to add to the game.
         """
         game: Game = self._game_manager.join_game(game_id=gameId, player_id=playerId)
+        self._connection_manager.subscribe(room=game_room(gameId), player_id=playerId)
 
         await self._connection_manager.send(
                 json_string=json.dumps({'event': 'joinedHand'}),
-                player_id=playerId
+                player_id=playerId,
+                event='joinedHand'
         )
         await self.gameUpdate(gameId=gameId)
         await self.gamesUpdate()
@@ -172,17 +364,40 @@ class SocketController:
                 await self.handUpdate(hand_id=gameId)
                 await self.updateScore(gameId=gameId)
 
+    @client_events.register(GamePayload)
+    async def addBot(self, playerId: str, gameId: str):
+        """ Adds a bot player to a game that is waiting for players
+
+        Args:
+            playerId (str): id of the player who adds the bot.
+            gameId (str): id of the game where the bot joins.
+        """
+        game: Game = self._game_manager.get_game(id=gameId)
+        # Sólo un jugador de la partida puede agregarle un bot
+        if game is None or all(player.id != playerId for player in game.players):
+            raise GameException('La partida no existe')
+        if len(game.players) >= game.rules['num_players']:
+            raise GameException('Partida completa')
+
+        await self._bot_manager.add_bot(game_id=gameId, dispatch=self.call_event)
+
+    @client_events.register(PlayerPayload)
     async def createNewGame(self, playerId: str):
-        """ Creates a new game
+        """ Creates a new game, with an id generated by the server
 
         Args:
             playerId (str): id of the player who creates the hand.
         """
+        gameId = None
+        if self.cluster is not None:
+            # La partida queda en este worker
+            gameId = self.cluster.new_game_id()
         # TODO, for now all games are only for 2 players and  up to 15 score, with no flor
-        game: Game = self._game_manager.create(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+        game: Game = self._game_manager.create(rules={'num_players': 2, 'max_score': 15, 'flor': False}, id=gameId)
         # Joins the user to the recently created hand
         await self.joinGame(playerId=playerId, gameId=game.id)
 
+    @client_events.register(HandPayload)
     async def dealCards(self, playerId: str, handId: str):
         """ Deals cards in a hand
 
@@ -199,6 +414,7 @@ class SocketController:
         await self.updateScore(gameId=handId)
         await self.handUpdate(hand_id=handId)
 
+    @client_events.register(CardPayload)
     async def playCard(self, playerId: str, handId: str, rank: str, suit: str):
         """ Plays a card in a hand
         If the card played finish the hand, also notifies the result to all players
@@ -232,17 +448,9 @@ class SocketController:
         """
         game: Game = self._game_manager.get_game(id=gameId)
         score: Score = self._score_manager.get_score(game_id=gameId)
-        players: List[Player] = self._game_manager.get_game(id=gameId).players
-
-        data = json.dumps({
-            "event": "updateScore",
-            "payload": {
-                "score": jsonable_encoder(score)
-            },
-        })
 
-        for player in players:
-            await self._connection_manager.send(json_string=data, player_id=player.id)
+        await self._connection_manager.publish(room=game_room(gameId), json_string=self._score_message(score),
+                                               event='updateScore')
 
         # Finalizó la partida
         if game.winner is not None:
@@ -254,7 +462,19 @@ class SocketController:
             )
             await self.gameUpdate(gameId=gameId)
             self._game_manager.remove_game(gameId=gameId)
+            self._hand_sync.forget_hand(hand_id=gameId)
+            self._connection_manager.close_room(room=game_room(gameId))
+
+    def _score_message(self, score: Score) -> str:
+        with SERIALIZATION_SECONDS.time('updateScore'):
+            return json.dumps({
+                "event": "updateScore",
+                "payload": {
+                    "score": jsonable_encoder(score)
+                },
+            })
 
+    @client_events.register(LevelPayload)
     async def chantTruco(self, playerId: str, handId: str, level: int):
         """ Handles the truco status of a hand
 
@@ -276,6 +496,7 @@ class SocketController:
 
         await self.handUpdate(hand_id=hand.id)
 
+    @client_events.register(LevelPayload)
     async def responseToTruco(self, playerId: str, handId: str, level: int):
         """ Response to a chantTruco event
         If level is higher than the actual, it's chanted again to the opponent.
@@ -318,6 +539,7 @@ class SocketController:
 
         await self.handUpdate(hand_id=hand.id)
 
+    @client_events.register(LevelPayload)
     async def chantEnvido(self, playerId: str, handId: str, level: int):
         """ Chants envido to the opponent
 
@@ -338,6 +560,7 @@ class SocketController:
 
         await self.handUpdate(hand_id=handId)
 
+    @client_events.register(LevelPayload)
     async def responseToEnvido(self, playerId: str, handId: str, level: int):
         """ Response to a envido to the opponent with another envido
 
@@ -357,6 +580,7 @@ class SocketController:
         )
         await self.handUpdate(hand_id=handId)
 
+    @client_events.register(HandPayload)
     async def acceptEnvido(self, playerId: str, handId: str):
         """ Accepts an envido play
 
@@ -376,6 +600,7 @@ class SocketController:
 
         await self.handUpdate(hand_id=handId)
 
+    @client_events.register(HandPayload)
     async def declineEnvido(self, playerId: str, handId: str):
         """ Declines envido in a Hand of Truco
 
@@ -403,6 +628,7 @@ class SocketController:
 
         await self.handUpdate(hand_id=handId)
 
+    @client_events.register(EnvidoCardsPayload)
     async def playEnvido(self, playerId: str, handId: str, cards: List):
         """ Plays the cards for envido
 
@@ -435,6 +661,7 @@ class SocketController:
 
         await self.handUpdate(hand_id=handId)
 
+    @client_events.register(GamePayload)
     async def goToDeck(self, gameId: str, playerId: str):
         """
         The player_id abandons the hand, assigning the actual score to the 
@@ -1,43 +1,260 @@
-import json
+import logging
+import os
+import socket
+import time
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
+from typing import Optional
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
 from services.connection_manager import ConnectionManager, dep_connection_manager
-from events.socket_events import SocketController, dep_socket_controller
+from events.socket_events import SocketController, dep_socket_controller, game_id_of
+from repositories.journal import Journal
+from repositories.repository import all_repositories, database, dep_game_repository
+from services.reaper import reaper
+from services.bot_manager import dep_bot_manager
+from services.cluster import Cluster
+from services.player_manager import PlayerManager
+from services.lock_manager import dep_lock_manager
+from services.session_manager import dep_session_manager
+from services.rate_limiter import RateLimiter, dep_rate_limiter
+from services.exceptions import GameException
+from services import log
+from services.metrics import MetricsRegistry, dep_metrics, instrument_repositories
 
 
 app = FastAPI()
+logger = logging.getLogger('truco.main')
+
+# Persistencia opcional: con TRUCO_JOURNAL_DIR las partidas sobreviven a un reinicio
+journal: Optional[Journal] = None
+# Modo multi worker opcional: con TRUCO_BUS_PATH los workers comparten las partidas
+cluster: Optional[Cluster] = None
+
+
+@app.on_event("startup")
+async def start_logging():
+    # Los logs se escriben en otro thread, TRUCO_LOG_LEVEL=DEBUG incluye cada mensaje recibido (muestreado)
+    log.setup_logging(level=os.environ.get('TRUCO_LOG_LEVEL', 'INFO'),
+                      sample_every=int(os.environ.get('TRUCO_LOG_SAMPLE_EVERY', 100)))
+
+
+@app.put("/logging")
+async def set_log_level(level: str, logger: str = log.ROOT_LOGGER, sample_every: int = None):
+    # Cambia el nivel de un logger y el muestreo de los logs de debug sin reiniciar
+    try:
+        log.set_level(level, name=logger)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if sample_every is not None:
+        log.sampling.sample_every = sample_every
+    return {'logger': logger, 'level': level.upper(), 'sample_every': log.sampling.sample_every}
+
+
+@app.on_event("startup")
+async def open_journal():
+    global journal
+    directory = os.environ.get('TRUCO_JOURNAL_DIR')
+    if directory:
+        journal = Journal(directory)
+        restored = journal.restore(all_repositories())
+        logger.info("Journal: %d objects restored from %s", restored, directory)
+        await journal.start()
+
+
+@app.on_event("shutdown")
+async def close_journal():
+    if journal is not None:
+        await journal.stop()
+
+
+@app.on_event("startup")
+async def configure_sessions():
+    # Todos los workers tienen que firmar las sesiones con el mismo secreto, y
+    # tiene que ser el mismo después de un reinicio para que los tokens sigan valiendo
+    secret = os.environ.get('TRUCO_SESSION_SECRET')
+    if secret:
+        dep_session_manager().secret = secret.encode()
+
+
+@app.on_event("startup")
+async def reserve_restored_players():
+    # Los jugadores de las partidas restauradas (del journal o de SQLite) tienen
+    # la ventana de gracia para volver con su token, como si se hubieran desconectado
+    dep_connection_manager().reserve_games(dep_game_repository().get_all())
+
+
+@app.on_event("startup")
+async def join_cluster():
+    # Cada worker se identifica con TRUCO_WORKER_ID, o con su host y pid si
+    # se levantan varios con uvicorn --workers
+    global cluster
+    path = os.environ.get('TRUCO_BUS_PATH')
+    if path:
+        worker_id = os.environ.get('TRUCO_WORKER_ID', f'{socket.gethostname()}-{os.getpid()}')
+        cluster = Cluster(path=path, worker_id=worker_id)
+        await cluster.start(dep_connection_manager(), dep_socket_controller(), PlayerManager(),
+                            all_repositories(), dep_lock_manager())
+        logger.info("Cluster: worker %s joined", cluster.worker_id)
+
+
+@app.on_event("shutdown")
+async def leave_cluster():
+    if cluster is not None:
+        await cluster.stop()
+
+
+@app.on_event("startup")
+async def start_bots():
+    # Los procesos de las búsquedas de los bots se levantan al inicio, uno por CPU o TRUCO_BOT_WORKERS
+    bot_manager = dep_bot_manager()
+    if os.environ.get('TRUCO_BOT_WORKERS'):
+        bot_manager.max_workers = int(os.environ['TRUCO_BOT_WORKERS'])
+    bot_manager.start()
+
+
+@app.on_event("shutdown")
+async def stop_bots():
+    dep_bot_manager().stop()
+
+
+@app.on_event("startup")
+async def start_reaper():
+    # Las partidas terminadas, abandonadas o sin actividad se eliminan en segundo plano
+    reaper.on_removed = dep_socket_controller().forget_games
+    await reaper.start()
+
+
+@app.on_event("shutdown")
+async def stop_reaper():
+    await reaper.stop()
+
+
+@app.on_event("shutdown")
+async def stop_logging():
+    # Se detiene al final, para escribir los logs de los demás
+    log.stop_logging()
+
+
+@app.on_event("startup")
+async def start_metrics():
+    # Los tiempos de los eventos y de los repositorios se miden siempre, el
+    # resto se lee del estado del servidor cuando se piden las métricas
+    registry = dep_metrics()
+    instrument_repositories(all_repositories(), registry)
+    manager, controller, games = dep_connection_manager(), dep_socket_controller(), dep_game_repository()
+
+    registry.gauge('truco_connected_sockets', 'Websockets connected to this worker',
+                   lambda: len(manager.active_connections))
+    registry.gauge('truco_remote_players', 'Players connected to the other workers',
+                   lambda: len(manager.remote_connections))
+    registry.gauge('truco_reserved_sessions', 'Disconnected players within their grace window',
+                   manager.reserved_count)
+    registry.gauge('truco_outbound_queued_messages', 'Messages waiting in the outbound queues',
+                   lambda: sum(manager.queue_depths()))
+    registry.gauge('truco_outbound_queue_max_depth', 'Messages in the longest outbound queue',
+                   lambda: max(manager.queue_depths(), default=0))
+    registry.gauge('truco_games', 'Live games by status',
+                   lambda: {(status,): count for status, count in games.count_by_status().items()}, ('status',))
+    registry.counter('truco_event_rejected_total', 'Client events rejected by their schema',
+                     lambda: {(event,): cost.rejected for event, cost in controller.event_costs.items()}, ('event',))
+    registry.counter('truco_event_errors_total', 'Client events that failed',
+                     lambda: {(event,): cost.errors for event, cost in controller.event_costs.items()}, ('event',))
+    registry.counter('truco_rate_limited_total', 'Client messages by rate limiter decision',
+                     lambda: {(decision,): getattr(dep_rate_limiter(), decision)
+                              for decision in ('allowed', 'coalesced', 'dropped')}, ('decision',))
+    registry.counter('truco_reaper_reclaimed_total', 'Games, hands and scores removed by the reaper',
+                     lambda: {(kind,): count for kind, count in reaper.reclaimed.items()}, ('kind',))
+    registry.counter('truco_reaper_removed_games_total', 'Games removed by the reaper by reason',
+                     lambda: {(reason,): count for reason, count in reaper.removed_by_reason.items()}, ('reason',))
+    registry.counter('truco_cluster_messages_total', 'Messages of this worker in cross-worker mode',
+                     lambda: {(kind,): getattr(cluster, kind) for kind in
+                              ('forwarded', 'relayed', 'migrated_in', 'migrated_out')} if cluster else {}, ('kind',))
+    registry.counter('truco_cluster_lost_workers_total', 'Workers removed from the ring for missing heartbeats',
+                     lambda: cluster.lost_workers if cluster else 0)
+    registry.counter('truco_cluster_bus_reconnections_total', 'Reconnections of this worker to the bus',
+                     lambda: cluster.reconnections if cluster else 0)
+    registry.counter('truco_cluster_unsent_total', 'Messages dropped while this worker was disconnected from the bus',
+                     lambda: cluster.unsent if cluster else 0)
+    registry.counter('truco_journal_records_total', 'Records written to the journal',
+                     lambda: journal.records_written if journal else 0)
+    registry.counter('truco_journal_commit_seconds_total', 'Time committing the journal',
+                     lambda: journal.commit_seconds if journal else 0)
+    if database is not None:
+        registry.counter('truco_unit_of_work_total', 'Writes of the units of work, registered and done',
+                         lambda: {('registered',): database.unit_of_work.registered,
+                                  ('written',): database.unit_of_work.written}, ('writes',))
+
+
+@app.get("/metrics")
+async def metrics(registry: MetricsRegistry = Depends(dep_metrics)):
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.get("/throttling")
+async def throttling(rate_limiter: RateLimiter = Depends(dep_rate_limiter)):
+    # Mensajes limitados en total y las conexiones más limitadas, sin los ids de sus jugadores
+    return rate_limiter.stats()
 
 
 @app.websocket("/ws")
 async def websocket_truco(
         websocket: WebSocket,
         manager: ConnectionManager = Depends(dep_connection_manager),
-        socket_controller: SocketController = Depends(dep_socket_controller)
+        socket_controller: SocketController = Depends(dep_socket_controller),
+        rate_limiter: RateLimiter = Depends(dep_rate_limiter)
 ):
-    player_id = await manager.connect(websocket)
-    await socket_controller.call_event(
-            event="gamesUpdate",
-            payload={'playerId': player_id}
-        )
+    # El cliente que se reconecta envía el token de su sesión para recuperar su lugar
+    player_id = await manager.connect(websocket, token=websocket.query_params.get('token'))
+
+    async def dispatch(event, payload):
+        fields = {'event': event, 'player_id': player_id,
+                  'game_id': game_id_of(payload) if isinstance(payload, dict) else None}
+        start = time.perf_counter()
+        try:
+            # Un cliente sólo puede enviar eventos de su propio jugador
+            if isinstance(payload, dict) and payload.get('playerId', player_id) != player_id:
+                raise GameException('Jugador inválido')
+            # El evento y su payload se validan en el SocketController
+            await socket_controller.call_event(event=event, payload=payload)
+        except (Exception) as e:
+            # Notificación del error al front
+            await socket_controller.notifyPlayer(playerId=player_id, title='ERROR', text=str(e), type='ERROR')
+            logger.warning("Event failed: %s", str(e), extra=fields)
+        else:
+            fields['duration'] = round((time.perf_counter() - start) * 1000, 3)
+            logger.debug("Event handled", extra=fields)
+
+    async def dropped(event):
+        # Una vez por ráfaga, así el operador encuentra al jugador de una conexión de /throttling
+        logger.warning("Messages dropped", extra={'event': event, 'player_id': player_id,
+                                                  'connection': rate_limiter.connection_key(player_id)})
+        # El jugador tiene que saber que su jugada no se envió
+        await socket_controller.notifyPlayer(playerId=player_id, title='ERROR',
+                                             text='Demasiados mensajes, espera un momento', type='ERROR')
+
     try:
+        # Un error al reanudar una partida se notifica como el de cualquier evento
+        for game_id in manager.games_of(player_id):
+            await dispatch('resumeGame', {'playerId': player_id, 'gameId': game_id})
+        await dispatch('gamesUpdate', {'playerId': player_id})
+        logger.info("Player connected, %d connected users", len(manager.active_connections),
+                    extra={'player_id': player_id})
+
         while True:
             data = await websocket.receive_json()
-            print(f"Received message: {data}")
-            print("Total connected users: ", len(manager.active_connections))
-
-            try:
-                await socket_controller.call_event(event=data['event'], payload=data['payload'])
-            except (Exception) as e:
-                # Notificación del error al front
-                await socket_controller.call_event(
-                        event="notify",
-                        payload={'playerId': player_id, 'title': 'ERROR', 'message': str(e), 'type': 'ERROR'}
-                )
-                # Log del error en la consola
-                print("ERROR: ", data)
-                print("ERROR message: ", str(e))
+            if not isinstance(data, dict):
+                logger.warning("Invalid message", extra={'player_id': player_id})
+                continue
+            # Los mensajes por encima del límite de la conexión se descartan o se juntan
+            await rate_limiter.submit(player_id, data.get('event'), data.get('payload'), dispatch, dropped)
 
     except WebSocketDisconnect:
-        # TODO end the game, set a winner if user was playing a game
-        # Notify all users
+        pass
+    finally:
+        # Sus partidas siguen: el jugador queda reservado la ventana de gracia para
+        # reanudarlas, y si nadie vuelve el reaper las elimina por huérfanas
         manager.disconnect(websocket)
+        socket_controller.forget_player(player_id=player_id)
+        rate_limiter.forget(player_id)
+        logger.info("Player disconnected, %d connected users", len(manager.active_connections),
+                    extra={'player_id': player_id})
@@ -1,9 +1,10 @@
 from __future__ import annotations
+import itertools
 import uuid
 
 from enum import Enum
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Union
+from pydantic import BaseModel, Field, validator
+from typing import List, Optional, Dict, Tuple, Union
 
 
 class Suit(str, Enum):
@@ -46,13 +47,63 @@ TRUCO_CARD_VALUES = {
 }
 
 
+# Tablas precalculadas. Cada carta tiene un índice de 0 a 39 según el orden
+# del mazo: rango * 4 + palo (en el orden en que están definidos los enums)
+DECK = [(rank, suit) for rank in Rank for suit in Suit]
+CARD_INDEX: Dict[Tuple[Rank, Suit], int] = {card: index for index, card in enumerate(DECK)}
+
+
+def _build_truco_values() -> List[int]:
+    values = [-1] * len(DECK)
+    for value, cards in TRUCO_CARD_VALUES.items():
+        for suit in cards["suit"]:
+            values[CARD_INDEX[(cards["rank"], suit)]] = int(value)
+    return values
+
+
+TRUCO_VALUES: List[int] = _build_truco_values()
+ENVIDO_VALUES: List[int] = [int(rank) if int(rank) < 10 else 0 for rank, _ in DECK]
+CARD_SUITS: List[int] = [index % len(Suit) for index in range(len(DECK))]
+
+
+def _best_envido(cards: Tuple[int, ...]) -> int:
+    """ Best envido for a combination of card indexes """
+    best = max(ENVIDO_VALUES[card] for card in cards)
+    for i in range(len(cards)):
+        for j in range(i + 1, len(cards)):
+            if CARD_SUITS[cards[i]] == CARD_SUITS[cards[j]]:
+                best = max(best, 20 + ENVIDO_VALUES[cards[i]] + ENVIDO_VALUES[cards[j]])
+    return best
+
+
+def _build_best_envido() -> List[int]:
+    table = [0] * len(DECK) ** 3
+    for combination in itertools.combinations(range(len(DECK)), 3):
+        envido = _best_envido(combination)
+        for a, b, c in itertools.permutations(combination):
+            table[a * 1600 + b * 40 + c] = envido
+    return table
+
+
+# Mejor envido de cualquier mano de 3 cartas, indexado por a * 1600 + b * 40 + c
+BEST_ENVIDO: List[int] = _build_best_envido()
+
+
 def get_value_of_card(rank: Rank, suit: Suit) -> int:
     """ Returns the value of a card acording to the Truco card score """
-    for value, cards in TRUCO_CARD_VALUES.items():
-        if cards["rank"] == rank and suit in cards["suit"]:
-            return int(value)
+    index = CARD_INDEX.get((Rank(rank), Suit(suit)))
+    return TRUCO_VALUES[index] if index is not None else -1
+
 
-    return -1
+def get_envido_of_card(rank: Rank, suit: Suit) -> int:
+    """ Returns the value of a card for the envido """
+    return ENVIDO_VALUES[CARD_INDEX[(Rank(rank), Suit(suit))]]
+
+
+def get_best_envido(cards: List[Card]) -> int:
+    """ Returns the best envido that can be played with 3 cards """
+    a, b, c = [CARD_INDEX[(card.rank, card.suit)] for card in cards]
+    return BEST_ENVIDO[a * 1600 + b * 40 + c]
 
 
 class Player(BaseModel):
@@ -65,6 +116,7 @@ class Card(BaseModel):
     suit: Suit
     rank: Rank
     _value: int = None
+    _index: int = None  # Índice en el mazo, la carta del motor (ver engine.cards)
 
     class Config:
         # Para que no serialize el _value
@@ -72,7 +124,18 @@ class Card(BaseModel):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self._value = get_value_of_card(rank=self.rank, suit=self.suit)
+        self._index = CARD_INDEX[(self.rank, self.suit)]
+        self._value = TRUCO_VALUES[self._index]
+
+
+# Una instancia de Card por carta del mazo. Las manos guardan éstas en vez de
+# copias, también las que se leen del journal o de SQLite
+SHARED_CARDS: List[Card] = [Card(rank=rank, suit=suit) for rank, suit in DECK]
+
+
+def shared_card(card: Optional[Card]) -> Optional[Card]:
+    """ Returns the shared instance of a card """
+    return SHARED_CARDS[card._index] if card is not None else None
 
 
 class Truco(int, Enum):
@@ -106,6 +169,11 @@ class Envido(BaseModel):
     winner: Optional[str]
     status: EnvidoStatus = EnvidoStatus.NOT_STARTED  # Initialized in chant phase
 
+    @validator('cards_played')
+    def _share_cards(cls, cards_played):
+        return {player: [shared_card(card) for card in cards] if cards is not None else None
+                for player, cards in cards_played.items()}
+
     @property
     def all_played(self):
         """ Returns the player_id of the winner """
@@ -129,6 +197,10 @@ class Round(BaseModel):
     """ A Round of a hand of truco """
     cards_played: Dict[str, Optional[Card]]
 
+    @validator('cards_played')
+    def _share_cards(cls, cards_played):
+        return {player: shared_card(card) for player, card in cards_played.items()}
+
     @property
     def finished(self) -> bool:
         """ Check if the round is finished """
@@ -169,6 +241,10 @@ class Hand(BaseModel):
     winner: Optional[str]
     status: HandStatus = HandStatus.NOT_STARTED
 
+    @validator('cards_dealed')
+    def _share_cards(cls, cards_dealed):
+        return {player: [shared_card(card) for card in cards] for player, cards in cards_dealed.items()}
+
     @property
     def check_winner(self) -> Optional[str]:
         """ Determines the winner of the hand according to the rules of Truco """
@@ -202,7 +278,7 @@ class Hand(BaseModel):
 
 class Score(BaseModel):
     """ Score of a truco game """
-    id: Optional[int]  # El id de la partida
+    id: Optional[str]  # El id de la partida
     # NOTA, Siempre van a ser 2 ya sea los jugadores o equipos
     score: Optional[Dict[str, int]] = {} # Por ahora queda con el id del jugador y puntaje
 
@@ -0,0 +1,221 @@
+""" Write-ahead journal and snapshots for the in-memory repositories.
+
+The repositories call Journal.record on every save/update/remove, which only
+keeps a reference to the object. A background task commits the pending
+changes in groups: the objects are serialized, appended to the journal file
+and the file is fsync'ed once per group, in a thread. Several changes of the
+same object in a group are written once, with its last state.
+
+Every snapshot_every records a snapshot with all the objects is written and
+a new journal generation is started. The snapshot is made of the last json
+committed of each object, so the objects are not serialized again: the loop
+only copies the references and the thread joins and writes them. On startup the repositories are rebuilt
+from the last snapshot plus the journals written after it.
+
+The events don't wait for the commit, so a crash can lose the changes of the
+last flush_interval seconds.
+
+Files in the directory:
+    snapshot.<generation>.json: the objects when the generation started
+    journal.<generation>.log: one json line per change during the generation
+"""
+import asyncio
+import json
+import os
+import time
+
+from typing import Dict, List, Optional, Tuple
+from pydantic import BaseModel
+from models.models import Game, Hand, Player, Score
+
+# Se restauran en este orden
+MODELS = {'player': Player, 'game': Game, 'hand': Hand, 'score': Score}
+
+
+class Journal:
+    """ Durable log of the changes of the repositories """
+    directory: str
+    flush_interval: float  # Ventana de espera para juntar cambios en un mismo commit
+    snapshot_every: int  # Registros escritos entre snapshots
+    fsync: bool
+    # Métricas
+    commits: int
+    records_written: int
+    snapshots: int
+    commit_seconds: float
+
+    def __init__(self, directory: str, flush_interval: float = 0.01, snapshot_every: int = 10_000, fsync: bool = True):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.commits = 0
+        self.records_written = 0
+        self.snapshots = 0
+        self.commit_seconds = 0
+        self._pending: Dict[Tuple[str, str], Optional[BaseModel]] = {}
+        self._latest: Dict[Tuple[str, str], str] = {}  # (tipo, id) -> último json escrito de cada objeto
+        self._repositories: Dict = {}
+        self._generation = 0
+        self._records = 0  # Registros escritos desde el último snapshot
+        self._file = None
+        self._file_generation = None
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, kind: str, id: str, obj: Optional[BaseModel]) -> None:
+        """ Records the change of an object, None if it was removed """
+        self._pending[(kind, id)] = obj
+        self._wakeup.set()
+
+    def restore(self, repositories: Dict) -> int:
+        """ Rebuilds the repositories (kind -> repository) from the files and
+        starts recording their changes.
+
+        Returns:
+            int: the number of objects restored
+        """
+        objects: Dict[Tuple[str, str], Optional[Dict]] = {}
+
+        snapshots = self._generations('snapshot')
+        base = snapshots[-1] if snapshots else 0
+        if snapshots:
+            with open(self._path('snapshot', base)) as file:
+                for kind, items in json.load(file).items():
+                    for data in items:
+                        objects[(kind, data['id'])] = data
+
+        journals = [generation for generation in self._generations('journal') if generation >= base]
+        for generation in journals:
+            with open(self._path('journal', generation)) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Línea cortada por una caída a mitad de escritura
+                        break
+                    objects[(entry['kind'], entry['id'])] = entry['data']
+
+        self._latest = {key: json.dumps(data) for key, data in objects.items() if data is not None}
+        restored = 0
+        for kind, model in MODELS.items():
+            repository = repositories[kind]
+            for (object_kind, _), data in objects.items():
+                if object_kind == kind and data is not None:
+                    repository.save(model.parse_obj(data))
+                    restored += 1
+
+        # Los cambios nuevos van a otro archivo, por si el último quedó cortado
+        self._generation = max([base] + journals) + 1
+        self._repositories = repositories
+        for kind, repository in repositories.items():
+            repository.journal = self
+        return restored
+
+    async def start(self) -> None:
+        """ Starts the background task that commits the changes """
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """ Commits the pending changes and stops the background task """
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.commit()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def _run(self):
+        while not self._stopping:
+            await self._wakeup.wait()
+            # Se espera a que se junten más cambios para hacer un solo fsync
+            if not self._stopping:
+                await asyncio.sleep(self.flush_interval)
+            await self.commit()
+
+    async def commit(self) -> None:
+        """ Writes the pending changes, and a snapshot if it's time to """
+        async with self._lock:
+            self._wakeup.clear()
+            if not self._pending:
+                return
+
+            start = time.perf_counter()
+            pending, self._pending = self._pending, {}
+            lines = []
+            for (kind, id), obj in pending.items():
+                if obj is not None:
+                    data = self._latest[(kind, id)] = obj.json()
+                else:
+                    data = 'null'
+                    self._latest.pop((kind, id), None)
+                lines.append(f'{{"kind": {json.dumps(kind)}, "id": {json.dumps(id)}, "data": {data}}}\n')
+
+            await asyncio.to_thread(self._append, self._generation, ''.join(lines))
+            self.commits += 1
+            self.records_written += len(lines)
+            self._records += len(lines)
+
+            if self._records >= self.snapshot_every:
+                await self._snapshot()
+            self.commit_seconds += time.perf_counter() - start
+
+    async def _snapshot(self) -> None:
+        # En el loop sólo se copian las referencias a los json, que no cambian
+        objects = list(self._latest.items())
+        # Lo que quedó pendiente no está en el snapshot, va al journal de la nueva generación
+        self._generation += 1
+        self._records = 0
+        await asyncio.to_thread(self._write_snapshot, self._generation, objects)
+        self.snapshots += 1
+
+    def _append(self, generation: int, data: str) -> None:
+        if self._file_generation != generation:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self._path('journal', generation), 'a')
+            self._file_generation = generation
+
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _write_snapshot(self, generation: int, objects: List[Tuple[Tuple[str, str], str]]) -> None:
+        items: Dict[str, List[str]] = {kind: [] for kind in MODELS}
+        for (kind, _), data in objects:
+            items[kind].append(data)
+        data = '{' + ', '.join(f'{json.dumps(kind)}: [' + ', '.join(items[kind]) + ']' for kind in items) + '}'
+
+        path = self._path('snapshot', generation)
+        with open(f'{path}.tmp', 'w') as file:
+            file.write(data)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+        os.replace(f'{path}.tmp', path)
+
+        # Lo anterior al snapshot ya no hace falta
+        for name in ('snapshot', 'journal'):
+            for old in self._generations(name):
+                if old < generation:
+                    os.remove(self._path(name, old))
+
+    def _path(self, name: str, generation: int) -> str:
+        extension = 'json' if name == 'snapshot' else 'log'
+        return os.path.join(self.directory, f'{name}.{generation}.{extension}')
+
+    def _generations(self, name: str) -> List[int]:
+        generations = []
+        for file_name in os.listdir(self.directory):
+            parts = file_name.split('.')
+            if len(parts) == 3 and parts[0] == name and parts[1].isdigit():
+                generations.append(int(parts[1]))
+        return sorted(generations)
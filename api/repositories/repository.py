@@ -1,7 +1,13 @@
 import abc
-from typing import List, Optional
+import os
+
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Callable, ContextManager, Dict, List, Optional
 from models.models import Game, Hand, Score, Player
 
+if TYPE_CHECKING:
+    from repositories.journal import Journal
+
 
 class AbstractPlayerRepository(abc.ABC):
     @abc.abstractmethod
@@ -18,27 +24,32 @@ class AbstractPlayerRepository(abc.ABC):
 
 
 class InMemoryPlayersRepository(AbstractPlayerRepository):
-    _players: List[Player]
+    _players: Dict[str, Player]
+    journal: Optional['Journal'] = None  # Si está, registra los cambios para persistirlos
 
     def __init__(self):
-        self._players = []
+        self._players = {}
 
     def get_by_id(self, id) -> Optional[Player]:
-        for player in self._players:
-            if player.id == id:
-                return player
-        return None
+        return self._players.get(id)
+
+    def get_all(self) -> List[Player]:
+        return list(self._players.values())
 
     def save(self, player: Player) -> None:
-        self._players.append(player)
+        self._players[player.id] = player
+        if self.journal is not None:
+            self.journal.record('player', player.id, player)
 
     def update(self, player: Player) -> None:
         # TODO feature to change name?
-        pass
+        if self.journal is not None:
+            self.journal.record('player', player.id, player)
 
     def remove(self, player: Player) -> None:
-        player_index = self._players.index(self.get_by_id(id=player.id))
-        del self._players[player_index]
+        self._players.pop(player.id, None)
+        if self.journal is not None:
+            self.journal.record('player', player.id, None)
 
 
 players_repository: InMemoryPlayersRepository = InMemoryPlayersRepository()
@@ -69,37 +80,45 @@ class AbstractHandRepository(abc.ABC):
     def get_availables(self):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_all(self) -> List[Hand]:
+        raise NotImplementedError
+
 
 class InMemoryHandRepository(AbstractHandRepository):
-    _hands: List[Hand]
+    _hands: Dict[str, Hand]
+    journal: Optional['Journal'] = None
 
     def __init__(self):
-        self._hands = []
+        self._hands = {}
 
     def get_by_id(self, id: str) -> Optional[Hand]:
-        for hand in self._hands:
-            if hand.id == id:
-                return hand
+        return self._hands.get(id)
 
-        return None
+    def get_all(self) -> List[Hand]:
+        return list(self._hands.values())
 
     def get_availables(self) -> List[Hand]:
         avaliable_games = []
-        for game in self._hands:
+        for game in self._hands.values():
             if len(game.players) < 2:
                 avaliable_games.append(game)
         return avaliable_games
 
     def save(self, hand: Hand) -> None:
-        self._hands.append(hand)
+        self._hands[hand.id] = hand
+        if self.journal is not None:
+            self.journal.record('hand', hand.id, hand)
 
     def remove(self, hand: Hand) -> None:
-        hand_index = self._hands.index(self.get_by_id(id=hand.id))
-        del self._hands[hand_index]
+        self._hands.pop(hand.id, None)
+        if self.journal is not None:
+            self.journal.record('hand', hand.id, None)
 
     def update(self, hand: Hand) -> None:
-        hand_index = self._hands.index(self.get_by_id(id=hand.id))
-        self._hands[hand_index] = hand
+        self._hands[hand.id] = hand
+        if self.journal is not None:
+            self.journal.record('hand', hand.id, hand)
 
 
 hand_repository: AbstractHandRepository = InMemoryHandRepository()
@@ -115,6 +134,10 @@ class AbstractScoreRepository(abc.ABC):
     def get_by_id(self, id: str) -> Hand:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_all(self) -> List[Score]:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def save(self, score: Score) -> None:
         raise NotImplementedError
@@ -123,26 +146,38 @@ class AbstractScoreRepository(abc.ABC):
     def update(self, score: Score) -> None:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def remove(self, score: Score) -> None:
+        raise NotImplementedError
+
 
 class InMemoryScoreRepository(AbstractScoreRepository):
-    _scores: List[Score]
+    _scores: Dict[str, Score]
+    journal: Optional['Journal'] = None
 
     def __init__(self):
-        self._scores = []
+        self._scores = {}
 
     def get_by_id(self, id: str) -> Optional[Score]:
-        for score in self._scores:
-            if score.id == id:
-                return score
+        return self._scores.get(id)
 
-        return None
+    def get_all(self) -> List[Score]:
+        return list(self._scores.values())
 
     def save(self, score: Score) -> None:
-        self._scores.append(score)
+        self._scores[score.id] = score
+        if self.journal is not None:
+            self.journal.record('score', score.id, score)
 
     def update(self, score: Score) -> None:
-        score_index = self._scores.index(self.get_by_id(id=score.id))
-        self._scores[score_index] = score
+        self._scores[score.id] = score
+        if self.journal is not None:
+            self.journal.record('score', score.id, score)
+
+    def remove(self, score: Score) -> None:
+        self._scores.pop(score.id, None)
+        if self.journal is not None:
+            self.journal.record('score', score.id, None)
 
 
 scores_repository: AbstractScoreRepository = InMemoryScoreRepository()
@@ -157,10 +192,19 @@ class AbstractGameRepository(abc.ABC):
     def get_by_id(self, id: str) -> Optional[Game]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_all(self) -> List[Game]:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def avaliable_games(self) -> List[Game]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def avaliable_games_revision(self) -> int:
+        """ Returns a number that changes every time avaliable_games changes """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def save(self, game: Game) -> None:
         raise NotImplementedError
@@ -175,35 +219,88 @@ class AbstractGameRepository(abc.ABC):
 
 
 class InMemoryGameRepository(AbstractGameRepository):
-    _games: List[Game]
+    _games: Dict[str, Game]
+    # Indices secundarios, se mantienen en cada save/update/remove
+    _games_by_status: Dict[str, Dict[str, Game]]
+    _status_of: Dict[str, str]
+    _open_games: Dict[str, Game]  # Partidas con lugares libres, en orden de creación
+    _open_games_revision: int
+    journal: Optional['Journal'] = None
 
     def __init__(self):
-        self._games = []
+        self._games = {}
+        self._games_by_status = {}
+        self._status_of = {}
+        self._open_games = {}
+        self._open_games_revision = 0
 
     def get_by_id(self, id: int) -> Optional[Game]:
-        for game in self._games:
-            if game.id == id:
-                return game
+        return self._games.get(id)
+
+    def get_all(self) -> List[Game]:
+        return list(self._games.values())
+
+    def get_by_status(self, status: str) -> List[Game]:
+        """ Returns the games with the passed status """
+        return list(self._games_by_status.get(status, {}).values())
 
-        return None
+    def count_by_status(self) -> Dict[str, int]:
+        """ Returns the number of games for each status """
+        return {status: len(games) for status, games in self._games_by_status.items()}
 
     def avaliable_games(self) -> List[Game]:
-        availables = []
-        for game in self._games:
-            if len(game.players) < game.rules['num_players']:
-                availables.append(game)
-        return availables
+        # Se vuelve a chequear por si la partida se modificó sin llamar a update
+        return [game for game in self._open_games.values()
+                if len(game.players) < game.rules['num_players']]
+
+    def avaliable_games_revision(self) -> int:
+        return self._open_games_revision
 
     def save(self, game: Game) -> None:
-        self._games.append(game)
+        self._games[game.id] = game
+        self._index(game)
+        if self.journal is not None:
+            self.journal.record('game', game.id, game)
 
     def update(self, game: Game) -> None:
-        game_index = self._games.index(self.get_by_id(id=game.id))
-        self._games[game_index] = game
+        self._games[game.id] = game
+        self._index(game)
+        if self.journal is not None:
+            self.journal.record('game', game.id, game)
 
     def remove(self, game: Game) -> None:
-        game_index = self._games.index(self.get_by_id(id=game.id))
-        del self._games[game_index]
+        self._games.pop(game.id, None)
+        self._unindex_status(game.id)
+        if self._open_games.pop(game.id, None) is not None:
+            self._open_games_revision += 1
+        if self.journal is not None:
+            self.journal.record('game', game.id, None)
+
+    def _index(self, game: Game) -> None:
+        """ Updates the secondary indexes for the passed game """
+        if self._status_of.get(game.id) != game.status:
+            self._unindex_status(game.id)
+            self._games_by_status.setdefault(game.status, {})[game.id] = game
+            self._status_of[game.id] = game.status
+        else:
+            self._games_by_status[game.status][game.id] = game
+
+        if len(game.players) < game.rules['num_players']:
+            # Si ya estaba se mantiene su posición en el lobby
+            self._open_games[game.id] = game
+            self._open_games_revision += 1
+        elif self._open_games.pop(game.id, None) is not None:
+            self._open_games_revision += 1
+
+    def _unindex_status(self, game_id: str) -> None:
+        status = self._status_of.pop(game_id, None)
+        if status is None:
+            return
+
+        games = self._games_by_status[status]
+        del games[game_id]
+        if not games:
+            del self._games_by_status[status]
 
 
 game_repository: InMemoryGameRepository = InMemoryGameRepository()
@@ -211,3 +308,31 @@ game_repository: InMemoryGameRepository = InMemoryGameRepository()
 
 def dep_game_repository() -> AbstractGameRepository:
     return game_repository
+
+
+def all_repositories() -> Dict:
+    """ The repositories of the server by kind of object, to persist them """
+    return {
+        'player': players_repository,
+        'game': game_repository,
+        'hand': hand_repository,
+        'score': scores_repository,
+    }
+
+
+# Con TRUCO_SQLITE_PATH los repositorios guardan el estado en SQLite
+database = None
+if os.environ.get('TRUCO_SQLITE_PATH'):
+    from repositories.sqlite_repository import (
+        Database, SqlitePlayersRepository, SqliteHandRepository, SqliteScoreRepository, SqliteGameRepository
+    )
+    database = Database(os.environ['TRUCO_SQLITE_PATH'])
+    players_repository = SqlitePlayersRepository(database)
+    hand_repository = SqliteHandRepository(database)
+    scores_repository = SqliteScoreRepository(database)
+    game_repository = SqliteGameRepository(database)
+
+
+def dep_unit_of_work() -> Callable[[], ContextManager]:
+    """ Returns the factory of the units of work that group the writes of an event """
+    return database.unit_of_work.begin if database is not None else nullcontext
@@ -0,0 +1,178 @@
+""" SQLite implementation of the repositories.
+
+The live objects are kept in memory, like in the in-memory repositories, so
+the managers keep getting the same instance of a game or hand on every
+lookup (they are the identity map). SQLite is the durable copy: the objects
+are stored as compact JSON blobs keyed by their id, and loaded back when
+the repositories are created.
+
+All the repositories share one long-lived connection in WAL mode. During
+a unit of work (one socket event) the objects changed are only registered,
+and written once each in a single transaction when it ends. The transaction
+is opened and committed in the same call, so it never stays open while the
+loop runs other events, and it's rolled back if a write fails.
+"""
+import sqlite3
+
+from typing import Iterator, Optional, Type
+
+from pydantic import BaseModel
+from models.models import Game, Hand, Player, Score
+from repositories.repository import (
+    InMemoryPlayersRepository, InMemoryHandRepository, InMemoryScoreRepository, InMemoryGameRepository
+)
+from repositories.unit_of_work import UnitOfWork, Changes
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS players (id TEXT PRIMARY KEY, data TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS games (id TEXT PRIMARY KEY, status TEXT, data TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS hands (id TEXT PRIMARY KEY, data TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS scores (id TEXT PRIMARY KEY, data TEXT NOT NULL)',
+]
+
+
+def to_json(obj: BaseModel) -> str:
+    return obj.json(separators=(',', ':'))
+
+
+class Database:
+    """ A SQLite connection shared by the repositories of a worker """
+    connection: sqlite3.Connection
+    unit_of_work: UnitOfWork
+    commits: int
+
+    def __init__(self, path: str, synchronous: str = 'NORMAL'):
+        # Autocommit, las transacciones se abren al escribir una unidad de trabajo
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # Con WAL y NORMAL no se hace fsync en cada commit, sólo en los checkpoints
+        self.connection.execute(f'PRAGMA synchronous={synchronous}')
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.unit_of_work = UnitOfWork(flush=self._flush)
+        self.commits = 0
+
+    def write(self, table: str, id: str, obj: Optional[BaseModel]) -> None:
+        """ Writes an object, or deletes it if it's None. Inside a unit of
+        work it's deferred until the unit of work ends
+        """
+        if not self.unit_of_work.register(table, id, obj):
+            self._write(table, id, obj)
+            self.commits += 1
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        # El módulo sqlite3 reutiliza los statements ya preparados de la conexión
+        return self.connection.execute(sql, parameters)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _flush(self, changes: Changes) -> None:
+        """ Writes the changes of a unit of work in one transaction, all or none """
+        self.execute('BEGIN')
+        try:
+            for (table, id), obj in changes.items():
+                self._write(table, id, obj)
+        except Exception:
+            self.execute('ROLLBACK')
+            raise
+        self.execute('COMMIT')
+        self.commits += 1
+
+    def _write(self, table: str, id: str, obj: Optional[BaseModel]) -> None:
+        if obj is None:
+            self.execute(f'DELETE FROM {table} WHERE id = ?', (id,))
+        elif table == 'games':
+            self.execute('INSERT OR REPLACE INTO games (id, status, data) VALUES (?, ?, ?)',
+                         (id, obj.status, to_json(obj)))
+        else:
+            self.execute(f'INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)', (id, to_json(obj)))
+
+
+def _load(database: Database, table: str, model: Type[BaseModel]) -> Iterator[BaseModel]:
+    for (data,) in database.execute(f'SELECT data FROM {table}'):
+        yield model.parse_raw(data)
+
+
+class SqlitePlayersRepository(InMemoryPlayersRepository):
+    _database: Database
+
+    def __init__(self, database: Database):
+        super().__init__()
+        self._database = database
+        for player in _load(database, 'players', Player):
+            super().save(player)
+
+    def save(self, player: Player) -> None:
+        super().save(player)
+        self._database.write('players', player.id, player)
+
+    def update(self, player: Player) -> None:
+        self.save(player)
+
+    def remove(self, player: Player) -> None:
+        super().remove(player)
+        self._database.write('players', player.id, None)
+
+
+class SqliteHandRepository(InMemoryHandRepository):
+    _database: Database
+
+    def __init__(self, database: Database):
+        super().__init__()
+        self._database = database
+        for hand in _load(database, 'hands', Hand):
+            super().save(hand)
+
+    def save(self, hand: Hand) -> None:
+        super().save(hand)
+        self._database.write('hands', hand.id, hand)
+
+    def update(self, hand: Hand) -> None:
+        self.save(hand)
+
+    def remove(self, hand: Hand) -> None:
+        super().remove(hand)
+        self._database.write('hands', hand.id, None)
+
+
+class SqliteScoreRepository(InMemoryScoreRepository):
+    _database: Database
+
+    def __init__(self, database: Database):
+        super().__init__()
+        self._database = database
+        for score in _load(database, 'scores', Score):
+            super().save(score)
+
+    def save(self, score: Score) -> None:
+        super().save(score)
+        self._database.write('scores', score.id, score)
+
+    def update(self, score: Score) -> None:
+        self.save(score)
+
+    def remove(self, score: Score) -> None:
+        super().remove(score)
+        self._database.write('scores', score.id, None)
+
+
+class SqliteGameRepository(InMemoryGameRepository):
+    _database: Database
+
+    def __init__(self, database: Database):
+        super().__init__()
+        self._database = database
+        for game in _load(database, 'games', Game):
+            super().save(game)
+
+    def save(self, game: Game) -> None:
+        super().save(game)
+        self._database.write('games', game.id, game)
+
+    def update(self, game: Game) -> None:
+        self.save(game)
+
+    def remove(self, game: Game) -> None:
+        super().remove(game)
+        self._database.write('games', game.id, None)
@@ -0,0 +1,101 @@
+import asyncio
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from pydantic import BaseModel
+
+Changes = Dict[Tuple[str, str], Optional[BaseModel]]  # (tipo, id) -> objeto, None si se borró
+
+
+def _current_task() -> Optional[asyncio.Task]:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        # Fuera del loop, ie. en los scripts y los tests sincrónicos
+        return None
+
+
+class _Event:
+    """ The changes of the unit of work of one event """
+    owner: Optional[asyncio.Task]  # Tarea que ejecuta el evento
+    dirty: Changes
+    open: bool
+
+    def __init__(self, owner: Optional[asyncio.Task]):
+        self.owner = owner
+        self.dirty = {}
+        self.open = True
+
+
+class UnitOfWork:
+    """ Groups the writes of the repositories during a socket event.
+
+    The repositories keep the live objects in memory (the identity map), so
+    every manager gets the same instance of a game, hand or score during the
+    event. While the unit of work is active the repositories only register
+    the objects changed, and each one is written once with its last state when
+    the outermost unit of work ends.
+
+    The changes are kept per event, in a context variable: the events of
+    different games run at the same time in other tasks, and each one is
+    written when it ends. A unit of work begun in the task of an event that
+    is still running is nested in it.
+    """
+    registered: int  # Cambios registrados
+    written: int  # Objetos escritos, registered - written son escrituras ahorradas
+    flushes: int
+
+    def __init__(self, flush: Callable[[Changes], None]):
+        self._flush = flush
+        self._current: ContextVar[Optional[_Event]] = ContextVar(f'unit_of_work_{id(self)}', default=None)
+        self.registered = 0
+        self.written = 0
+        self.flushes = 0
+
+    def _event(self) -> Optional[_Event]:
+        """ The unit of work of the running event, if any """
+        event = self._current.get()
+        # Las tareas creadas durante un evento heredan la variable, pero no son parte de él
+        if event is None or not event.open or event.owner is not _current_task():
+            return None
+        return event
+
+    @property
+    def active(self) -> bool:
+        return self._event() is not None
+
+    @contextmanager
+    def begin(self) -> Iterator[None]:
+        """ Starts a unit of work. Can be nested, only the outermost one flushes """
+        if self._event() is not None:
+            yield
+            return
+
+        event = _Event(owner=_current_task())
+        token = self._current.set(event)
+        try:
+            yield
+        finally:
+            self._current.reset(token)
+            event.open = False
+            # Se escribe aunque el evento haya fallado: lo que está en memoria es el estado real
+            if event.dirty:
+                self._flush(event.dirty)
+                self.written += len(event.dirty)
+                self.flushes += 1
+
+    def register(self, kind: str, id: str, obj: Optional[BaseModel]) -> bool:
+        """ Registers a changed object, None if it was removed.
+
+        Returns:
+            bool: False if there is no active unit of work and the change has
+                  to be written right away
+        """
+        event = self._event()
+        if event is None:
+            return False
+        event.dirty[(kind, id)] = obj
+        self.registered += 1
+        return True
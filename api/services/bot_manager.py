@@ -0,0 +1,400 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from engine import monte_carlo
+from engine.cards import best_envido_cards, index_of, to_card, to_mask
+from engine.monte_carlo import Observation
+from engine.state import HandState
+from models.models import EnvidoLevels, EnvidoStatus, HandStatus, Truco
+from services.connection_manager import ConnectionManager, dep_connection_manager
+from services.exceptions import GameException
+
+Dispatch = Callable[[str, Dict], Awaitable]
+
+MAX_ENVIDO_CHANTS = 4
+# Jugadas rechazadas seguidas, sin cambios en la mano, antes de irse al mazo
+MAX_FAILURES = 3
+
+logger = logging.getLogger('truco.bots')
+
+
+class BotSocket:
+    """ Stands in for the websocket of a bot: the frames sent by the server
+    are passed to the bot instead of a client
+    """
+    def __init__(self, bot: 'BotPlayer'):
+        self.bot = bot
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.bot.receive(json.loads(data))
+
+    async def close(self, code: int = 1000):
+        self.bot.stop()
+
+
+class BotPlayer:
+    """ A player that plays over the socket protocol.
+
+    It keeps the last hand and game received, like a client does, and after
+    every update decides if it has to act. The decisions are taken with a
+    Monte Carlo search that runs in an executor, bounded by the latency
+    budget: if the search doesn't answer in time a simple heuristic is used.
+
+    A move rejected by the server (an error raised, or an error notified
+    when the game is in another worker) is logged and decided again after a
+    short wait. After MAX_FAILURES rejected moves without the hand changing
+    the bot goes to deck, and if it still can't play it leaves the game.
+    """
+    player_id: Optional[str]
+    game_id: str
+    budget: float  # Segundos por decisión
+    retry_delay = 0.05  # Segundos antes de reintentar una jugada rechazada
+
+    # Umbrales de probabilidad de ganar para cantar
+    truco_threshold = 0.7
+    raise_threshold = 0.85
+    envido_threshold = 0.7
+
+    def __init__(
+            self,
+            game_id: str,
+            dispatch: Dispatch,
+            executor: Executor,
+            budget: float = 0.05,
+            rng: random.Random = None,
+            on_finish: Callable[['BotPlayer'], None] = None
+            ):
+        self.player_id = None
+        self.game_id = game_id
+        self.budget = budget
+        self._dispatch = dispatch
+        self._executor = executor
+        self._rng = rng if rng is not None else random.Random()
+        self._on_finish = on_finish
+        self._players: List[str] = []
+        self._hand: Optional[Dict] = None
+        self._truco_chanted = 0  # Último nivel de truco cantado por el bot, 0 si no cantó
+        self._dirty = False
+        self._stopped = False
+        self._failures = 0
+        self._resigned = False
+        self._task: Optional[asyncio.Task] = None
+
+    def receive(self, message: Dict) -> None:
+        """ Handles a frame sent by the server """
+        event, payload = message.get('event'), message.get('payload') or {}
+
+        if event == 'gameUpdate' and payload['game']['id'] == self.game_id:
+            game = payload['game']
+            self._players = [player['id'] for player in game['players']]
+            if game['winner'] is not None:
+                # Terminó la partida, el bot se va
+                self._finish()
+                return
+        elif event == 'handUpdated' and payload['hand']['id'] == self.game_id:
+            self._hand = payload['hand']
+            self._failures = 0
+            self._resigned = False
+        elif event == 'notify' and payload.get('type') == 'ERROR':
+            # La jugada se rechazó en el worker de la partida
+            logger.warning('Bot move rejected: %s', payload.get('text'), extra=self._fields())
+            self._failures += 1
+        else:
+            return
+
+        self._wake()
+
+    def _fields(self) -> Dict:
+        return {'player_id': self.player_id, 'game_id': self.game_id}
+
+    def _finish(self) -> None:
+        self.stop()
+        if self._on_finish is not None:
+            asyncio.get_running_loop().call_soon(self._on_finish, self)
+
+    def stop(self) -> None:
+        self._stopped = True
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def _wake(self) -> None:
+        self._dirty = True
+        if not self._stopped and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._dirty and not self._stopped:
+            self._dirty = False
+            if self._failures:
+                # Da tiempo a que lleguen las actualizaciones pendientes, la mano pudo haber cambiado
+                await asyncio.sleep(self.retry_delay * self._failures)
+            try:
+                if self._failures >= MAX_FAILURES:
+                    await self._give_up()
+                    continue
+                action = await self._decide()
+                # Si llegó otra actualización mientras pensaba, se decide de nuevo
+                if action is None or self._dirty:
+                    continue
+
+                event, payload = action
+                await self._dispatch(event, {'playerId': self.player_id, 'handId': self.game_id, **payload})
+            except GameException as e:
+                logger.warning('Bot move rejected: %s', str(e), extra=self._fields())
+                self._failures += 1
+                self._dirty = True
+            except Exception as e:
+                logger.exception('Bot failed: %s', str(e), extra=self._fields())
+                self._failures += 1
+                self._dirty = True
+
+    async def _give_up(self) -> None:
+        """ Goes to deck when its moves are rejected, or leaves the game if
+        it still can't play after that
+        """
+        self._failures = 0
+        if self._resigned:
+            logger.error('Bot leaves the game, its moves are rejected', extra=self._fields())
+            self._finish()
+            return
+        self._resigned = True
+        logger.error('Bot goes to deck, its moves are rejected', extra=self._fields())
+        await self._dispatch('goToDeck', {'playerId': self.player_id, 'gameId': self.game_id})
+
+    async def _decide(self) -> Optional[Tuple[str, Dict]]:
+        """ The next event to send, None if the bot doesn't have to act """
+        hand = self._hand
+        if hand is None or hand['winner'] is not None or self.player_id not in self._players:
+            return None
+
+        me = self.player_id
+        status = hand['status']
+        envido = hand['envido']
+
+        if status == HandStatus.NOT_STARTED:
+            return ('dealCards', {}) if hand['player_dealer'] == me else None
+        if status == HandStatus.FINISHED:
+            return None
+
+        if hand['truco_status'] == Truco.NO_CANTADO:
+            self._truco_chanted = 0
+
+        observation = self._observe(hand)
+
+        if status == HandStatus.ENVIDO:
+            if envido['status'] == EnvidoStatus.ACCEPTED:
+                if envido['cards_played'].get(me) == []:
+                    cards = [to_card(card).dict() for card in best_envido_cards(self._dealt(hand))]
+                    return 'playEnvido', {'cards': cards}
+                return None
+            if hand['chant_turn'] != me:
+                return None
+            return self._respond_envido(envido, await self._search(monte_carlo.envido_win_probability, observation))
+
+        if status == HandStatus.LOCKED:
+            if hand['chant_turn'] != me:
+                return None
+            return self._respond_truco(hand, await self._search(monte_carlo.hand_win_probability, observation))
+
+        if hand['player_turn'] != me:
+            return None
+
+        # Sólo se canta si además tiene el turno de canto
+        can_chant = hand['chant_turn'] == me
+        if (can_chant and envido['status'] == EnvidoStatus.NOT_STARTED
+                and not (hand['rounds'] and self._round_finished(hand, 0))):
+            probability = await self._search(monte_carlo.envido_win_probability, observation)
+            if probability >= self.envido_threshold:
+                level = EnvidoLevels.REAL_ENVIDO if probability >= self.raise_threshold else EnvidoLevels.ENVIDO
+                return 'chantEnvido', {'level': int(level)}
+
+        level = hand['truco_status']
+        if can_chant and level < Truco.VALE_CUATRO and self._truco_chanted != level:
+            probability = await self._search(monte_carlo.hand_win_probability, observation)
+            if probability >= self.truco_threshold:
+                self._truco_chanted = level + 1
+                return 'chantTruco', {'level': level + 1}
+
+        card = to_card(await self._search(monte_carlo.best_card, observation))
+        return 'playCard', {'rank': card.rank.value, 'suit': card.suit.value}
+
+    def _respond_truco(self, hand: Dict, probability: float) -> Tuple[str, Dict]:
+        level = hand['truco_status']
+        if level < Truco.VALE_CUATRO and probability >= self.raise_threshold:
+            self._truco_chanted = level + 1
+            return 'responseToTruco', {'level': level + 1}
+
+        # Se compara lo que se espera ganar aceptando con lo que se pierde al no querer
+        if level * (2 * probability - 1) >= -(level - 1):
+            return 'responseToTruco', {'level': level}
+        return 'responseToTruco', {'level': level - 1}
+
+    def _respond_envido(self, envido: Dict, probability: float) -> Tuple[str, Dict]:
+        chanted = envido['chanted']
+        if probability >= self.raise_threshold and len(chanted) < MAX_ENVIDO_CHANTS:
+            raises = [level for level in EnvidoLevels if chanted[-1] == EnvidoLevels.ENVIDO or level > chanted[-1]]
+            if raises and raises[0] != EnvidoLevels.FALTA_ENVIDO:
+                return 'responseToEnvido', {'level': int(raises[0])}
+
+        if sum(chanted) * (2 * probability - 1) >= -(sum(chanted[:-1]) + 1):
+            return 'acceptEnvido', {}
+        return 'declineEnvido', {}
+
+    async def _search(self, search: Callable, observation: Observation):
+        """ Runs a search in the executor, with the heuristic as fallback """
+        deadline = time.monotonic() + self.budget * 0.8
+        future = asyncio.get_running_loop().run_in_executor(
+                self._executor, search, observation, deadline, self._rng.getrandbits(32))
+        try:
+            return await asyncio.wait_for(future, timeout=self.budget)
+        except asyncio.TimeoutError:
+            if search is monte_carlo.best_card:
+                return monte_carlo.rollout_card(observation.state, observation.seat)
+            return 0.5
+
+    def _dealt(self, hand: Dict) -> List[int]:
+        return [index_of(rank=card['rank'], suit=card['suit']) for card in hand['cards_dealed']]
+
+    def _round_finished(self, hand: Dict, round: int) -> bool:
+        return None not in hand['rounds'][round]['cards_played'].values()
+
+    def _observe(self, hand: Dict) -> Observation:
+        """ Builds the engine state of the hand as seen by the bot """
+        seats = {player: seat for seat, player in enumerate(self._players)}
+        seat = seats[self.player_id]
+        opponent = 1 - seat
+
+        state = HandState(cards=[0, 0], mano=seats[hand['player_hand']])
+        played = set()
+        for round, round_played in enumerate(hand['rounds']):
+            for player, card in round_played['cards_played'].items():
+                if card is not None:
+                    index = index_of(rank=card['rank'], suit=card['suit'])
+                    state.played[round * state.num_players + seats[player]] = index
+                    played.add(index)
+        state.round = max(len(hand['rounds']) - 1, 0)
+        state.turn = seats[hand['player_turn']]
+
+        dealt = self._dealt(hand)
+        state.cards[seat] = to_mask(card for card in dealt if card not in played)
+        # Las cartas que mostró el rival en el envido y todavía no jugó
+        shown = [index_of(rank=card['rank'], suit=card['suit'])
+                 for card in hand['envido']['cards_played'].get(self._players[opponent]) or []]
+        state.cards[opponent] = to_mask(card for card in shown if card not in played)
+
+        opponent_played = sum(1 for card in state.played[opponent::state.num_players] if card >= 0)
+        known = to_mask(dealt) | to_mask(played) | to_mask(shown)
+        return Observation(
+            state=state,
+            seat=seat,
+            unseen=monte_carlo.unseen_cards(known),
+            hidden=3 - opponent_played - bin(state.cards[opponent]).count('1'),
+        )
+
+
+class BotManager:
+    """ Adds bot players to the games.
+
+    The searches of all the bots run in one pool of max_workers processes,
+    by default one per CPU so the bots deciding at the same time don't wait
+    for each other and run out of their budget. The pool is started with
+    start, on the startup of the server.
+    """
+    _connection_manager: ConnectionManager
+    bots: Dict[str, BotPlayer]  # player_id -> bot
+    max_workers: int
+
+    def __init__(
+            self,
+            connection_manager: ConnectionManager = dep_connection_manager(),
+            executor: Executor = None,
+            budget: float = 0.05,
+            max_workers: int = None
+            ):
+        self._connection_manager = connection_manager
+        self._executor = executor
+        self._own_executor = False
+        self.budget = budget
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count() or 1
+        self.bots = {}
+        self._sockets: Dict[str, BotSocket] = {}
+        self._joining = set()
+
+    def start(self) -> None:
+        """ Starts the processes of the pool, so the first bots don't wait for them """
+        executor = self._get_executor()
+        if self._own_executor:
+            # Los procesos se crean a medida que se piden, uno por tarea en espera
+            for _ in range(self.max_workers):
+                executor.submit(os.getpid)
+
+    def stop(self) -> None:
+        """ Stops the pool, if it was created by the manager """
+        if self._own_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor, self._own_executor = None, False
+
+    def _get_executor(self) -> Executor:
+        # Si no se inició, el pool se crea con el primer bot. Con spawn para no copiar el event loop
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=get_context('spawn'))
+            self._own_executor = True
+        return self._executor
+
+    async def add_bot(self, game_id: str, dispatch: Dispatch) -> str:
+        """ Connects a new bot and joins it to the game.
+
+        The join is sent as a separate task, as the event adding the bot may
+        be holding the lock of the game.
+        """
+        bot = BotPlayer(game_id=game_id, dispatch=dispatch, executor=self._get_executor(),
+                        budget=self.budget, on_finish=self.remove_bot)
+        socket = BotSocket(bot)
+        bot.player_id = await self._connection_manager.connect(socket)
+        self.bots[bot.player_id] = bot
+        self._sockets[bot.player_id] = socket
+
+        task = asyncio.create_task(self._join(bot))
+        self._joining.add(task)
+        task.add_done_callback(self._joining.discard)
+        return bot.player_id
+
+    async def _join(self, bot: BotPlayer):
+        try:
+            await bot._dispatch('joinGame', {'gameId': bot.game_id, 'playerId': bot.player_id})
+        except GameException:
+            self.remove_bot(bot)
+
+    def is_bot(self, player_id: str) -> bool:
+        return player_id in self.bots
+
+    def remove_bots(self, game_id: str) -> None:
+        """ Removes the bots playing a game, ie. when the game is removed """
+        for bot in [bot for bot in self.bots.values() if bot.game_id == game_id]:
+            self.remove_bot(bot)
+
+    def remove_bot(self, bot: BotPlayer) -> None:
+        """ Stops the bot and closes its connection """
+        bot.stop()
+        socket = self._sockets.pop(bot.player_id, None)
+        self.bots.pop(bot.player_id, None)
+        if socket is not None:
+            self._connection_manager.disconnect(socket)
+
+
+bot_manager = BotManager()
+
+
+def dep_bot_manager():
+    return bot_manager
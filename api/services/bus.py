@@ -0,0 +1,233 @@
+""" A minimal publish/subscribe bus over a Unix socket.
+
+The broker is a separate process that the workers connect to. Every message
+is a json line: the clients send subscribe, unsubscribe, publish and ping
+operations, and the broker writes the published lines as they are to the
+other clients subscribed to the topic. The lines of a client are handled in
+order, so the messages a client publishes arrive in the same order to every
+subscriber.
+
+The broker doesn't wait for the subscribers: a subscriber that has more than
+max_buffer bytes waiting to be written is too slow, and its connection is
+aborted so the broker's memory stays bounded. A client whose connection is
+lost, by the broker or because it stopped, is told with on_lost and can
+connect again with reconnect.
+
+Usage (from the api folder), to run the broker:
+    python -m services.bus /tmp/truco.sock
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+
+from typing import Any, Callable, Dict, Optional, Set
+
+logger = logging.getLogger('truco.bus')
+
+# Límite de una línea, un mensaje de juego serializado entra de sobra
+LINE_LIMIT = 2 ** 24
+# Bytes pendientes de escribir a un suscriptor antes de cortarlo por lento
+MAX_BUFFER = 2 ** 26
+
+
+class Broker:
+    """ Relays the messages published to the subscribers of their topic """
+    path: str
+    max_buffer: int
+    # Métricas
+    published: int
+    delivered: int
+    dropped_subscribers: int  # Clientes cortados por lentos
+
+    def __init__(self, path: str, max_buffer: int = MAX_BUFFER):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.published = 0
+        self.delivered = 0
+        self.dropped_subscribers = 0
+        self._subscribers: Dict[str, Set[asyncio.StreamWriter]] = {}
+        self._clients: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path, limit=LINE_LIMIT)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        # Al cerrar las conexiones los clientes terminan de leer
+        tasks = list(self._clients.values())
+        for writer in list(self._clients):
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        topics = set()
+        self._clients[writer] = asyncio.current_task()
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                op = message['op']
+                if op == 'publish':
+                    self.published += 1
+                    for subscriber in self._subscribers.get(message['topic'], ()):
+                        # No se le devuelve el mensaje a quien lo publicó
+                        if subscriber is writer or subscriber.is_closing():
+                            continue
+                        if subscriber.transport.get_write_buffer_size() > self.max_buffer:
+                            self._drop(subscriber)
+                            continue
+                        subscriber.write(line)
+                        self.delivered += 1
+                elif op == 'subscribe':
+                    self._subscribers.setdefault(message['topic'], set()).add(writer)
+                    topics.add(message['topic'])
+                elif op == 'unsubscribe':
+                    self._unsubscribe(message['topic'], writer)
+                    topics.discard(message['topic'])
+                elif op == 'ping':
+                    writer.write(line)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for topic in topics:
+                self._unsubscribe(topic, writer)
+            del self._clients[writer]
+            writer.close()
+
+    def _drop(self, subscriber: asyncio.StreamWriter) -> None:
+        """ Aborts the connection of a subscriber that doesn't read its messages.
+        Its handler then removes its subscriptions
+        """
+        logger.warning("Bus: dropping a subscriber with %d bytes pending",
+                       subscriber.transport.get_write_buffer_size())
+        subscriber.transport.abort()
+        self.dropped_subscribers += 1
+
+    def _unsubscribe(self, topic: str, writer: asyncio.StreamWriter) -> None:
+        subscribers = self._subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del self._subscribers[topic]
+
+
+class BusClient:
+    """ A connection to the broker. The messages received are passed to the
+    handler with their topic, in the order they arrive.
+
+    Sending while not connected raises ConnectionError. If the connection is
+    lost the pending syncs fail and on_lost is called.
+    """
+    path: str
+
+    def __init__(self, path: str, handler: Callable[[str, Any], None], on_lost: Callable[[], None] = None):
+        self.path = path
+        self._handler = handler
+        self._on_lost = on_lost
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pings: Dict[int, asyncio.Future] = {}
+        self._next_ping = 0
+        self._topics: Set[str] = set()  # Para volver a suscribirse al reconectar
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+        self._task = asyncio.create_task(self._read())
+
+    async def reconnect(self) -> None:
+        """ Connects again after the connection was lost, with the same subscriptions """
+        await self.connect()
+        for topic in self._topics:
+            self._send({'op': 'subscribe', 'topic': topic})
+        await self.sync()
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, topic: str) -> None:
+        self._send({'op': 'subscribe', 'topic': topic})
+        self._topics.add(topic)
+
+    def unsubscribe(self, topic: str) -> None:
+        self._send({'op': 'unsubscribe', 'topic': topic})
+        self._topics.discard(topic)
+
+    def publish(self, topic: str, data: Any) -> None:
+        """ Sends a message to the subscribers of the topic, without waiting """
+        self._send({'op': 'publish', 'topic': topic, 'data': data})
+
+    async def sync(self) -> None:
+        """ Waits until the broker handled everything sent before, ie. the
+        subscriptions
+        """
+        self._next_ping += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pings[self._next_ping] = future
+        self._send({'op': 'ping', 'id': self._next_ping})
+        await future
+
+    def _send(self, message: Dict) -> None:
+        if not self.connected:
+            raise ConnectionError('Bus desconectado')
+        # El writer acumula las líneas y las escribe juntas cuando el socket puede
+        self._writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+
+    async def _read(self):
+        try:
+            async for line in self._reader:
+                message = json.loads(line)
+                if message['op'] == 'ping':
+                    self._pings.pop(message['id']).set_result(None)
+                    continue
+                try:
+                    self._handler(message['topic'], message['data'])
+                except Exception as e:
+                    # Un mensaje que no se pudo procesar no corta la conexión
+                    logger.exception("Message of %s failed: %s", message['topic'], str(e))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        # Se cortó la conexión sin llamar a close, ie. se cayó el broker
+        self._lost()
+
+    def _lost(self) -> None:
+        logger.error("Bus: connection to %s lost", self.path)
+        self._writer.close()
+        self._writer = None
+        for future in self._pings.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Bus desconectado'))
+        self._pings.clear()
+        if self._on_lost is not None:
+            self._on_lost()
+
+
+async def serve(path: str) -> None:
+    broker = Broker(path)
+    await broker.start()
+    print(f"Bus: listening on {path}")
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(serve(sys.argv[1]))
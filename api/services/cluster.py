@@ -0,0 +1,443 @@
+""" Cross-worker mode: several workers play the same games through the bus.
+
+Every game belongs to one worker, chosen by hashing its id onto a consistent
+hash ring of the workers. The owner keeps the game, its hand and its score
+in memory and runs all its events, so the events of a game never leave its
+worker. The players can be connected to any worker:
+
+    - the events of a game of another worker are forwarded to its owner,
+      with the player that sent them (the owner may not know the player).
+    - the frames for a player connected to another worker are relayed to
+      it. Remote players are kept in the ConnectionManager as connections
+      that write to the bus, so sends and rooms work the same way.
+    - the workers announce their connected players and their available
+      games, so every worker knows where to relay the frames and can show
+      all the games in the lobby.
+
+The workers join the ring when they start, and leave it when they stop.
+They also send a heartbeat every heartbeat_interval seconds: a worker not
+heard of for heartbeat_timeout seconds crashed, and it's removed from the
+ring with its players so no events nor frames are sent to it. Its games
+are lost with it. When the ring changes every worker sends the games it doesn't own anymore
+to their new owner: the game, hand and score are serialized while holding
+the lock of the game and removed locally. An event that arrives to the new
+owner before the game waits for it a moment.
+
+If the worker loses its connection to the bus, the messages it would
+publish are dropped and it tries to connect again reconnect_attempts times,
+waiting reconnect_delay seconds more each time. Once connected it says hello
+again, as a worker that was removed from the ring. If it can't connect
+on_failure is called, by default it shuts the worker down.
+
+Topics of the bus:
+    worker.<id>: events forwarded, frames relayed and games migrated to the worker
+    presence: workers and players connected and disconnected
+    games: available games of each worker
+    lobby: frames broadcast to all the connected users
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+import uuid
+
+from typing import Callable, Dict, List, Optional
+from events.socket_events import SocketController, game_id_of
+from models.models import Game, Hand, Player, Score
+from services.bus import BusClient
+from services.connection_manager import ConnectionManager, game_room
+from services.hash_ring import HashRing
+from services.lock_manager import GameLockManager
+from services.player_manager import PlayerManager
+
+# Veces que se puede reenviar un evento mientras los workers no coinciden en el dueño
+MAX_HOPS = 3
+
+logger = logging.getLogger('truco.cluster')
+
+
+class RemoteConnection:
+    """ A player connected to another worker, the frames are relayed through the bus """
+    worker: str
+    player_id: str
+    dropped: int = 0
+
+    def __init__(self, cluster: 'Cluster', worker: str, player_id: str):
+        self._cluster = cluster
+        self.worker = worker
+        self.player_id = player_id
+
+    def put(self, json_string: str, event: str = None) -> bool:
+        self._cluster.relay(worker=self.worker, player_id=self.player_id, json_string=json_string, event=event)
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+class Cluster:
+    """ Connects a worker to the others through the bus """
+    worker_id: str
+    ring: HashRing
+    migration_timeout: float  # Segundos que un evento espera a que llegue su partida
+    heartbeat_interval: float
+    heartbeat_timeout: float  # Segundos sin noticias de un worker para darlo por caído
+    reconnect_attempts: int
+    reconnect_delay: float
+    # Métricas
+    forwarded: int
+    relayed: int
+    migrated_in: int
+    migrated_out: int
+    lost_workers: int
+    unsent: int  # Mensajes descartados sin conexión al bus
+    reconnections: int
+
+    def __init__(
+            self,
+            path: str,
+            worker_id: str,
+            replicas: int = 64,
+            migration_timeout: float = 1.0,
+            heartbeat_interval: float = 1.0,
+            heartbeat_timeout: float = 5.0,
+            reconnect_attempts: int = 5,
+            reconnect_delay: float = 0.5,
+            clock: Callable[[], float] = time.monotonic,
+            on_failure: Callable[[], None] = None
+            ):
+        self.worker_id = worker_id
+        self.ring = HashRing([worker_id], replicas=replicas)
+        self.migration_timeout = migration_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+        self._clock = clock
+        self.on_failure = on_failure or self._shutdown
+        self.forwarded = 0
+        self.relayed = 0
+        self.migrated_in = 0
+        self.migrated_out = 0
+        self.lost_workers = 0
+        self.unsent = 0
+        self.reconnections = 0
+        self.games_revision = 0
+        self._bus = BusClient(path, handler=self._receive, on_lost=self._lost)
+        self._stopping = False
+        self._remote_games: Dict[str, List[Dict]] = {}  # worker -> partidas disponibles
+        self._arrivals: Dict[str, asyncio.Event] = {}  # Partidas esperadas por algún evento
+        self._pending_members: Dict[str, List[str]] = {}  # player_id -> partidas migradas que juega
+        self._last_seen: Dict[str, float] = {}  # worker -> último mensaje de presencia
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self._connection_manager: Optional[ConnectionManager] = None
+        self._socket_controller: Optional[SocketController] = None
+        self._player_manager: Optional[PlayerManager] = None
+        self._repositories: Dict = {}
+        self._lock_manager: Optional[GameLockManager] = None
+
+    def owner(self, game_id: str) -> str:
+        """ The worker that keeps the game """
+        return self.ring.owner(game_id)
+
+    def is_local(self, game_id: Optional[str]) -> bool:
+        return game_id is None or self.owner(game_id) == self.worker_id
+
+    def new_game_id(self) -> str:
+        """ An id for a game that belongs to this worker """
+        while not self.is_local(game_id := str(uuid.uuid4())):
+            pass
+        return game_id
+
+    async def start(
+            self,
+            connection_manager: ConnectionManager,
+            socket_controller: SocketController,
+            player_manager: PlayerManager,
+            repositories: Dict,
+            lock_manager: GameLockManager
+            ) -> None:
+        """ Connects to the bus and attaches the cluster to the connection
+        manager and the socket controller of the worker. The repositories
+        (kind -> repository) are the ones of the games migrated
+        """
+        self._connection_manager = connection_manager
+        self._socket_controller = socket_controller
+        self._player_manager = player_manager
+        self._repositories = repositories
+        self._lock_manager = lock_manager
+        await self._bus.connect()
+        for topic in (f'worker.{self.worker_id}', 'presence', 'games', 'lobby'):
+            self._bus.subscribe(topic)
+        await self._bus.sync()
+
+        connection_manager.cluster = self
+        socket_controller.cluster = self
+        # Los demás workers lo agregan al anillo y responden con sus jugadores y partidas
+        self._hello()
+        await self._bus.sync()
+        self._heartbeat = asyncio.create_task(self._beat())
+
+    async def stop(self) -> None:
+        """ Leaves the ring, sending the games to their new owners """
+        self._stopping = True
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        if self._bus.connected:
+            self._publish('presence', {'worker': self.worker_id,
+                                       'disconnected': list(self._connection_manager.active_connections)})
+            if self.ring.workers != [self.worker_id]:
+                self.ring.remove(self.worker_id)
+                await self.rebalance()
+            self._publish('presence', {'worker': self.worker_id, 'bye': True})
+            await self._bus.sync()
+        await self._bus.close()
+        self._connection_manager.cluster = None
+        self._socket_controller.cluster = None
+
+    def _publish(self, topic: str, data) -> None:
+        if not self._bus.connected:
+            # Sin bus no hay a quién mandarlo, se reconecta o se apaga el worker
+            self.unsent += 1
+            return
+        self._bus.publish(topic, data)
+
+    def _lost(self) -> None:
+        if not self._stopping:
+            self._spawn(self._rejoin())
+
+    async def _rejoin(self) -> None:
+        """ Connects to the bus again, or shuts the worker down """
+        for attempt in range(1, self.reconnect_attempts + 1):
+            await asyncio.sleep(self.reconnect_delay * attempt)
+            try:
+                await self._bus.reconnect()
+            except (ConnectionError, OSError) as e:
+                logger.warning("Bus: reconnection %d of %d failed: %s", attempt, self.reconnect_attempts, str(e))
+                continue
+            logger.info("Bus: worker %s reconnected", self.worker_id)
+            self.reconnections += 1
+            # Los demás lo pueden haber dado por caído, se les vuelve a saludar
+            self._last_seen = dict.fromkeys(self._last_seen, self._clock())
+            self._hello()
+            return
+
+        logger.critical("Bus: worker %s can't reconnect, shutting down", self.worker_id)
+        self.on_failure()
+
+    @staticmethod
+    def _shutdown() -> None:
+        # El servidor termina ordenadamente, como con Ctrl+C
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def _hello(self) -> None:
+        self._publish('presence', {'worker': self.worker_id, 'hello': True,
+                                   'connected': list(self._connection_manager.active_connections)})
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if not self._bus.connected:
+                # Sin bus no llegan los latidos de nadie, no se los da por caídos
+                continue
+            self._publish('presence', {'worker': self.worker_id})
+            self.check_workers()
+
+    def check_workers(self) -> None:
+        """ Removes the workers that stopped sending heartbeats """
+        now = self._clock()
+        for worker in list(self.ring.workers):
+            if worker != self.worker_id and now - self._last_seen.setdefault(worker, now) > self.heartbeat_timeout:
+                logger.warning("Worker %s is not responding, removing it", worker)
+                self._remove_worker(worker)
+                self.lost_workers += 1
+
+    def _remove_worker(self, worker: str) -> None:
+        self.ring.remove(worker)
+        self._last_seen.pop(worker, None)
+        self._remote_games.pop(worker, None)
+        self.games_revision += 1
+        # Los jugadores conectados a ese worker se desconectaron con él
+        for player_id, connection in list(self._connection_manager.remote_connections.items()):
+            if connection.worker == worker:
+                self._connection_manager.remove_remote(player_id)
+                self._socket_controller.forget_player(player_id=player_id)
+
+    def forward(self, event: str, payload: Dict, game_id: str, hops: int = 0) -> None:
+        """ Sends an event to the worker that owns the game """
+        player = self._player_manager.find_player(player_id=payload.get('playerId'))
+        self._publish(f'worker.{self.owner(game_id)}', {
+            'event': event,
+            'payload': payload,
+            'player': player.dict() if player is not None else None,
+            'hops': hops
+        })
+        self.forwarded += 1
+
+    def relay(self, worker: str, player_id: str, json_string: str, event: str = None) -> None:
+        """ Sends a frame to a player connected to another worker """
+        self._publish(f'worker.{worker}', {'playerId': player_id, 'frame': json_string, 'event': event})
+        self.relayed += 1
+
+    def connected(self, player_id: str) -> None:
+        self._publish('presence', {'worker': self.worker_id, 'connected': [player_id]})
+
+    def disconnected(self, player_id: str) -> None:
+        self._publish('presence', {'worker': self.worker_id, 'disconnected': [player_id]})
+
+    def broadcast(self, json_string: str, event: str = None) -> None:
+        """ Sends a frame to the users connected to the other workers """
+        self._publish('lobby', {'frame': json_string, 'event': event})
+
+    def announce_games(self, games: List[Dict]) -> None:
+        """ Tells the other workers the available games of this worker """
+        self._publish('games', {'worker': self.worker_id, 'games': games})
+
+    def remote_games(self) -> List[Dict]:
+        """ The available games of the other workers """
+        return [game for worker in sorted(self._remote_games) for game in self._remote_games[worker]]
+
+    async def rebalance(self) -> None:
+        """ Sends the local games that belong to other workers to their owners """
+        moved = []
+        for game in self._repositories['game'].get_all():
+            if self.is_local(game.id):
+                continue
+            # Con el lock ningún evento de la partida queda a medias
+            async with self._lock_manager.lock(game.id):
+                if self._repositories['game'].get_by_id(id=game.id) is game and not self.is_local(game.id):
+                    self._migrate(game)
+                    moved.append(game.id)
+
+        if moved:
+            await self._socket_controller.forget_games(moved)
+
+    def _migrate(self, game: Game) -> None:
+        hand: Hand = self._repositories['hand'].get_by_id(id=game.id)
+        score: Score = self._repositories['score'].get_by_id(id=game.id)
+        self._publish(f'worker.{self.owner(game.id)}', {'migrate': {
+            'game': json.loads(game.json()),
+            'hand': json.loads(hand.json()) if hand is not None else None,
+            'score': json.loads(score.json()) if score is not None else None,
+        }})
+        self._repositories['game'].remove(game)
+        if hand is not None:
+            self._repositories['hand'].remove(hand)
+        if score is not None:
+            self._repositories['score'].remove(score)
+        self.migrated_out += 1
+
+    def _arrive(self, data: Dict) -> None:
+        """ Keeps a game migrated from another worker """
+        game = Game.parse_obj(data['game'])
+        for player in game.players:
+            if self._player_manager.find_player(player_id=player.id) is None:
+                self._player_manager.register(player)
+            if self._connection_manager.is_connected(player.id):
+                self._connection_manager.subscribe(room=game_room(game.id), player_id=player.id)
+            else:
+                # Se suscribe cuando se sepa en qué worker está conectado
+                self._pending_members.setdefault(player.id, []).append(game.id)
+
+        self._repositories['game'].save(game)
+        if data['hand'] is not None:
+            self._repositories['hand'].save(Hand.parse_obj(data['hand']))
+        if data['score'] is not None:
+            self._repositories['score'].save(Score.parse_obj(data['score']))
+        self.migrated_in += 1
+
+        arrival = self._arrivals.pop(game.id, None)
+        if arrival is not None:
+            arrival.set()
+        self._spawn(self._socket_controller.gamesUpdate())
+
+    def _receive(self, topic: str, data) -> None:
+        if topic == 'lobby':
+            self._connection_manager.publish_local_lobby(data['frame'], event=data['event'])
+        elif topic == 'presence':
+            self._presence(data)
+        elif topic == 'games':
+            self._remote_games[data['worker']] = data['games']
+            self.games_revision += 1
+        elif 'frame' in data:
+            self._connection_manager.deliver(player_id=data['playerId'], json_string=data['frame'],
+                                             event=data.get('event'))
+        elif 'migrate' in data:
+            self._arrive(data['migrate'])
+        else:
+            # Se ejecuta en otra tarea, el lock de la partida mantiene el orden de los eventos
+            self._spawn(self._run(data['event'], data['payload'], data['player'], data['hops']))
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _presence(self, data: Dict) -> None:
+        worker = data['worker']
+        if data.get('bye'):
+            if worker in self.ring:
+                self._remove_worker(worker)
+            return
+
+        self._last_seen[worker] = self._clock()
+        if worker not in self.ring:
+            self.ring.add(worker)
+            self._spawn(self.rebalance())
+            if not data.get('hello'):
+                # Se lo había dado por caído, los saludos de todos le devuelven sus jugadores
+                self._hello()
+
+        for player_id in data.get('connected', ()):
+            resumed = self._connection_manager.add_remote(
+                    player_id, RemoteConnection(self, worker=worker, player_id=player_id))
+            for game_id in self._pending_members.pop(player_id, ()):
+                self._connection_manager.subscribe(room=game_room(game_id), player_id=player_id)
+            if resumed:
+                # El jugador reanudó su sesión en su worker, se le envían las partidas de este
+                for game_id in self._connection_manager.games_of(player_id):
+                    self._spawn(self._run('resumeGame', {'playerId': player_id, 'gameId': game_id}, None, 0))
+        for player_id in data.get('disconnected', ()):
+            self._pending_members.pop(player_id, None)
+            # El jugador queda reservado por la ventana de gracia, como en su worker
+            self._connection_manager.remove_remote(player_id)
+            self._socket_controller.forget_player(player_id=player_id)
+
+        if data.get('hello'):
+            self._publish('presence', {'worker': self.worker_id,
+                                       'connected': list(self._connection_manager.active_connections)})
+            self.announce_games(self._socket_controller.local_games())
+
+    async def _run(self, event: str, payload: Dict, player: Optional[Dict], hops: int) -> None:
+        if player is not None and self._player_manager.find_player(player_id=player['id']) is None:
+            self._player_manager.register(Player(**player))
+
+        game_id = game_id_of(payload)
+        try:
+            if not self.is_local(game_id):
+                # Este worker todavía no sabía que la partida es de otro
+                if hops >= MAX_HOPS:
+                    raise Exception('Partida no disponible')
+                self.forward(event=event, payload=payload, game_id=game_id, hops=hops + 1)
+                return
+
+            await self._socket_controller.call_event(event=event, payload=payload)
+        except Exception as e:
+            # El error se notifica al jugador en su worker
+            if player is not None:
+                await self._socket_controller.notifyPlayer(
+                        playerId=player['id'], title='ERROR', text=str(e), type='ERROR')
+
+    async def wait_for_game(self, game_id: Optional[str]) -> None:
+        """ Waits a moment for a game that may be migrating to this worker """
+        if game_id is None or self._repositories['game'].get_by_id(id=game_id) is not None:
+            return
+        arrival = self._arrivals.setdefault(game_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(arrival.wait(), timeout=self.migration_timeout)
+        except asyncio.TimeoutError:
+            self._arrivals.pop(game_id, None)
@@ -1,49 +1,428 @@
+import asyncio
 import json
 
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Set, TYPE_CHECKING, Tuple, Union
 from fastapi import WebSocket
+from models.models import Game
 from services.player_manager import PlayerManager
+from services.session_manager import SessionManager, dep_session_manager
 from repositories.repository import dep_players_repository
 
+if TYPE_CHECKING:
+    from services.cluster import Cluster, RemoteConnection
+
+
+class SlowConsumerPolicy(str, Enum):
+    """ What to do when the outbound queue of a connection is full.
+
+    The event of each frame is passed with it. Only the frames of the chat,
+    the lobby and the notifications are discarded: losing a frame with the
+    state of a game (STATE_EVENTS) leaves the client out of sync, so the
+    connection is closed instead with any policy. The client then resumes
+    its session and gets a fresh snapshot of its games.
+    """
+    DROP = 'DROP'  # Descarta el mensaje nuevo
+    DROP_OLDEST = 'DROP_OLDEST'  # Descarta el mensaje más viejo de la cola y encola el nuevo
+    # Un mensaje de COALESCED_EVENTS reemplaza al del mismo evento que sigue en la cola,
+    # con la cola llena el resto se descarta como con DROP_OLDEST
+    COALESCE = 'COALESCE'
+    DISCONNECT = 'DISCONNECT'  # Cierra la conexión del cliente lento
+
+
+# Eventos con el estado de una partida, no se pueden descartar
+STATE_EVENTS = frozenset(('gameUpdate', 'handUpdated', 'handPatch', 'handSnapshot', 'updateScore'))
+# Eventos en los que sólo importa el último mensaje, ie. la lista de partidas del lobby
+COALESCED_EVENTS = frozenset(('gamesUpdate',))
+
+
+class Connection:
+    """ A websocket connection with its own outbound queue and writer task.
+
+    The queue has the event of each frame with it. The frames coalesced are
+    kept apart, by event, so a newer one takes the place of the queued one.
+    """
+    websocket: WebSocket
+    queue: asyncio.Queue  # (evento, frame), el frame es None si está en _coalesced
+    policy: SlowConsumerPolicy
+    dropped: int  # Mensajes descartados por cola llena
+    coalesced: int  # Mensajes reemplazados por uno más nuevo del mismo evento
+    closing: bool  # Se cerró, ie. por cliente lento, los mensajes nuevos se ignoran
+
+    def __init__(self, websocket: WebSocket, max_queue_size: int, policy: SlowConsumerPolicy):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.policy = policy
+        self.dropped = 0
+        self.coalesced = 0
+        self.closing = False
+        self._coalesced: Dict[str, str] = {}  # evento -> último frame
+        self._writer = asyncio.create_task(self._write())
+
+    def put(self, json_string: str, event: str = None) -> bool:
+        """ Enqueues a message without waiting for the socket.
+
+        Returns:
+            bool: False if the client is too slow and has to be disconnected
+        """
+        if self.closing:
+            # Al reanudar la sesión el cliente recibe el estado de sus partidas
+            return True
+
+        if event in self._coalesced:
+            self._coalesced[event] = json_string
+            self.coalesced += 1
+            return True
+
+        if self._enqueue(json_string, event):
+            return True
+
+        if self.policy == SlowConsumerPolicy.DISCONNECT or event in STATE_EVENTS:
+            return False
+
+        if self.policy != SlowConsumerPolicy.DROP:
+            oldest = self._dequeue()
+            if oldest in STATE_EVENTS:
+                return False
+            self._enqueue(json_string, event)
+
+        self.dropped += 1
+        return True
+
+    def _enqueue(self, json_string: str, event: Optional[str]) -> bool:
+        """ Returns False if the queue is full """
+        coalesce = self.policy == SlowConsumerPolicy.COALESCE and event in COALESCED_EVENTS
+        try:
+            self.queue.put_nowait((event, None if coalesce else json_string))
+        except asyncio.QueueFull:
+            return False
+        if coalesce:
+            self._coalesced[event] = json_string
+        return True
+
+    def _dequeue(self) -> Optional[str]:
+        """ Discards the oldest frame of the queue, returns its event """
+        event, json_string = self.queue.get_nowait()
+        self.queue.task_done()
+        if json_string is None:
+            del self._coalesced[event]
+        return event
+
+    async def drain(self) -> None:
+        """ Waits until all the queued messages were written to the socket """
+        await self.queue.join()
+
+    def close(self) -> None:
+        """ Stops the writer task """
+        self.closing = True
+        self._writer.cancel()
+
+    async def _write(self):
+        while True:
+            event, json_string = await self.queue.get()
+            if json_string is None:
+                json_string = self._coalesced.pop(event)
+            try:
+                await self.websocket.send_text(json_string)
+            except Exception:
+                # El socket se cerró, el loop de recepción se encarga de desconectarlo
+                return
+            finally:
+                self.queue.task_done()
+
+
+# Todos los jugadores conectados están en el lobby
+LOBBY = 'lobby'
+GAME_ROOM_PREFIX = 'game:'
+
+
+def game_room(game_id: str) -> str:
+    """ The room of the players of a game """
+    return f'{GAME_ROOM_PREFIX}{game_id}'
+
 
 class ConnectionManager:
-    """ Handles real time connections via websockets """
-    active_connections: dict[str, WebSocket] = {}
+    """ Handles real time connections via websockets.
+
+    The connections are grouped in rooms: every player is in the lobby while
+    connected, and in the room of each game joined. Publishing to a room
+    enqueues the frame in the connections of its members, which are kept in
+    the room, and the writer tasks of the connections send it concurrently.
+    The player of each socket is indexed too, so a disconnect doesn't go
+    through all the connections.
+
+    In cross-worker mode (see services.cluster) the players connected to
+    other workers are kept in remote_connections, and can be sent frames
+    and be members of rooms like the local ones.
+
+    With sessions, a player that disconnects is not removed right away: its
+    id and its rooms are reserved for the grace window, and a socket that
+    connects with its session token takes them back. The players of the
+    games restored on start are reserved the same way with reserve.
+    """
+    active_connections: dict[str, Connection]
+    remote_connections: Dict[str, 'RemoteConnection']
+    cluster: Optional['Cluster'] = None
+    _player_of: Dict[int, str]  # id(websocket) -> player_id, los WebSocket no son hasheables
+    _rooms: Dict[str, Dict[str, Union[Connection, 'RemoteConnection']]]  # room -> player_id -> conexión
+    _rooms_of: Dict[str, Set[str]]  # player_id -> rooms en las que está
+    _reserved: Dict[str, Tuple[asyncio.TimerHandle, Set[str]]]  # player_id -> (expiración, rooms)
     player_service: PlayerManager = PlayerManager(dep_players_repository())
+    sessions: Optional[SessionManager] = None
+    max_queue_size: int
+    slow_consumer_policy: SlowConsumerPolicy
+
+    def __init__(
+            self,
+            max_queue_size: int = 256,
+            slow_consumer_policy: SlowConsumerPolicy = SlowConsumerPolicy.COALESCE,
+            player_service: PlayerManager = None,
+            sessions: SessionManager = None
+            ):
+        self.active_connections = {}
+        self.remote_connections = {}
+        self._player_of = {}
+        self._rooms = {}
+        self._rooms_of = {}
+        self._reserved = {}
+        self._closing = set()
+        self.max_queue_size = max_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        if player_service is not None:
+            self.player_service = player_service
+        if sessions is not None:
+            self.sessions = sessions
 
-    async def connect(self, websocket: WebSocket) -> str:
-        """ Adds a new websocket connection """
+    async def connect(self, websocket: WebSocket, token: str = None) -> str:
+        """ Adds a new websocket connection.
+
+        If the token is the session of a player that is still reserved, the
+        connection takes its id and its rooms back, otherwise a new player
+        is created.
+        """
         await websocket.accept()
-        player = self.player_service.create()
-        self.active_connections[player.id] = websocket
-        await websocket.send_text(
-                json.dumps({"event": "connect",
-                            "payload": {
-                                "player": {"id": player.id, "name": player.name}
-                                }
-                            })
-            )
+        player_id = self.sessions.verify(token) if self.sessions is not None else None
+        rooms = self._take_reservation(player_id)
+        player = self.player_service.find_player(player_id=player_id) if rooms is not None else None
+        if player is None:
+            player, rooms = self.player_service.create(), set()
+
+        self.active_connections[player.id] = Connection(
+                websocket=websocket,
+                max_queue_size=self.max_queue_size,
+                policy=self.slow_consumer_policy
+        )
+        self._player_of[id(websocket)] = player.id
+        self.subscribe(room=LOBBY, player_id=player.id)
+        for room in rooms:
+            self.subscribe(room=room, player_id=player.id)
+        if self.cluster is not None:
+            self.cluster.connected(player.id)
+
+        payload = {"player": {"id": player.id, "name": player.name}}
+        if self.sessions is not None:
+            payload["token"] = self.sessions.issue(player.id)
+            payload["resumed"] = player.id == player_id
+        await self.send(json.dumps({"event": "connect", "payload": payload}), player_id=player.id, event='connect')
         return player.id
 
     def disconnect(self, websocket: WebSocket):
         """ Removes a websocket connection """
-        player_id = None
-        for id, socket in self.active_connections.items():
-            if socket == websocket:
-                player_id = id
+        player_id = self._player_of.pop(id(websocket))
+        rooms = self._rooms_of.pop(player_id, set())
+        for room in rooms:
+            self._remove_member(room, player_id)
+        self.active_connections.pop(player_id).close()
+        self._release(player_id, rooms)
+        if self.cluster is not None:
+            self.cluster.disconnected(player_id)
+
+    def add_remote(self, player_id: str, connection: 'RemoteConnection') -> bool:
+        """ Adds a player connected to another worker.
+
+        Returns:
+            bool: True if the player was reserved and got its rooms back
+        """
+        self.remote_connections[player_id] = connection
+        rooms = self._take_reservation(player_id)
+        for room in rooms or ():
+            self.subscribe(room=room, player_id=player_id)
+        return rooms is not None
+
+    def remove_remote(self, player_id: str) -> None:
+        """ Removes a player that disconnected from another worker """
+        rooms = set()
+        if self.remote_connections.pop(player_id, None) is not None:
+            rooms = self._rooms_of.pop(player_id, set())
+            for room in rooms:
+                self._remove_member(room, player_id)
+        self._release(player_id, rooms)
+
+    def _release(self, player_id: str, rooms: Set[str]) -> None:
+        """ Removes a disconnected player, or reserves it for the grace window """
+        if self.sessions is None:
+            self.player_service.remove_player(player_id=player_id)
+            return
+        self.reserve(player_id, rooms)
+
+    def reserve(self, player_id: str, rooms: Set[str]) -> None:
+        """ Reserves a player that is not connected for the grace window, with
+        the rooms it gets back when it connects with its session token, ie.
+        the players of the games restored after a restart
+        """
+        if self.sessions is None or self.is_connected(player_id):
+            return
+        self._take_reservation(player_id)
+        expiration = asyncio.get_running_loop().call_later(self.sessions.grace, self._expire, player_id)
+        self._reserved[player_id] = (expiration, set(rooms))
+
+    def reserve_games(self, games: Iterable[Game]) -> None:
+        """ Reserves the players seated in the games not finished, with the
+        room of each one, ie. the games restored from the journal or SQLite
+        """
+        rooms: Dict[str, Set[str]] = {}
+        for game in games:
+            if game.winner is None:
+                for player in game.players:
+                    rooms.setdefault(player.id, set()).add(game_room(game.id))
+        for player_id, player_rooms in rooms.items():
+            self.reserve(player_id, player_rooms)
+
+    def _take_reservation(self, player_id: Optional[str]) -> Optional[Set[str]]:
+        """ Ends the reservation of a player, returns its rooms if it was reserved """
+        reservation = self._reserved.pop(player_id, None)
+        if reservation is None:
+            return None
+        expiration, rooms = reservation
+        expiration.cancel()
+        return rooms
+
+    def _expire(self, player_id: str) -> None:
+        # Terminó la ventana de gracia sin que el jugador vuelva
+        del self._reserved[player_id]
         self.player_service.remove_player(player_id=player_id)
-        del self.active_connections[player_id]
 
-    async def send(self, json_string: str, player_id: str):
-        """ Sends a json string to a single websocket user """
-        await self.active_connections[player_id].send_text(json_string)
+    def is_reserved(self, player_id: str) -> bool:
+        """ True if the player is disconnected but can still resume its session """
+        return player_id in self._reserved
+
+    def reserved_count(self) -> int:
+        """ Number of disconnected players within their grace window """
+        return len(self._reserved)
+
+    def queue_depths(self) -> List[int]:
+        """ Messages waiting in the outbound queue of each local connection """
+        return [connection.queue.qsize() for connection in self.active_connections.values()]
+
+    def games_of(self, player_id: str) -> List[str]:
+        """ Returns the ids of the games whose room the player is in """
+        return [room[len(GAME_ROOM_PREFIX):] for room in self._rooms_of.get(player_id, ())
+                if room.startswith(GAME_ROOM_PREFIX)]
+
+    def is_connected(self, player_id: str) -> bool:
+        return player_id in self.active_connections or player_id in self.remote_connections
 
-    async def broadcast(self, json_string: str):
+    def _connection(self, player_id: str) -> Optional[Union[Connection, 'RemoteConnection']]:
+        connection = self.active_connections.get(player_id)
+        return connection if connection is not None else self.remote_connections.get(player_id)
+
+    def player_of(self, websocket: WebSocket) -> str:
+        """ Returns the id of the player connected with the websocket """
+        return self._player_of.get(id(websocket))
+
+    def subscribe(self, room: str, player_id: str) -> None:
+        """ Adds a connected player to a room """
+        connection = self._connection(player_id)
+        if connection is not None:
+            self._rooms.setdefault(room, {})[player_id] = connection
+            self._rooms_of.setdefault(player_id, set()).add(room)
+
+    def unsubscribe(self, room: str, player_id: str) -> None:
+        """ Removes a player from a room """
+        rooms = self._rooms_of.get(player_id)
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self._rooms_of[player_id]
+        self._remove_member(room, player_id)
+
+    def _remove_member(self, room: str, player_id: str) -> None:
+        members = self._rooms.get(room)
+        if members is not None:
+            members.pop(player_id, None)
+            if not members:
+                del self._rooms[room]
+
+    def close_room(self, room: str) -> None:
+        """ Removes a room with all its members, ie. when its game was removed """
+        for player_id in self._rooms.pop(room, {}):
+            rooms = self._rooms_of.get(player_id)
+            if rooms is not None:
+                rooms.discard(room)
+                if not rooms:
+                    del self._rooms_of[player_id]
+        # Los jugadores reservados no vuelven a una partida eliminada
+        for _, rooms in self._reserved.values():
+            rooms.discard(room)
+
+    def members(self, room: str) -> Set[str]:
+        """ Returns the ids of the players in a room """
+        return set(self._rooms.get(room, ()))
+
+    async def send(self, json_string: str, player_id: str, event: str = None):
+        """ Sends a json string to a single websocket user. The event decides
+        what is done with it if the client is too slow (see SlowConsumerPolicy)
+        """
+        connection = self._connection(player_id)
+        if connection is not None and not connection.put(json_string, event):
+            self._drop_slow_consumer(connection)
+
+    def deliver(self, player_id: str, json_string: str, event: str = None) -> None:
+        """ Sends a json string relayed by another worker to a local user """
+        connection = self.active_connections.get(player_id)
+        if connection is not None and not connection.put(json_string, event):
+            self._drop_slow_consumer(connection)
+
+    async def publish(self, room: str, json_string: str, event: str = None):
+        """ Sends a json string to all the players in a room """
+        self._publish(room, json_string, event)
+
+    def _publish(self, room: str, json_string: str, event: Optional[str]) -> None:
+        for connection in self._rooms.get(room, {}).values():
+            if not connection.put(json_string, event):
+                self._drop_slow_consumer(connection)
+
+    async def broadcast(self, json_string: str, event: str = None):
         """ Sends a json string all connected users """
-        for connection in self.active_connections.values():
-            await connection.send_text(json_string)
+        self._publish(LOBBY, json_string, event)
+        if self.cluster is not None:
+            self.cluster.broadcast(json_string, event)
+
+    def publish_local_lobby(self, json_string: str, event: str = None) -> None:
+        """ Sends a json string broadcast by another worker to the local users """
+        self._publish(LOBBY, json_string, event)
+
+    def _drop_slow_consumer(self, connection: Connection):
+        """ Closes the socket of a client that can't keep up with the messages.
+        The receive loop of the socket then removes the connection, until
+        then it ignores the messages and stays in its rooms for the session
+        """
+        if connection.closing:
+            return
+        connection.close()
+        # El cierre también puede bloquearse, se hace en otra tarea
+        task = asyncio.create_task(self._close_socket(connection.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close_socket(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(sessions=dep_session_manager())
 
 
 def dep_connection_manager():
@@ -1,6 +1,6 @@
 from typing import List
 from models.models import (
-    Hand, Card, Player, HandStatus, EnvidoLevels, EnvidoStatus
+    Hand, Card, Player, HandStatus, EnvidoLevels, EnvidoStatus, get_envido_of_card
 )
 from services.exceptions import GameException
 from repositories.repository import (
@@ -122,12 +122,9 @@ class EnvidoManager:
     def _calculate_envido(self, cards: List[Card]) -> int:
         """ Calculates the envido value for the cards passed """
         if len(cards) == 2:
-            score = 20
-            for card in cards:
-                score += int(card.rank) if int(card.rank) < 10 else 0
-            return score
+            return 20 + get_envido_of_card(cards[0].rank, cards[0].suit) + get_envido_of_card(cards[1].rank, cards[1].suit)
         else:
-            return int(cards[0].rank) if int(cards[0].rank) < 10 else 0
+            return get_envido_of_card(cards[0].rank, cards[0].suit)
 
     def _next_player_chant_turn(self, hand: Hand) -> str:
         """ Determines the chant turn of the next player in the hand """
@@ -1,7 +1,7 @@
 import uuid
 
 from typing import List, Optional, Dict, Union
-from models.models import Game, Hand
+from models.models import Game, Hand, Score
 from services.exceptions import GameException
 from services.hand_manager import HandManager
 from services.score_manager import ScoreManager
@@ -9,7 +9,8 @@ from services.score_manager import ScoreManager
 from repositories.repository import (
         AbstractPlayerRepository, dep_players_repository,
         AbstractGameRepository, dep_game_repository,
-        AbstractHandRepository, dep_hand_repository
+        AbstractHandRepository, dep_hand_repository,
+        AbstractScoreRepository, dep_scores_repository
 )
 
 
@@ -17,25 +18,33 @@ class GameManager:
     """ Manages games of truco """
     _game_repository: AbstractGameRepository
     _player_repository: AbstractPlayerRepository
+    _hand_repository: AbstractHandRepository
+    _score_repository: AbstractScoreRepository
     _hand_manager: HandManager = HandManager()
     _score_manager: ScoreManager = ScoreManager()
 
     def __init__(self,
                  games: AbstractGameRepository = dep_game_repository(),
                  players: AbstractPlayerRepository = dep_players_repository(),
-                 hands: AbstractHandRepository = dep_hand_repository()
+                 hands: AbstractHandRepository = dep_hand_repository(),
+                 scores: AbstractScoreRepository = dep_scores_repository()
                  ):
         self._game_repository = games
         self._player_repository = players
+        self._hand_repository = hands
+        self._score_repository = scores
 
     def get_game(self, id: str) -> Optional[Game]:
         """ Returns a game """
         return self._game_repository.get_by_id(id=id)
 
-    def create(self, rules: Dict[str, Union[int, bool]]) -> Game:
-        """ Creates a new game of truco in the server """
+    def create(self, rules: Dict[str, Union[int, bool]], id: str = None) -> Game:
+        """ Creates a new game of truco in the server, with a new id if none is passed """
+        if id is not None and self._game_repository.get_by_id(id=id) is not None:
+            raise GameException('La partida ya existe')
+
         game: Game = Game(rules=rules)
-        game.id = str(uuid.uuid4())
+        game.id = id if id is not None else str(uuid.uuid4())
         self._game_repository.save(game)
 
         return game
@@ -63,12 +72,24 @@ class GameManager:
         """ Returns available games to join """
         return self._game_repository.avaliable_games()
 
+    def get_available_games_revision(self) -> int:
+        """ Returns the revision of the available games, it changes when a
+        game is created, joined or removed
+        """
+        return self._game_repository.avaliable_games_revision()
+
     def remove_game(self, gameId: str) -> None:
-        """ Deletes the game from server """
+        """ Deletes the game from server, with its hand and score """
         game: Game = self.get_game(id=gameId)
         hand: Hand = self._hand_repository.get_by_id(id=gameId)
-        self._game_repository.remove(game)
-        self._hand_repository.remove(hand)
+        score: Score = self._score_repository.get_by_id(id=gameId)
+        if game is not None:
+            self._game_repository.remove(game)
+        # Si la partida no empezó no tiene mano ni puntaje
+        if hand is not None:
+            self._hand_repository.remove(hand)
+        if score is not None:
+            self._score_repository.remove(score)
 
 
 def dep_game_manager():
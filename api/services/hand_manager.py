@@ -2,9 +2,11 @@ import random
 
 from typing import List, Dict
 from models.models import (
-    Hand, Suit, Rank, Card, Player, Round, Truco, HandStatus, Envido, EnvidoLevels
+    Hand, Card, Player, Round, Truco, HandStatus, Envido, EnvidoLevels
 )
 from services.exceptions import GameException
+from engine.cards import CARDS, index_of, to_index, to_card
+from engine.state import MAX_ROUNDS, from_hand
 from repositories.repository import (
         AbstractHandRepository, dep_hand_repository,
         AbstractPlayerRepository, dep_players_repository,
@@ -27,7 +29,7 @@ class HandManager:
         self._hand_repository = hands
         self._player_repository = players
         self._game_repository = games
-        self.deck = [Card(suit=suit, rank=rank) for rank in Rank for suit in Suit]
+        self.deck = list(CARDS)
 
     def get_hand(self, id: int) -> Hand:
         return self._hand_repository.get_by_id(id=id)
@@ -52,16 +54,25 @@ class HandManager:
         return hand.cards_dealed
 
     def play_card(self, hand_id: int, player_id: str, rank: str, suit: str) -> Hand:
-        """ Performs a card play on a game
+        """ Performs a card play on a game.
+
+        The move is played on the engine state of the hand (see
+        engine.state), that has the rules of the turns and the winners, and
+        its result is copied to the hand.
 
             Returns:
                 cards: Dict[str, List[Card]] the cards played on the hand
         """
-        card: Card = Card(suit=suit, rank=rank)
+        try:
+            card_index = index_of(rank=rank, suit=suit)
+        except (ValueError, KeyError):
+            raise GameException('Carta inválida')
+
         hand: Hand = self._hand_repository.get_by_id(id=hand_id)
-        players: List[Player] = self._game_repository.get_by_id(id=hand_id).players
+        players: List[str] = [player.id for player in self._game_repository.get_by_id(id=hand_id).players]
 
-        if card not in hand.cards_dealed[player_id]:
+        # Se comparan los índices de las cartas en vez de los modelos
+        if card_index not in [to_index(dealed) for dealed in hand.cards_dealed.get(player_id, [])]:
             raise GameException('No tienes ésa carta')
 
         if hand.player_turn != player_id:
@@ -70,22 +81,25 @@ class HandManager:
         if hand.status != HandStatus.IN_PROGRESS:
             raise GameException('Acción inválidad')
 
+        state = from_hand(hand, players=players)
+        try:
+            round_finished = state.play(seat=players.index(player_id), card=card_index)
+        except ValueError as e:
+            # La carta ya se jugó
+            raise GameException(str(e))
+
         # Juega la carta y actualiza los turnos
-        hand.rounds[-1].cards_played[player_id] = card
-        hand.player_turn = self._next_player_turn(hand=hand)
+        hand.rounds[-1].cards_played[player_id] = to_card(card_index)
+        hand.player_turn = players[state.turn]
         hand.chant_turn = hand.player_turn
 
-        round_finished = True
-        for player in players:
-            if hand.rounds[-1].cards_played[player.id] is None:
-                round_finished = False
-
-        if round_finished and len(hand.rounds) < 3:
-            cards_played = {player.id: None for player in players}
-            hand.rounds.append(Round(cards_played=cards_played))
+        if round_finished and len(hand.rounds) < MAX_ROUNDS:
+            # Las cartas ya son válidas, no hace falta validar la ronda nueva
+            hand.rounds.append(Round.construct(cards_played=dict.fromkeys(players)))
 
-        if hand.check_winner:
-            hand.winner = hand.check_winner
+        winner = state.winner()
+        if winner is not None:
+            hand.winner = players[winner]
 
         self._hand_repository.update(hand)
 
@@ -144,27 +158,3 @@ class HandManager:
         hand = Hand()
         hand.id = game_id
         self._hand_repository.save(hand)
-
-    # TODO, improve for multiple players
-    def _next_player_turn(self, hand: Hand) -> str:
-        """ Determines the turn of the next player in the hand """
-        players = self._game_repository.get_by_id(id=hand.id).players
-
-        # Reglas para determinar el turno:
-        # Siempre empieza el jugador a la derecha de la 'mano' y gira el turno hasta llegar al repartidor
-        # El que ganó el round es el que inicia el próximo round y rota en el mismo sentino
-        # Si va parda juega la siguiente carta el ultimo que empardó
-
-        # Si ya hay ganador, empieza el nuevo round el que ganó el anterior
-        if hand.rounds[-1].winner:
-            # Ojo, devuelve al último de la lista, que no necesariamente es el último que empardó
-            return hand.rounds[-1].winner[-1]
-        else:
-            # Sino sigo el orden normal de la lista hasta que todos juegan la carta y haya ganador
-            player = [player for player in players if player.id == hand.player_turn]
-            player_turn_index = players.index(player[0])
-
-            if player_turn_index == len(players) - 1:
-                return players[0].id
-            else:
-                return players[player_turn_index + 1].id
@@ -0,0 +1,53 @@
+import bisect
+import hashlib
+
+from typing import Dict, Iterable, List
+
+
+class HashRing:
+    """ Consistent hashing of the game ids onto the workers.
+
+    Every worker is placed in many points of the ring (its replicas), and a
+    key belongs to the worker of the first point after the hash of the key.
+    When a worker joins or leaves only the keys of the arcs it takes or
+    leaves change of owner, about 1/N of them.
+    """
+    replicas: int
+
+    def __init__(self, workers: Iterable[str] = (), replicas: int = 64):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        for worker in workers:
+            self.add(worker)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        # md5 porque el reparto tiene que ser igual en todos los procesos, hash() no lo es
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    @property
+    def workers(self) -> List[str]:
+        return sorted(set(self._owners.values()))
+
+    def __contains__(self, worker: str) -> bool:
+        return worker in self._owners.values()
+
+    def add(self, worker: str) -> None:
+        for replica in range(self.replicas):
+            point = self._hash(f'{worker}#{replica}')
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+            self._owners[point] = worker
+
+    def remove(self, worker: str) -> None:
+        for replica in range(self.replicas):
+            point = self._hash(f'{worker}#{replica}')
+            if self._owners.get(point) == worker:
+                del self._owners[point]
+                self._points.pop(bisect.bisect_left(self._points, point))
+
+    def owner(self, key: str) -> str:
+        """ The worker that the key belongs to """
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
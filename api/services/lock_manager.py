@@ -0,0 +1,49 @@
+import asyncio
+
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+
+class GameLockManager:
+    """ Serializes the events of each game.
+
+    Every game has its own asyncio lock, so the handlers of a game never
+    interleave across their awaits, while the events of different games
+    still run concurrently. The locks are removed when nobody is using them.
+    """
+    _locks: Dict[str, asyncio.Lock]
+    _users: Dict[str, int]  # Tareas que tienen o esperan cada lock
+
+    def __init__(self):
+        self._locks = {}
+        self._users = {}
+
+    @asynccontextmanager
+    async def lock(self, game_id: Optional[str]):
+        """ Holds the lock of the game while the block runs. A None game_id
+        doesn't lock anything
+        """
+        if game_id is None:
+            yield
+            return
+
+        lock = self._locks.setdefault(game_id, asyncio.Lock())
+        self._users[game_id] = self._users.get(game_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[game_id] -= 1
+            if self._users[game_id] == 0:
+                del self._users[game_id]
+                del self._locks[game_id]
+
+    def locked(self, game_id: str) -> bool:
+        return game_id in self._locks and self._locks[game_id].locked()
+
+
+lock_manager: GameLockManager = GameLockManager()
+
+
+def dep_lock_manager() -> GameLockManager:
+    return lock_manager
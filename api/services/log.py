@@ -0,0 +1,113 @@
+""" Structured logging that doesn't block the event loop.
+
+The loggers of the server are under 'truco' (ie. 'truco.main'). Their
+records are put in a queue and a background thread formats them as json
+lines and writes them, so logging from a socket event only costs building
+the record. The records can carry the fields game_id, player_id, event,
+connection and duration (in ms) with the extra argument:
+
+    logger.debug('Event handled', extra={'event': 'playCard', 'duration': 0.4})
+
+The debug records are sampled, only one of every sample_every is logged.
+The levels and the sampling can be changed while the server runs.
+"""
+import json
+import logging
+import queue
+import sys
+
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import IO, Optional
+
+ROOT_LOGGER = 'truco'
+# Campos estructurados que se agregan al json si el registro los tiene
+FIELDS = ('game_id', 'player_id', 'event', 'connection', 'duration')
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats a record as a json line """
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """ Lets through one of every sample_every debug records, and all the others """
+    sample_every: int
+
+    def __init__(self, sample_every: int = 1):
+        super().__init__()
+        self.sample_every = sample_every
+        self._seen = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.sample_every <= 1:
+            return True
+        self._seen += 1
+        return self._seen % self.sample_every == 1
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El mensaje y el json se arman en el thread del listener, los
+        # argumentos de los registros no se tienen que modificar después
+        return record
+
+
+sampling = SamplingFilter()
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str = 'INFO', sample_every: int = 100, stream: IO = None) -> None:
+    """ Sends the records of the server loggers to the background thread """
+    global _listener
+    stop_logging()
+    output = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    output.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    _listener = QueueListener(records, output)
+
+    handler = _QueueHandler(records)
+    handler.addFilter(sampling)
+    sampling.sample_every = sample_every
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    for previous in list(logger.handlers):
+        logger.removeHandler(previous)
+    logger.addHandler(handler)
+    logger.propagate = False
+    set_level(level)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """ Writes the records still in the queue and stops the thread """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def set_level(level: str, name: str = ROOT_LOGGER) -> None:
+    """ Changes the level of a logger of the server
+
+    Raises:
+        ValueError: if the level or the logger is not valid
+    """
+    if name != ROOT_LOGGER and not name.startswith(f'{ROOT_LOGGER}.'):
+        raise ValueError(f'Logger desconocido: {name}')
+    if not isinstance(logging.getLevelName(level.upper()), int):
+        raise ValueError(f'Nivel desconocido: {level}')
+    logging.getLogger(name).setLevel(level.upper())
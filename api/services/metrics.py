@@ -0,0 +1,203 @@
+""" Metrics of the server in the Prometheus text format, served by /metrics.
+
+There are two kinds of metrics:
+    - histograms, that count the values observed in buckets (ie. the time
+      of each event). Observing a value is a bisect and two additions.
+    - gauges and counters, that are read from the state of the server when
+      the metrics are requested (ie. the connected sockets, or the messages
+      dropped by the rate limiter), so they cost nothing until then.
+
+Every metric can have labels, their values are passed in the same order as
+the label names.
+"""
+import bisect
+import time
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+# Límites de los buckets en segundos, de 100µs a 2.5s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+# Operaciones de los repositorios que se miden
+REPOSITORY_OPERATIONS = ('get_by_id', 'get_all', 'save', 'update', 'remove')
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    name: str
+    help: str
+    type: str
+    label_names: Tuple[str, ...]
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}'] + self.samples()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Histogram(Metric):
+    """ Counts the values observed in buckets, with their sum """
+    type = 'histogram'
+    buckets: Tuple[float, ...]
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> cantidad por bucket (el último es +Inf), y la suma al final
+        self._values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        values = self._values.get(labels)
+        if values is None:
+            values = self._values[labels] = [0] * (len(self.buckets) + 2)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def time(self, *labels) -> 'Timer':
+        """ Context manager that observes the time spent in its block """
+        return Timer(self, labels)
+
+    def count(self, *labels) -> int:
+        values = self._values.get(labels)
+        return sum(values[:-1]) if values is not None else 0
+
+    def samples(self) -> List[str]:
+        samples = []
+        for labels, values in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                samples.append(f'{self.name}_bucket{_labels(self.label_names, labels, extra=le)} {cumulative}')
+            samples.append(f'{self.name}_sum{_labels(self.label_names, labels)} {_number(values[-1])}')
+            samples.append(f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}')
+        return samples
+
+
+class Timer:
+    def __init__(self, histogram: Histogram, labels: Tuple):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start, *self._labels)
+
+
+class Collected(Metric):
+    """ A gauge or a counter read when the metrics are requested. The function
+    returns the value, or the values by labels
+    """
+    collect: Callable[[], Union[float, Dict[Tuple, float]]]
+
+    def __init__(self, name: str, help: str, type: str, collect: Callable, label_names: Iterable[str] = ()):
+        super().__init__(name, help, label_names)
+        self.type = type
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f'{self.name}{_labels(self.label_names, labels)} {_number(value)}'
+                for labels, value in sorted(values.items())]
+
+
+class MetricsRegistry:
+    """ The metrics of the server, by name """
+    _metrics: Dict[str, Metric]
+
+    def __init__(self):
+        self._metrics = {}
+
+    def histogram(self, name: str, help: str, label_names: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(name, lambda: Histogram(name, help, label_names, buckets))
+
+    def gauge(self, name: str, help: str, collect: Callable, label_names: Iterable[str] = ()) -> Collected:
+        """ A value that goes up and down, read with collect """
+        return self._collected(name, help, 'gauge', collect, label_names)
+
+    def counter(self, name: str, help: str, collect: Callable, label_names: Iterable[str] = ()) -> Collected:
+        """ A value that only goes up, read with collect """
+        return self._collected(name, help, 'counter', collect, label_names)
+
+    def _collected(self, name: str, help: str, type: str, collect: Callable, label_names: Iterable[str]):
+        # Si ya estaba se reemplaza la función, ie. si se vuelve a iniciar la app
+        metric = self._register(name, lambda: Collected(name, help, type, collect, label_names))
+        metric.collect = collect
+        return metric
+
+    def _register(self, name: str, create: Callable[[], Metric]):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = create()
+        return metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """ All the metrics in the Prometheus text format """
+        lines = []
+        for name in sorted(self._metrics):
+            lines += self._metrics[name].render()
+        return '\n'.join(lines) + '\n'
+
+
+def instrument_repositories(repositories: Dict, registry: 'MetricsRegistry') -> None:
+    """ Counts and times the operations of the repositories (kind -> repository).
+
+    The methods are wrapped in each repository object, so the classes and the
+    repositories not instrumented (ie. in the tests) don't change
+    """
+    # El _count del histograma es la cantidad de operaciones
+    seconds = registry.histogram('truco_repository_operation_seconds',
+                                 'Time of the operations on the repositories', ('repository', 'operation'))
+    for kind, repository in repositories.items():
+        for operation in REPOSITORY_OPERATIONS:
+            method = getattr(repository, operation, None)
+            if method is None or getattr(method, 'instrumented', False):
+                continue
+            setattr(repository, operation, _timed(method, seconds, (kind, operation)))
+
+
+def _timed(method: Callable, seconds: Histogram, labels: Tuple) -> Callable:
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            seconds.observe(time.perf_counter() - start, *labels)
+    timed.instrumented = True
+    return timed
+
+
+metrics = MetricsRegistry()
+
+
+def dep_metrics():
+    return metrics
@@ -16,6 +16,10 @@ class PlayerManager:
         self._player_repository.save(player)
         return player
 
+    def register(self, player: Player) -> None:
+        """ Adds a player created in another worker """
+        self._player_repository.save(player)
+
     def find_player(self, player_id: str) -> Optional[Player]:
         return self._player_repository.get_by_id(id=player_id)
 
@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+
+from enum import Enum
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+# Límites (eventos por segundo, ráfaga) de los eventos que envían mensajes a
+# muchos usuarios, el chat y el lobby llegan a todos los conectados
+FAN_OUT_LIMITS = {
+    'message': (0.5, 3),
+    'gamesUpdate': (1, 2),
+    'createNewGame': (0.2, 2),
+    'joinGame': (0.5, 3),
+    'addBot': (0.2, 2),
+    'syncHand': (2, 4),
+}
+# Límite compartido por el resto de los eventos, las jugadas de una persona
+GAME_LIMIT = (5, 10)
+# Límite de todos los mensajes de una conexión
+CONNECTION_LIMIT = (10, 20)
+# Eventos que se pueden juntar: sólo importa el último, se ejecuta cuando hay saldo
+COALESCED_EVENTS = {'gamesUpdate', 'syncHand'}
+# Conexiones más limitadas que se muestran en las estadísticas
+TOP_THROTTLED = 10
+# Claves del límite compartido y del límite de la conexión
+OTHER_EVENTS = '*'
+ALL_EVENTS = ''
+
+
+class Decision(str, Enum):
+    """ What the limiter did with a message """
+    ALLOWED = 'ALLOWED'
+    COALESCED = 'COALESCED'  # Se ejecuta después, con el payload del último mensaje
+    DROPPED = 'DROPPED'
+
+
+class TokenBucket:
+    """ Allows rate events per second on average, and bursts of up to burst events """
+    rate: float
+    burst: float
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float]):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> bool:
+        self._refill()
+        return self._tokens >= 1
+
+    def take(self) -> None:
+        self._tokens -= 1
+
+    def delay(self) -> float:
+        """ Seconds until there is a token """
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+
+class RateLimiter:
+    """ Token bucket limits for the messages of each connection.
+
+    Every connection has a bucket for all its messages, and a bucket for
+    each fan-out event (see FAN_OUT_LIMITS) so a client that floods the
+    chat or the lobby doesn't use up the budget of its moves. The rest of
+    the events share one bucket.
+
+    A message over the limit is dropped, except the events in
+    COALESCED_EVENTS that only need the last one: it's kept and dispatched
+    once when the bucket has a token again. The sender of a dropped message
+    is told with on_dropped, once until a message of that kind is allowed
+    again, so a flood doesn't get a notice per message.
+
+    The messages throttled of each player are counted in throttled. The
+    stats show the top_throttled connections with the most messages
+    throttled by their connection_key, a keyed hash of the player id that
+    changes on every start: the operator finds the player in the logs of the
+    drops, the clients can't get any player id from it.
+    """
+    fan_out_limits: Dict[str, Tuple[float, float]]
+    game_limit: Tuple[float, float]
+    connection_limit: Tuple[float, float]
+    top_throttled: int
+    # Métricas
+    allowed: int
+    coalesced: int
+    dropped: int
+    throttled: Dict[str, Dict[str, int]]  # player_id -> evento -> mensajes limitados
+
+    def __init__(
+            self,
+            fan_out_limits: Dict[str, Tuple[float, float]] = None,
+            game_limit: Tuple[float, float] = GAME_LIMIT,
+            connection_limit: Tuple[float, float] = CONNECTION_LIMIT,
+            top_throttled: int = TOP_THROTTLED,
+            clock: Callable[[], float] = time.monotonic
+            ):
+        self.fan_out_limits = fan_out_limits if fan_out_limits is not None else FAN_OUT_LIMITS
+        self.game_limit = game_limit
+        self.connection_limit = connection_limit
+        self.top_throttled = top_throttled
+        self._clock = clock
+        self._key_secret = os.urandom(16)
+        self.allowed = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.throttled = {}
+        self._buckets: Dict[str, Dict[str, TokenBucket]] = {}  # player_id -> clave -> bucket
+        self._pending: Dict[str, Dict[str, Tuple[str, Dict]]] = {}  # player_id -> clave -> (evento, payload)
+        self._tasks: Dict[str, Dict[str, asyncio.Task]] = {}  # player_id -> clave -> tarea que lo despacha
+        self._warned: Dict[str, Set[str]] = {}  # player_id -> claves avisadas desde el último mensaje permitido
+
+    def _bucket(self, player_id: str, key: str) -> TokenBucket:
+        buckets = self._buckets.setdefault(player_id, {})
+        bucket = buckets.get(key)
+        if bucket is None:
+            if key == ALL_EVENTS:
+                rate, burst = self.connection_limit
+            else:
+                rate, burst = self.fan_out_limits.get(key, self.game_limit)
+            bucket = buckets[key] = TokenBucket(rate, burst, self._clock)
+        return bucket
+
+    def _key(self, event) -> str:
+        # Los eventos desconocidos no crean buckets nuevos
+        return event if event in self.fan_out_limits else OTHER_EVENTS
+
+    def _take(self, player_id: str, key: str) -> bool:
+        """ Takes a token of the event and of the connection, if both have """
+        event_bucket, connection_bucket = self._bucket(player_id, key), self._bucket(player_id, ALL_EVENTS)
+        if not (event_bucket.available() and connection_bucket.available()):
+            return False
+        event_bucket.take()
+        connection_bucket.take()
+        return True
+
+    async def submit(
+            self,
+            player_id: str,
+            event: Optional[str],
+            payload,
+            dispatch: Callable[[str, Dict], Awaitable],
+            on_dropped: Callable[[str], Awaitable] = None
+            ) -> Decision:
+        """ Dispatches a message of a player if it's within its limits """
+        key = self._key(event)
+        pending = self._pending.setdefault(player_id, {})
+        # Con un mensaje juntado pendiente, los siguientes esperan detrás de él
+        if key not in pending and self._take(player_id, key):
+            self.allowed += 1
+            self._warned.get(player_id, set()).discard(key)
+            await dispatch(event, payload)
+            return Decision.ALLOWED
+
+        counts = self.throttled.setdefault(player_id, {})
+        counts[key] = counts.get(key, 0) + 1
+        if event not in COALESCED_EVENTS:
+            self.dropped += 1
+            warned = self._warned.setdefault(player_id, set())
+            if on_dropped is not None and key not in warned:
+                warned.add(key)
+                await on_dropped(event)
+            return Decision.DROPPED
+
+        self.coalesced += 1
+        if key not in pending:
+            tasks = self._tasks.setdefault(player_id, {})
+            tasks[key] = asyncio.create_task(self._dispatch_later(player_id, key, dispatch))
+        # Reemplaza al mensaje pendiente, si había
+        pending[key] = (event, payload)
+        return Decision.COALESCED
+
+    async def _dispatch_later(self, player_id: str, key: str, dispatch: Callable[[str, Dict], Awaitable]):
+        while not self._take(player_id, key):
+            await asyncio.sleep(max(self._bucket(player_id, key).delay(),
+                                    self._bucket(player_id, ALL_EVENTS).delay()))
+        event, payload = self._pending[player_id].pop(key)
+        del self._tasks[player_id][key]
+        self.allowed += 1
+        await dispatch(event, payload)
+
+    def forget(self, player_id: str) -> None:
+        """ Drops the buckets and the pending messages of a disconnected player """
+        self._buckets.pop(player_id, None)
+        self._pending.pop(player_id, None)
+        self._warned.pop(player_id, None)
+        for task in self._tasks.pop(player_id, {}).values():
+            task.cancel()
+        self.throttled.pop(player_id, None)
+
+    def connection_key(self, player_id: str) -> str:
+        """ The id of the connection of a player in the stats """
+        return hmac.new(self._key_secret, player_id.encode(), hashlib.sha256).hexdigest()[:12]
+
+    def stats(self) -> Dict:
+        """ The messages by decision, and the players limited. No player ids are exposed """
+        throttled_events: Dict[str, int] = {}
+        for counts in self.throttled.values():
+            for key, count in counts.items():
+                throttled_events[key] = throttled_events.get(key, 0) + count
+        top = sorted(self.throttled.items(), key=lambda item: sum(item[1].values()), reverse=True)
+        return {
+            'allowed': self.allowed,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'throttled_players': len(self.throttled),
+            'throttled_events': throttled_events,
+            'top_connections': [{'connection': self.connection_key(player_id),
+                                 'throttled': sum(counts.values()),
+                                 'events': dict(counts)} for player_id, counts in top[:self.top_throttled]]
+        }
+
+
+rate_limiter = RateLimiter()
+
+
+def dep_rate_limiter():
+    return rate_limiter
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import time
+
+from typing import Awaitable, Callable, Dict, List, Optional
+from models.models import Game
+from services.bot_manager import BotManager, dep_bot_manager
+from services.connection_manager import ConnectionManager, dep_connection_manager
+from services.game_manager import GameManager
+from services.lock_manager import GameLockManager, dep_lock_manager
+from repositories.repository import (
+        AbstractGameRepository, dep_game_repository,
+        AbstractHandRepository, dep_hand_repository,
+        AbstractScoreRepository, dep_scores_repository
+)
+
+logger = logging.getLogger('truco.reaper')
+
+# Motivos por los que se elimina una partida
+FINISHED = 'finished'
+ORPHANED = 'orphaned'
+IDLE = 'idle'
+
+
+class GameReaper:
+    """ Removes the games that nobody is going to play anymore.
+
+    A game is removed when it has a winner (finished_ttl after the reaper
+    saw it finished), when none of its players is connected (orphan_ttl),
+    or when it had no events for idle_ttl seconds. Hands and scores whose
+    game doesn't exist anymore are removed too.
+
+    The bots don't count as connected players, and the bots of a game are
+    removed with it.
+
+    The activity of the games is kept here, SocketController.call_event
+    touches the game of every event. A game seen for the first time (ie.
+    restored from the journal) starts its idle time when it's first seen.
+    """
+    idle_ttl: float
+    orphan_ttl: float
+    finished_ttl: float
+    interval: float  # Segundos entre barridas
+    # Métricas
+    sweeps: int
+    reclaimed: Dict[str, int]  # Objetos eliminados por tipo
+    removed_by_reason: Dict[str, int]  # Partidas eliminadas por motivo
+
+    def __init__(
+            self,
+            game_manager: GameManager = GameManager(),
+            games: AbstractGameRepository = dep_game_repository(),
+            hands: AbstractHandRepository = dep_hand_repository(),
+            scores: AbstractScoreRepository = dep_scores_repository(),
+            connection_manager: ConnectionManager = dep_connection_manager(),
+            lock_manager: GameLockManager = dep_lock_manager(),
+            bot_manager: BotManager = dep_bot_manager(),
+            idle_ttl: float = 30 * 60,
+            orphan_ttl: float = 2 * 60,
+            finished_ttl: float = 0,
+            interval: float = 30,
+            clock: Callable[[], float] = time.monotonic
+            ):
+        self._game_manager = game_manager
+        self._games = games
+        self._hands = hands
+        self._scores = scores
+        self._connection_manager = connection_manager
+        self._lock_manager = lock_manager
+        self._bot_manager = bot_manager
+        self.idle_ttl = idle_ttl
+        self.orphan_ttl = orphan_ttl
+        self.finished_ttl = finished_ttl
+        self.interval = interval
+        self._clock = clock
+        self.sweeps = 0
+        self.reclaimed = {'games': 0, 'hands': 0, 'scores': 0}
+        self.removed_by_reason = {FINISHED: 0, ORPHANED: 0, IDLE: 0}
+        self.on_removed: Optional[Callable[[List[str]], Awaitable]] = None
+        self._last_activity: Dict[str, float] = {}
+        self._orphaned_since: Dict[str, float] = {}
+        self._finished_since: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, game_id: Optional[str]) -> None:
+        """ Records an event in the game """
+        if game_id is not None:
+            self._last_activity[game_id] = self._clock()
+
+    async def start(self) -> None:
+        """ Starts the background task that sweeps the games """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                # Una barrida fallida no detiene las siguientes
+                logger.exception("Sweep failed: %s", str(e))
+
+    async def sweep(self) -> List[str]:
+        """ Removes the expired games, and the hands and scores without a game.
+
+        Returns:
+            List[str]: the ids of the games removed
+        """
+        now = self._clock()
+        removed = []
+        for game in list(self._games.get_all()):
+            if self._expired(game, now) is None:
+                continue
+
+            # Se vuelve a comprobar con el lock, por si llegó un evento mientras tanto
+            async with self._lock_manager.lock(game.id):
+                reason = self._expired(game, self._clock())
+                if reason is not None and self._games.get_by_id(id=game.id) is game:
+                    self._remove_game(game)
+                    self.removed_by_reason[reason] += 1
+                    removed.append(game.id)
+
+        self._forget_removed_games()
+
+        # Manos y puntajes de partidas que ya no existen
+        for hand in list(self._hands.get_all()):
+            if self._games.get_by_id(id=hand.id) is None:
+                self._hands.remove(hand)
+                self.reclaimed['hands'] += 1
+        for score in list(self._scores.get_all()):
+            if self._games.get_by_id(id=score.id) is None:
+                self._scores.remove(score)
+                self.reclaimed['scores'] += 1
+
+        self.sweeps += 1
+        if removed:
+            logger.info("Removed %d games", len(removed))
+        if removed and self.on_removed is not None:
+            await self.on_removed(removed)
+        return removed
+
+    def _expired(self, game: Game, now: float) -> Optional[str]:
+        """ The reason to remove the game, None if it has to be kept """
+        if game.winner is not None:
+            if now - self._finished_since.setdefault(game.id, now) >= self.finished_ttl:
+                return FINISHED
+        else:
+            self._finished_since.pop(game.id, None)
+
+        if game.players and not any(self._connection_manager.is_connected(player.id)
+                                    and not self._bot_manager.is_bot(player.id) for player in game.players):
+            if now - self._orphaned_since.setdefault(game.id, now) >= self.orphan_ttl:
+                return ORPHANED
+        else:
+            self._orphaned_since.pop(game.id, None)
+
+        if now - self._last_activity.setdefault(game.id, now) >= self.idle_ttl:
+            return IDLE
+        return None
+
+    def _remove_game(self, game: Game) -> None:
+        # Se cuentan sólo la mano y el puntaje que existían
+        self.reclaimed['hands'] += self._hands.get_by_id(id=game.id) is not None
+        self.reclaimed['scores'] += self._scores.get_by_id(id=game.id) is not None
+        self._game_manager.remove_game(gameId=game.id)
+        self._bot_manager.remove_bots(game_id=game.id)
+        self.reclaimed['games'] += 1
+
+    def _forget_removed_games(self) -> None:
+        """ Drops the times kept of the games that don't exist anymore """
+        for times in (self._last_activity, self._orphaned_since, self._finished_since):
+            for game_id in [game_id for game_id in times if self._games.get_by_id(id=game_id) is None]:
+                del times[game_id]
+
+
+reaper = GameReaper()
+
+
+def dep_reaper():
+    return reaper
@@ -47,7 +47,7 @@ class ScoreManager:
         score.score[hand.winner] += hand.truco_status
 
         self._score_repository.update(score=score)
-        self._check_winner(game_id=hand.id)
+        self._check_winner(score=score)
         return score
 
     def assign_envido_score(self, hand: Hand) -> Score:
@@ -56,13 +56,12 @@ class ScoreManager:
         score.score[hand.envido.winner] += hand.envido.points
 
         self._score_repository.update(score=score)
-        self._check_winner(game_id=hand.id)
+        self._check_winner(score=score)
         return score
 
-    def _check_winner(self, game_id: str) -> None:
+    def _check_winner(self, score: Score) -> None:
         """ Sets the winner of a game (if exists) """
-        game: Game = self._game_repository.get_by_id(id=game_id)
-        score: Score = self._score_repository.get_by_id(id=game_id)
+        game: Game = self._game_repository.get_by_id(id=score.id)
 
         for player, points in score.score.items():
             if points >= game.rules['max_score']:
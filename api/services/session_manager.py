@@ -0,0 +1,52 @@
+import base64
+import hashlib
+import hmac
+import secrets
+
+from typing import Optional
+
+
+class SessionManager:
+    """ Signs the session tokens that let a player reconnect with its id.
+
+    The token is issued in the connect event and is the player id signed
+    with an HMAC of the server secret, so a client can't resume the session
+    of another player. While a disconnected player is within the grace
+    window its id stays reserved (see ConnectionManager.disconnect), and a
+    new socket that presents its token takes its place in the games.
+
+    Every worker has to share the secret for the tokens to be valid in all
+    of them, otherwise a random one is generated on start. The secret has to
+    be kept between restarts too (TRUCO_SESSION_SECRET), or the players of
+    the restored games can't take their places back.
+    """
+    grace: float  # Segundos que se reserva el jugador desconectado
+
+    def __init__(self, secret: bytes = None, grace: float = 30):
+        self.secret = secret if secret is not None else secrets.token_bytes(32)
+        self.grace = grace
+
+    def _signature(self, player_id: str) -> str:
+        digest = hmac.new(self.secret, player_id.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+    def issue(self, player_id: str) -> str:
+        """ The session token of a player """
+        return f'{player_id}.{self._signature(player_id)}'
+
+    def verify(self, token: Optional[str]) -> Optional[str]:
+        """ Returns the player id of a valid token, None if it's missing or forged """
+        if not token or '.' not in token:
+            return None
+        player_id, signature = token.rsplit('.', 1)
+        # Comparación en tiempo constante para no filtrar la firma
+        if not hmac.compare_digest(signature, self._signature(player_id)):
+            return None
+        return player_id
+
+
+session_manager = SessionManager()
+
+
+def dep_session_manager():
+    return session_manager
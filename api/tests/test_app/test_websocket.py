@@ -1,5 +1,9 @@
+import time
+
 from api.main import app
 from fastapi.testclient import TestClient
+from services.connection_manager import dep_connection_manager
+from services.game_manager import GameManager
 
 
 def test_websocket():
@@ -9,3 +13,48 @@ def test_websocket():
     #     data = websocket.receive_json()
     #     assert data == {"event": "connect", "playerId": "uuid"}  
     pass
+
+
+def receive_until(websocket, event: str) -> dict:
+    while True:
+        message = websocket.receive_json()
+        if message['event'] == event:
+            return message['payload']
+
+
+def test_failed_resume_is_notified_and_the_connection_removed():
+    """ Test that resuming a session in a game that doesn't exist anymore
+    notifies the error, and the connection is still removed when it closes
+    """
+    with TestClient(app) as client:
+        with client.websocket_connect('/ws') as websocket:
+            session = receive_until(websocket, 'connect')
+            player_id = session['player']['id']
+            websocket.send_json({'event': 'createNewGame', 'payload': {'playerId': player_id}})
+            game_id = receive_until(websocket, 'gameUpdate')['game']['id']
+
+        # La partida se elimina mientras el jugador está reservado
+        GameManager().remove_game(gameId=game_id)
+
+        with client.websocket_connect(f'/ws?token={session["token"]}') as websocket:
+            assert receive_until(websocket, 'connect')['resumed']
+            assert receive_until(websocket, 'notify') == {
+                'type': 'ERROR', 'title': 'ERROR', 'text': 'La partida no existe'}
+
+        for _ in range(100):
+            if player_id not in dep_connection_manager().active_connections:
+                break
+            time.sleep(0.01)
+        assert player_id not in dep_connection_manager().active_connections
+
+
+def test_events_for_another_player_are_rejected():
+    """ Test that a client can't send events with the id of another player """
+    with TestClient(app) as client:
+        with client.websocket_connect('/ws') as victim, client.websocket_connect('/ws') as attacker:
+            victim_id = receive_until(victim, 'connect')['player']['id']
+            receive_until(attacker, 'connect')
+            attacker.send_json({'event': 'createNewGame', 'payload': {'playerId': victim_id}})
+
+            assert receive_until(attacker, 'notify') == {'type': 'ERROR', 'title': 'ERROR', 'text': 'Jugador inválido'}
+            assert not any(victim_id in [player.id for player in game.players] for game in GameManager().get_available_games())
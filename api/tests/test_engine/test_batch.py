@@ -0,0 +1,30 @@
+from engine.batch import BatchStats, run_batch, run_chunk
+
+
+def test_batch_is_reproducible_for_the_same_seed():
+    """ Test that two batches with the same seed and workers give the same statistics """
+    first = run_batch(games=40, workers=2, seed=3, policies=['greedy', 'random'])
+    second = run_batch(games=40, workers=2, seed=3, policies=['greedy', 'random'])
+
+    assert first.summary() == second.summary()
+    assert first.games == 40
+
+
+def test_batch_merges_the_chunks_of_each_worker():
+    """ Test that the batch statistics are the sum of the chunk of each worker """
+    batch = run_batch(games=30, workers=3, seed=5, policies=['random', 'random'])
+    expected = BatchStats()
+    for worker in range(3):
+        expected.merge(run_chunk(games=10, seed=5, worker=worker, policies=['random', 'random'], max_score=15))
+
+    assert batch == expected
+    assert sum(batch.game_lengths.values()) == 30
+    assert sum(batch.game_wins) == 30
+
+
+def test_different_seeds_give_different_games():
+    """ Test that the seed changes the games played """
+    first = run_chunk(games=20, seed=1, worker=0, policies=['random', 'random'], max_score=15)
+    second = run_chunk(games=20, seed=2, worker=0, policies=['random', 'random'], max_score=15)
+
+    assert first != second
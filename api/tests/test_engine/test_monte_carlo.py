@@ -0,0 +1,63 @@
+import random
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from engine.cards import index_of, to_mask
+from engine.monte_carlo import Observation, best_card, envido_win_probability, hand_win_probability, unseen_cards
+from engine.state import HandState
+
+
+def observe(mine, opponent_played=None, mano=0):
+    """ The observation of seat 0 with its cards, and the card played by the opponent if any """
+    state = HandState(cards=[to_mask(mine), 0], mano=mano)
+    known = to_mask(mine)
+    if opponent_played is not None:
+        state.played[1] = opponent_played
+        state.turn = 0
+        known |= 1 << opponent_played
+    return Observation(state=state, seat=0, unseen=unseen_cards(known), hidden=3 - (opponent_played is not None))
+
+
+def test_best_card_wins_the_round_with_the_lowest_card():
+    """ Test that the search beats the card on the table without wasting the best card """
+    ancho = index_of(rank='1', suit='E')
+    tres = index_of(rank='3', suit='B')
+    cuatro = index_of(rank='4', suit='C')
+    observation = observe([ancho, tres, cuatro], opponent_played=index_of(rank='2', suit='O'))
+
+    card = best_card(observation, deadline=time.monotonic() + 0.05, seed=1)
+
+    assert card == tres
+
+
+def test_probabilities_of_unbeatable_hands():
+    """ Test the probabilities of hands that can't lose """
+    mine = [index_of(rank='1', suit='E'), index_of(rank='1', suit='B'), index_of(rank='7', suit='E')]
+    observation = observe(mine)
+
+    assert hand_win_probability(observation, deadline=time.monotonic() + 0.01, seed=1) == 1
+    assert envido_win_probability(observation, deadline=time.monotonic() + 0.01, seed=1) < 1
+
+
+def test_search_respects_the_deadline():
+    """ Test that the search returns close to the deadline, and runs at least once if it's late """
+    observation = observe(random.Random(1).sample(range(40), 3))
+
+    start = time.monotonic()
+    best_card(observation, deadline=start + 0.02, seed=1)
+    assert time.monotonic() - start < 0.1
+
+    start = time.monotonic()
+    best_card(observation, deadline=start - 1, seed=1)
+    assert time.monotonic() - start < 0.05
+
+
+def test_search_runs_in_a_process_pool():
+    """ Test that the observations can be sent to another process """
+    observation = observe([0, 1, 2])
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        probability = executor.submit(hand_win_probability, observation, time.monotonic() + 0.01, 1).result()
+
+    assert probability == 1
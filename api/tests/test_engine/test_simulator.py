@@ -0,0 +1,106 @@
+import random
+
+from engine.cards import best_envido_cards, from_mask, to_card
+from engine.simulator import Simulator, RandomPolicy, GreedyPolicy, HandResult
+from models.models import Game, Player, HandStatus, get_best_envido
+from services.hand_manager import HandManager
+from services.envido_manager import EnvidoManager
+from services.truco_manager import TrucoManager
+from repositories.repository import InMemoryGameRepository, InMemoryHandRepository, InMemoryPlayersRepository
+
+PLAYERS = ['player0', 'player1']
+
+
+def replay(result: HandResult):
+    """ Plays the actions of a simulated hand with the managers of the server """
+    players = InMemoryPlayersRepository()
+    games = InMemoryGameRepository()
+    hands = InMemoryHandRepository()
+    game = Game(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+    game.id = 'game'
+    for id in PLAYERS:
+        player = Player()
+        player.id = id
+        players.save(player)
+        game.players.append(player)
+    games.save(game)
+
+    hand_manager = HandManager(hands=hands, players=players, games=games)
+    envido_manager = EnvidoManager(hands=hands, games=games)
+    truco_manager = TrucoManager(hands=hands, games=games)
+    hand_manager.new_hand(game_id='game')
+    hand_manager.initialize_hand(hand_id='game')
+
+    # Se reparten las mismas cartas que en la simulación
+    hand = hand_manager.get_hand(id='game')
+    mano = PLAYERS[result.mano]
+    hand.player_dealer = PLAYERS[1 - result.mano]
+    hand.player_hand = hand.player_turn = hand.chant_turn = mano
+    for seat, player in enumerate(PLAYERS):
+        hand.cards_dealed[player] = [to_card(card) for card in from_mask(result.dealt[seat])]
+    hand.status = HandStatus.IN_PROGRESS
+
+    for event, seat, *args in result.actions:
+        player_id = PLAYERS[seat]
+        if event == 'playCard':
+            card = to_card(args[0])
+            hand_manager.play_card(hand_id='game', player_id=player_id, rank=card.rank, suit=card.suit)
+        elif event == 'chantEnvido':
+            envido_manager.chant_envido(hand_id='game', player_id=player_id, level=args[0])
+        elif event == 'responseToEnvido':
+            envido_manager.response_to_envido(hand_id='game', player_id=player_id, level=args[0])
+        elif event == 'acceptEnvido':
+            envido_manager.accept_envido(hand_id='game', player_id=player_id)
+        elif event == 'declineEnvido':
+            envido_manager.decline_envido(hand_id='game', player_id=player_id)
+        elif event == 'playEnvido':
+            cards = [to_card(card) for card in best_envido_cards(from_mask(result.dealt[seat]))]
+            envido_manager.play_envido(hand_id='game', player_id=player_id, cards=cards)
+        elif event == 'chantTruco':
+            truco_manager.chant_truco(hand_id='game', player_id=player_id, level=args[0])
+        elif event == 'responseToTruco':
+            truco_manager.response_to_truco(hand_id='game', player_id=player_id, level=args[0])
+
+    return hand
+
+
+def test_simulated_hands_match_the_managers():
+    """ Test that the simulator gives the same results as the server rules """
+    rng = random.Random(42)
+    policies = [
+        [RandomPolicy(rng, chant_probability=0.5), RandomPolicy(rng, chant_probability=0.5)],
+        [GreedyPolicy(), RandomPolicy(rng)],
+    ]
+
+    for players in policies:
+        simulator = Simulator(policies=players, rng=rng, record=True)
+        for _ in range(150):
+            result = simulator.play_hand(scores=[0, 0])
+            hand = replay(result)
+
+            if result.winner is not None:
+                assert hand.winner == PLAYERS[result.winner]
+                assert hand.truco_status == result.truco
+            if result.envido_chanted:
+                assert hand.envido.winner == PLAYERS[result.envido_winner]
+                assert hand.envido.points == result.envido_points
+
+
+def test_best_envido_cards_have_the_best_envido():
+    """ Test that the cards chosen for the envido give the best envido of the hand """
+    rng = random.Random(7)
+    for _ in range(200):
+        cards = rng.sample(range(40), 3)
+        best = best_envido_cards(cards)
+        score = EnvidoManager()._calculate_envido([to_card(card) for card in best])
+
+        assert score == get_best_envido([to_card(card) for card in cards])
+
+
+def test_game_ends_when_a_player_reaches_max_score():
+    """ Test that a simulated game is played until a player reaches the max score """
+    result = Simulator(policies=[GreedyPolicy(), GreedyPolicy()], rng=random.Random(1)).play_game()
+
+    assert result.scores[result.winner] >= 15
+    assert result.scores[1 - result.winner] < 15
+    assert sum(hand.points + hand.envido_points for hand in result.hands) == sum(result.scores)
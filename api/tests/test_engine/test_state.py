@@ -0,0 +1,84 @@
+import pytest
+import random
+
+from engine.cards import CARDS, NUM_CARDS, to_card, to_index, to_mask, from_mask
+from engine.state import HandState, from_hand
+from models.models import Game, Hand, Player
+from services.hand_manager import HandManager
+from repositories.repository import InMemoryGameRepository, InMemoryHandRepository, InMemoryPlayersRepository
+
+
+def test_cards_convert_to_and_from_indexes():
+    """ Test that every card converts to its index and back """
+    for index in range(NUM_CARDS):
+        assert to_index(to_card(index)) == index
+        assert to_card(index) is CARDS[index]
+
+
+def test_masks_convert_to_and_from_indexes():
+    """ Test that a set of cards converts to a bitmask and back """
+    assert from_mask(to_mask([39, 0, 17])) == (0, 17, 39)
+
+
+def test_hands_read_from_json_share_the_card_instances():
+    """ Test that the cards of a hand parsed, ie. from the journal, are the shared ones """
+    _, hand = new_hand_manager()
+    hand.rounds[0].cards_played[hand.player_turn] = hand.cards_dealed[hand.player_turn][0]
+
+    restored = Hand.parse_raw(hand.json())
+
+    assert all(card is CARDS[to_index(card)] for cards in restored.cards_dealed.values() for card in cards)
+    assert restored.rounds[0].cards_played[hand.player_turn] is hand.cards_dealed[hand.player_turn][0]
+
+
+def test_cannot_play_a_card_not_in_hand():
+    """ Test that a seat can only play its own cards """
+    state = HandState(cards=[to_mask([1, 2, 3]), to_mask([4, 5, 6])], mano=0)
+
+    with pytest.raises(ValueError) as excep:
+        state.play(seat=0, card=4)
+
+    assert 'No tienes ésa carta' in str(excep)
+
+
+def new_hand_manager():
+    players = InMemoryPlayersRepository()
+    games = InMemoryGameRepository()
+    game = Game(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+    game.id = 'game'
+    for id in ['player1', 'player2']:
+        player = Player()
+        player.id = id
+        players.save(player)
+        game.players.append(player)
+    games.save(game)
+
+    hand_manager = HandManager(hands=InMemoryHandRepository(), players=players, games=games)
+    hand_manager.new_hand(game_id='game')
+    hand_manager.initialize_hand(hand_id='game')
+    hand = hand_manager.get_hand(id='game')
+    hand_manager.deal_cards(hand_id='game', player_id=hand.player_dealer)
+    return hand_manager, hand
+
+
+def test_engine_plays_like_the_hand_manager():
+    """ Test that the engine gives the same turns and winners as HandManager
+    for random hands
+    """
+    random.seed(1234)
+    players = ['player1', 'player2']
+
+    for _ in range(300):
+        hand_manager, hand = new_hand_manager()
+        state = from_hand(hand, players=players)
+
+        while hand.winner is None:
+            player = hand.player_turn
+            seat = players.index(player)
+            card = random.choice([card for card in hand.cards_dealed[player] if state.cards[seat] >> to_index(card) & 1])
+
+            hand_manager.play_card(hand_id='game', player_id=player, rank=card.rank, suit=card.suit)
+            state.play(seat=seat, card=to_index(card))
+
+            assert players[state.turn] == hand.player_turn
+            assert state.winner() == (players.index(hand.winner) if hand.winner else None)
@@ -0,0 +1,88 @@
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from engine.cards import NUM_CARDS, VALUES, from_mask, to_mask
+from engine.state import HandState
+from engine.strength import NUM_HANDS, compute, hand_index, load, outcomes
+from models.models import BEST_ENVIDO
+
+
+@pytest.fixture(scope='module')
+def strength():
+    return compute()
+
+
+def play_highest_first(mine, theirs, mano):
+    """ Plays a hand with HandState, both seats playing their highest card first """
+    state = HandState(cards=[to_mask(mine), to_mask(theirs)], mano=mano)
+    while True:
+        seat = state.turn
+        card = max(from_mask(state.cards[seat]), key=VALUES.__getitem__)
+        if state.play(seat, card) and state.winner() is not None:
+            return state.winner()
+
+
+def test_hands_are_indexed_by_their_combination(strength):
+    """ Test that every hand is in the position of its combinatorial index """
+    assert len(strength.cards) == NUM_HANDS
+    for cards in itertools.combinations(range(NUM_CARDS), 3):
+        index = hand_index(reversed(cards))
+        assert tuple(strength.cards[index]) == cards
+
+
+def test_envido_and_truco_values(strength):
+    """ Test that the best envido and the sorted truco values match the card tables """
+    for index, (a, b, c) in enumerate(strength.cards.tolist()):
+        assert strength.envido[index] == BEST_ENVIDO[a * 1600 + b * 40 + c]
+        assert strength.truco[index].tolist() == sorted([VALUES[a], VALUES[b], VALUES[c]], reverse=True)
+
+
+def test_outcomes_match_the_hand_state_winner(strength):
+    """ Test that the vectorized comparison follows the same rules as the engine """
+    rng = random.Random(11)
+    for _ in range(2000):
+        cards = rng.sample(range(NUM_CARDS), 6)
+        mine, theirs = hand_index(cards[:3]), hand_index(cards[3:])
+        mine_wins, theirs_wins = outcomes(strength.truco[mine], strength.truco[theirs])
+
+        for mano in [0, 1]:
+            winner = play_highest_first(cards[:3], cards[3:], mano)
+            expected = 0 if mine_wins else 1 if theirs_wins else mano
+            assert winner == expected
+
+
+def test_equity_against_every_opponent(strength):
+    """ Test the equity of some hands against all the opponent hands """
+    rng = random.Random(3)
+    for index in rng.sample(range(NUM_HANDS), 3):
+        mine = strength.cards[index].tolist()
+        rest = [card for card in range(NUM_CARDS) if card not in mine]
+        wins = {0: 0, 1: 0}
+        opponents = 0
+        for theirs in itertools.combinations(rest, 3):
+            opponents += 1
+            for mano in [0, 1]:
+                wins[mano] += play_highest_first(mine, list(theirs), mano) == 0
+
+        assert strength.equity_mano[index] == pytest.approx(wins[0] / opponents)
+        assert strength.equity_pie[index] == pytest.approx(wins[1] / opponents)
+
+
+def test_equity_is_symmetric(strength):
+    """ Test that on average a hand wins as often as it loses """
+    assert strength.equity.mean() == pytest.approx(0.5)
+    assert strength.equity_mano.mean() > strength.equity_pie.mean()
+
+
+def test_tables_are_saved_and_loaded(strength, tmp_path):
+    """ Test that the tables are loaded from the cache file """
+    path = str(tmp_path / 'strength.npz')
+    strength.save(path)
+
+    loaded = load(path)
+
+    for name in ['cards', 'envido', 'truco', 'equity_mano', 'equity_pie', 'equity']:
+        assert np.array_equal(getattr(loaded, name), getattr(strength, name))
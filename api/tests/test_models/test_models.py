@@ -1,5 +1,8 @@
 import pytest
-from models.models import Round, Card, Hand, Player
+from models.models import (
+    Round, Card, Hand, Player, Rank, Suit, TRUCO_CARD_VALUES,
+    get_value_of_card, get_best_envido
+)
 
 
 @pytest.fixture()
@@ -216,6 +219,40 @@ def test_player1_loses_first_and_wins_second_and_third_round(fake_hand):
     assert hand.check_winner == 'player1'
 
 
+# -----------------------------------------------------------------------------
+# Card tables tests
+# -----------------------------------------------------------------------------
+def test_card_values_table_matches_truco_card_values():
+    """ Test that the precomputed values are the ones defined in TRUCO_CARD_VALUES """
+    for rank in Rank:
+        for suit in Suit:
+            expected = [int(value) for value, cards in TRUCO_CARD_VALUES.items()
+                        if cards['rank'] == rank and suit in cards['suit']]
+
+            assert get_value_of_card(rank=rank, suit=suit) == expected[0]
+
+
+def test_best_envido_of_two_cards_of_the_same_suit():
+    """ Test that the best envido uses the 2 cards of the same suit """
+    cards = [Card(suit='E', rank='7'), Card(suit='O', rank='7'), Card(suit='E', rank='6')]
+
+    assert get_best_envido(cards) == 33
+
+
+def test_best_envido_with_figures():
+    """ Test that the figures count as 0 in the envido """
+    cards = [Card(suit='B', rank='12'), Card(suit='B', rank='11'), Card(suit='C', rank='4')]
+
+    assert get_best_envido(cards) == 20
+
+
+def test_best_envido_without_cards_of_the_same_suit():
+    """ Test that with 3 different suits the envido is the highest card """
+    cards = [Card(suit='B', rank='12'), Card(suit='C', rank='5'), Card(suit='E', rank='3')]
+
+    assert get_best_envido(cards) == 5
+
+
 # def test_advances_to_next_player_in_the_players_list(fake_hand):
 #     """ Test that the hand updates the turn to the next player on the list """
 #     hand: Hand = fake_hand
@@ -0,0 +1,180 @@
+import os
+import pytest
+
+from models.models import Game, Hand, Player, Score
+from repositories.journal import Journal
+from services.connection_manager import ConnectionManager, game_room
+from services.player_manager import PlayerManager
+from services.session_manager import SessionManager
+from repositories.repository import (
+    InMemoryGameRepository, InMemoryHandRepository, InMemoryPlayersRepository, InMemoryScoreRepository
+)
+
+pytest_plugins = ('pytest_asyncio',)
+
+
+def new_repositories():
+    return {
+        'player': InMemoryPlayersRepository(),
+        'game': InMemoryGameRepository(),
+        'hand': InMemoryHandRepository(),
+        'score': InMemoryScoreRepository(),
+    }
+
+
+def new_game(repositories, id: str) -> Game:
+    player = Player()
+    repositories['player'].save(player)
+    game = Game(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+    game.id = id
+    game.players.append(player)
+    repositories['game'].save(game)
+    repositories['hand'].save(Hand(id=id))
+    score = Score()
+    score.id = id
+    score.score[player.id] = 0
+    repositories['score'].save(score)
+    return game
+
+
+@pytest.mark.asyncio
+async def test_changes_are_restored_after_a_restart(tmp_path):
+    """ Test that the repositories are rebuilt from the journal """
+    repositories = new_repositories()
+    journal = Journal(str(tmp_path), flush_interval=0)
+    journal.restore(repositories)
+    await journal.start()
+
+    game = new_game(repositories, 'game1')
+    new_game(repositories, 'game2')
+    repositories['score'].get_by_id(id='game1').score[game.players[0].id] = 7
+    repositories['score'].update(repositories['score'].get_by_id(id='game1'))
+    repositories['game'].remove(repositories['game'].get_by_id(id='game2'))
+    await journal.stop()
+
+    restored = new_repositories()
+    Journal(str(tmp_path)).restore(restored)
+
+    assert restored['game'].get_by_id(id='game1') == game
+    assert restored['game'].get_by_id(id='game2') is None
+    assert restored['game'].avaliable_games() == [game]
+    assert restored['hand'].get_by_id(id='game2') == Hand(id='game2')
+    assert restored['score'].get_by_id(id='game1').score == {game.players[0].id: 7}
+    assert restored['player'].get_by_id(id=game.players[0].id) == game.players[0]
+
+
+@pytest.mark.asyncio
+async def test_players_of_restored_games_resume_with_their_previous_token(tmp_path):
+    """ Test that a player whose game was restored takes its place back with
+    the token issued before the restart, signed with the same secret
+    """
+    repositories = new_repositories()
+    journal = Journal(str(tmp_path), flush_interval=0)
+    journal.restore(repositories)
+    await journal.start()
+    game = new_game(repositories, 'game1')
+    player_id = game.players[0].id
+    token = SessionManager(secret=b'secret').issue(player_id)
+    await journal.stop()
+
+    restored = new_repositories()
+    Journal(str(tmp_path)).restore(restored)
+    manager = ConnectionManager(player_service=PlayerManager(players=restored['player']),
+                                sessions=SessionManager(secret=b'secret', grace=60))
+    manager.reserve_games(restored['game'].get_all())
+
+    class WebSocket:
+        async def accept(self):
+            pass
+
+        async def send_text(self, data: str):
+            pass
+
+    assert await manager.connect(WebSocket(), token=token) == player_id
+    assert manager.games_of(player_id) == ['game1']
+    assert manager.members(game_room('game1')) == {player_id}
+
+
+@pytest.mark.asyncio
+async def test_changes_of_a_commit_are_coalesced(tmp_path):
+    """ Test that many updates of an object between commits are written once """
+    repositories = new_repositories()
+    journal = Journal(str(tmp_path))
+    journal.restore(repositories)
+    new_game(repositories, 'game1')
+    hand = repositories['hand'].get_by_id(id='game1')
+    for player_turn in ['a', 'b', 'c']:
+        hand.player_turn = player_turn
+        repositories['hand'].update(hand)
+
+    await journal.commit()
+
+    assert journal.commits == 1
+    assert journal.records_written == 4
+    restored = new_repositories()
+    Journal(str(tmp_path)).restore(restored)
+    assert restored['hand'].get_by_id(id='game1').player_turn == 'c'
+
+
+@pytest.mark.asyncio
+async def test_restores_from_snapshot_and_journal_tail(tmp_path):
+    """ Test that after a snapshot only the newer journal is replayed, and old files are removed """
+    repositories = new_repositories()
+    journal = Journal(str(tmp_path), snapshot_every=6)
+    journal.restore(repositories)
+    new_game(repositories, 'game1')
+    await journal.commit()
+    new_game(repositories, 'game2')
+    await journal.commit()
+    new_game(repositories, 'game3')
+    await journal.commit()
+
+    assert journal.snapshots == 1
+    assert sorted(os.listdir(tmp_path)) == ['journal.2.log', 'snapshot.2.json']
+
+    restored = new_repositories()
+    assert Journal(str(tmp_path)).restore(restored) == 12
+    assert [game.id for game in restored['game'].get_all()] == ['game1', 'game2', 'game3']
+
+
+@pytest.mark.asyncio
+async def test_snapshot_keeps_the_objects_restored_and_not_changed(tmp_path):
+    """ Test that the snapshot, made from the json already written, includes
+    the objects restored and not changed since, and not the removed ones
+    """
+    repositories = new_repositories()
+    journal = Journal(str(tmp_path))
+    journal.restore(repositories)
+    new_game(repositories, 'game1')
+    new_game(repositories, 'game2')
+    await journal.commit()
+
+    repositories = new_repositories()
+    journal = Journal(str(tmp_path), snapshot_every=2)
+    journal.restore(repositories)
+    repositories['game'].remove(repositories['game'].get_by_id(id='game2'))
+    new_game(repositories, 'game3')
+    await journal.commit()
+
+    assert journal.snapshots == 1
+    restored = new_repositories()
+    Journal(str(tmp_path)).restore(restored)
+    assert [game.id for game in restored['game'].get_all()] == ['game1', 'game3']
+    assert restored['hand'].get_by_id(id='game2') == Hand(id='game2')
+
+
+@pytest.mark.asyncio
+async def test_torn_journal_line_is_ignored(tmp_path):
+    """ Test that a line cut by a crash doesn't prevent the recovery """
+    repositories = new_repositories()
+    journal = Journal(str(tmp_path))
+    journal.restore(repositories)
+    new_game(repositories, 'game1')
+    await journal.commit()
+    with open(tmp_path / 'journal.1.log', 'a') as file:
+        file.write('{"kind": "game", "id": "game2", "da')
+
+    restored = new_repositories()
+    Journal(str(tmp_path)).restore(restored)
+
+    assert [game.id for game in restored['game'].get_all()] == ['game1']
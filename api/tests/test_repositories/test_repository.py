@@ -0,0 +1,93 @@
+from models.models import Game, Player
+from repositories.repository import InMemoryGameRepository, InMemoryPlayersRepository
+
+
+def new_game(id: str, num_players: int = 2) -> Game:
+    game = Game(rules={'num_players': num_players, 'max_score': 15, 'flor': False})
+    game.id = id
+    return game
+
+
+def test_available_games_keeps_creation_order_after_updates():
+    """ Test that a game keeps its place in the lobby when a player joins it """
+    repository = InMemoryGameRepository()
+    game_a = new_game('a', num_players=3)
+    game_b = new_game('b')
+    repository.save(game_a)
+    repository.save(game_b)
+
+    game_a.players.append(Player())
+    repository.update(game_a)
+
+    assert [game.id for game in repository.avaliable_games()] == ['a', 'b']
+
+
+def test_full_games_are_removed_from_available_games():
+    """ Test that a game is no longer available when all seats are taken """
+    repository = InMemoryGameRepository()
+    game = new_game('game')
+    repository.save(game)
+
+    game.players += [Player(), Player()]
+    game.status = 'STARTED'
+    repository.update(game)
+
+    assert repository.avaliable_games() == []
+    assert repository.get_by_status('STARTED') == [game]
+    assert repository.get_by_status('NOT_STARTED') == []
+    assert repository.count_by_status() == {'STARTED': 1}
+
+
+def test_removed_games_are_dropped_from_all_indexes():
+    """ Test that removing a game clears the secondary indexes """
+    repository = InMemoryGameRepository()
+    game = new_game('game')
+    repository.save(game)
+
+    repository.remove(game)
+
+    assert repository.get_by_id(id='game') is None
+    assert repository.avaliable_games() == []
+    assert repository.count_by_status() == {}
+
+
+def test_remove_player():
+    """ Test that a player can be removed from the repository """
+    repository = InMemoryPlayersRepository()
+    player = Player()
+    repository.save(player)
+
+    repository.remove(player)
+
+    assert repository.get_by_id(id=player.id) is None
+
+
+def test_available_games_revision_changes_when_lobby_changes():
+    """ Test that the revision changes when games are created, joined or removed """
+    repository = InMemoryGameRepository()
+    game = new_game('game')
+    initial = repository.avaliable_games_revision()
+
+    repository.save(game)
+    created = repository.avaliable_games_revision()
+    game.players.append(Player())
+    repository.update(game)
+    joined = repository.avaliable_games_revision()
+    repository.remove(game)
+    removed = repository.avaliable_games_revision()
+
+    assert len({initial, created, joined, removed}) == 4
+
+
+def test_available_games_revision_does_not_change_for_started_games():
+    """ Test that updating a game that is not in the lobby keeps the revision """
+    repository = InMemoryGameRepository()
+    game = new_game('game')
+    game.players += [Player(), Player()]
+    repository.save(game)
+    revision = repository.avaliable_games_revision()
+
+    game.status = 'STARTED'
+    repository.update(game)
+
+    assert repository.avaliable_games_revision() == revision
@@ -0,0 +1,163 @@
+import asyncio
+import pytest
+import sqlite3
+
+from models.models import Game, Hand, Player, Score
+from repositories.sqlite_repository import (
+    Database, SqlitePlayersRepository, SqliteHandRepository, SqliteScoreRepository, SqliteGameRepository
+)
+
+pytest_plugins = ('pytest_asyncio',)
+
+
+@pytest.fixture()
+def path(tmp_path) -> str:
+    return str(tmp_path / 'truco.db')
+
+
+def open_repositories(path: str):
+    database = Database(path)
+    return (database, SqlitePlayersRepository(database), SqliteGameRepository(database),
+            SqliteHandRepository(database), SqliteScoreRepository(database))
+
+
+def new_game(id: str, players) -> Game:
+    game = Game(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+    game.id = id
+    game.players = players
+    return game
+
+
+def test_objects_survive_reopening_the_database(path):
+    """ Test that the objects saved are loaded when the database is opened again """
+    database, players, games, hands, scores = open_repositories(path)
+    player = Player()
+    players.save(player)
+    game = new_game('game1', [player])
+    games.save(game)
+    hands.save(Hand(id='game1', player_turn=player.id))
+    score = Score()
+    score.id = 'game1'
+    score.score = {player.id: 3}
+    scores.save(score)
+    database.close()
+
+    database, players, games, hands, scores = open_repositories(path)
+
+    assert players.get_by_id(id=player.id) == player
+    assert games.get_by_id(id='game1') == game
+    assert games.avaliable_games() == [game]
+    assert hands.get_by_id(id='game1').player_turn == player.id
+    assert scores.get_by_id(id='game1').score == {player.id: 3}
+
+
+def test_lookups_return_the_same_instance(path):
+    """ Test that the managers keep getting the live object, not a copy """
+    _, _, games, hands, _ = open_repositories(path)
+    games.save(new_game('game1', []))
+    hands.save(Hand(id='game1'))
+
+    assert games.get_by_id(id='game1') is games.get_by_id(id='game1')
+    assert hands.get_by_id(id='game1') is hands.get_by_id(id='game1')
+
+
+def test_updates_and_removes_are_persisted(path):
+    """ Test that the last state is stored and removed objects are deleted """
+    database, _, games, hands, _ = open_repositories(path)
+    game = new_game('game1', [Player(), Player()])
+    games.save(game)
+    games.save(new_game('game2', []))
+    hands.save(Hand(id='game2'))
+    game.status = 'STARTED'
+    games.update(game)
+    games.remove(games.get_by_id(id='game2'))
+    hands.remove(hands.get_by_id(id='game2'))
+    database.close()
+
+    database, _, games, hands, _ = open_repositories(path)
+
+    assert games.get_by_status('STARTED') == [game]
+    assert games.get_by_id(id='game2') is None
+    assert hands.get_by_id(id='game2') is None
+    rows = database.execute('SELECT id, status FROM games').fetchall()
+    assert rows == [('game1', 'STARTED')]
+
+
+def test_unit_of_work_writes_each_object_once(path):
+    """ Test that the changes of a unit of work are written once per object, in one commit """
+    database, _, games, hands, _ = open_repositories(path)
+
+    with database.unit_of_work.begin():
+        games.save(new_game('game1', []))
+        with database.unit_of_work.begin():
+            hands.save(Hand(id='game1'))
+        hand = hands.get_by_id(id='game1')
+        hand.player_turn = 'player1'
+        hands.update(hand)
+        assert database.execute('SELECT count(*) FROM hands').fetchone() == (0,)
+
+    assert database.commits == 1
+    assert database.unit_of_work.registered == 3
+    assert database.unit_of_work.written == 2
+    database.close()
+
+    _, _, games, hands, _ = open_repositories(path)
+    assert hands.get_by_id(id='game1').player_turn == 'player1'
+
+
+def test_unit_of_work_is_written_when_the_event_fails(path):
+    """ Test that the objects changed before an error are written, as they are already changed in memory """
+    database, _, games, _, _ = open_repositories(path)
+
+    with pytest.raises(ValueError):
+        with database.unit_of_work.begin():
+            games.save(new_game('game1', []))
+            raise ValueError()
+
+    assert database.execute('SELECT id FROM games').fetchall() == [('game1',)]
+
+
+@pytest.mark.asyncio
+async def test_overlapping_events_of_two_games_are_written_when_each_ends(path):
+    """ Test that the events of different games, running at the same time,
+    have their own unit of work and each one is written when it ends
+    """
+    database, _, games, _, _ = open_repositories(path)
+    started, finish = asyncio.Event(), asyncio.Event()
+
+    async def long_event():
+        with database.unit_of_work.begin():
+            games.save(new_game('game1', []))
+            started.set()
+            await finish.wait()
+            game = games.get_by_id(id='game1')
+            game.status = 'STARTED'
+            games.update(game)
+
+    long_task = asyncio.create_task(long_event())
+    await started.wait()
+    with database.unit_of_work.begin():
+        games.save(new_game('game2', []))
+
+    # El evento de game2 se escribe sin esperar al de game1, y sin sus cambios
+    assert database.execute('SELECT id, status FROM games').fetchall() == [('game2', 'NOT_STARTED')]
+    finish.set()
+    await long_task
+
+    assert database.execute('SELECT id, status FROM games ORDER BY id').fetchall() == [
+        ('game1', 'STARTED'), ('game2', 'NOT_STARTED')]
+    assert database.commits == 2
+
+
+def test_unit_of_work_is_committed_all_or_none(path):
+    """ Test that a write that fails rolls back the writes of its unit of work """
+    database, _, games, _, _ = open_repositories(path)
+
+    with pytest.raises(sqlite3.OperationalError):
+        with database.unit_of_work.begin():
+            games.save(new_game('game1', []))
+            database.write('missing', 'game1', Hand(id='game1'))
+
+    assert database.execute('SELECT id FROM games').fetchall() == []
+    assert not database.connection.in_transaction
+    assert database.commits == 0
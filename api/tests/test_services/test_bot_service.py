@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from events.socket_events import SocketController
+from services.bot_manager import BotManager, BotPlayer, MAX_FAILURES
+from services.connection_manager import ConnectionManager
+from services.exceptions import GameException
+from services.game_manager import GameManager
+
+pytest_plugins = ('pytest_asyncio',)
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent.append(json.loads(data))
+
+
+@pytest.fixture()
+def executor():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        yield executor
+
+
+@pytest.mark.asyncio
+async def test_two_bots_play_a_full_game(executor):
+    """ Test that two bots play a game until the end over the socket protocol """
+    connection_manager = ConnectionManager()
+    bot_manager = BotManager(connection_manager=connection_manager, executor=executor, budget=0.005)
+    socket = SocketController(connection_manager=connection_manager, bot_manager=bot_manager)
+    game = GameManager().create(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+
+    human = FakeWebSocket()
+    player_id = await connection_manager.connect(human)
+    await bot_manager.add_bot(game_id=game.id, dispatch=socket.call_event)
+    await bot_manager.add_bot(game_id=game.id, dispatch=socket.call_event)
+
+    for _ in range(3000):
+        if not bot_manager.bots and list(connection_manager.active_connections) == [player_id]:
+            break
+        await asyncio.sleep(0.01)
+
+    assert bot_manager.bots == {}
+    assert list(connection_manager.active_connections) == [player_id]
+    assert game.winner is not None
+    # La partida terminada se elimina del servidor
+    assert GameManager().get_game(id=game.id) is None
+
+
+@pytest.mark.asyncio
+async def test_cannot_add_a_bot_to_a_full_game(executor, fake_games_repository, fake_players_repository):
+    """ Test that a bot is only added to games waiting for players """
+    fake_game_manager = GameManager(games=fake_games_repository, players=fake_players_repository)
+    connection_manager = ConnectionManager()
+    bot_manager = BotManager(connection_manager=connection_manager, executor=executor)
+    socket = SocketController(connection_manager=connection_manager, game_manager=fake_game_manager,
+                              bot_manager=bot_manager)
+
+    with pytest.raises(Exception) as excep:
+        await socket.call_event(event='addBot', payload={'playerId': 'player1', 'gameId': 'game1'})
+
+    assert 'Partida completa' in str(excep)
+    assert bot_manager.bots == {}
+
+
+@pytest.mark.asyncio
+async def test_only_the_players_of_a_game_can_add_a_bot(executor, fake_games_repository, fake_players_repository):
+    """ Test that a player can't add a bot to a game it's not in """
+    fake_game_manager = GameManager(games=fake_games_repository, players=fake_players_repository)
+    connection_manager = ConnectionManager()
+    bot_manager = BotManager(connection_manager=connection_manager, executor=executor)
+    socket = SocketController(connection_manager=connection_manager, game_manager=fake_game_manager,
+                              bot_manager=bot_manager)
+
+    with pytest.raises(GameException, match='La partida no existe'):
+        await socket.call_event(event='addBot', payload={'playerId': 'player1', 'gameId': 'game0'})
+
+    assert bot_manager.bots == {}
+    assert fake_games_repository.get_by_id(id='game0').players == []
+
+
+def test_bot_pool_has_a_process_per_cpu():
+    """ Test that the searches of the bots run in a pool sized by the CPUs, started on start """
+    bot_manager = BotManager(connection_manager=ConnectionManager(), max_workers=2)
+    bot_manager.start()
+    try:
+        assert bot_manager._get_executor()._max_workers == 2
+        assert BotManager(connection_manager=ConnectionManager()).max_workers == (os.cpu_count() or 1)
+    finally:
+        bot_manager.stop()
+
+    assert bot_manager._executor is None
+
+
+@pytest.mark.asyncio
+async def test_bot_answers_within_the_latency_budget():
+    """ Test that the heuristic is used when the search doesn't answer in time """
+    class SlowExecutor(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            return super().submit(lambda: asyncio.run(asyncio.sleep(1)))
+
+    with SlowExecutor(max_workers=1) as slow:
+        bot = BotPlayer(game_id='game', dispatch=None, executor=slow, budget=0.02)
+        bot.player_id = 'bot'
+        bot._players = ['bot', 'player']
+        card = {'rank': '1', 'suit': 'E'}
+        bot._hand = {
+            'id': 'game', 'player_turn': 'bot', 'chant_turn': 'player', 'player_hand': 'bot',
+            'player_dealer': 'player', 'cards_dealed': [card], 'truco_status': 1, 'winner': None,
+            'rounds': [{'cards_played': {'bot': None, 'player': None}}], 'status': 'IN_PROGRESS',
+            'envido': {'chanted': [], 'points': 0, 'cards_played': {}, 'winner': None, 'status': 'FINISHED'}
+        }
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        action = await bot._decide()
+
+        assert action == ('playCard', card)
+        assert loop.time() - start < 0.5
+
+
+@pytest.mark.asyncio
+async def test_bot_with_rejected_moves_goes_to_deck_and_leaves(executor):
+    """ Test that a bot whose moves are rejected retries them, then goes to
+    deck, and leaves the game if it still can't play
+    """
+    events = []
+    finished = asyncio.Event()
+
+    async def dispatch(event, payload):
+        events.append(event)
+        raise GameException('No es tu turno')
+
+    class StuckBot(BotPlayer):
+        async def _decide(self):
+            return 'playCard', {'rank': '1', 'suit': 'E'}
+
+    bot = StuckBot(game_id='game', dispatch=dispatch, executor=executor, on_finish=lambda bot: finished.set())
+    bot.player_id = 'bot'
+    bot.retry_delay = 0
+    bot.receive({'event': 'handUpdated', 'payload': {'hand': {'id': 'game'}}})
+
+    await asyncio.wait_for(finished.wait(), timeout=5)
+
+    assert events[:MAX_FAILURES + 1] == ['playCard'] * MAX_FAILURES + ['goToDeck']
+    assert len(events) == 2 * MAX_FAILURES
@@ -0,0 +1,433 @@
+import asyncio
+import json
+import multiprocessing
+import pytest
+import pytest_asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from unittest import mock
+from events.socket_events import SocketController, dep_socket_controller
+from repositories.repository import (
+    all_repositories, dep_game_repository, dep_hand_repository, InMemoryGameRepository, InMemoryPlayersRepository
+)
+from services.bot_manager import BotPlayer, BotSocket
+from services.bus import Broker, BusClient
+from services.cluster import Cluster, RemoteConnection
+from services.connection_manager import ConnectionManager, dep_connection_manager
+from services.game_manager import GameManager
+from services.hash_ring import HashRing
+from services.lock_manager import dep_lock_manager
+from services.player_manager import PlayerManager
+
+pytest_plugins = ('pytest_asyncio',)
+
+WORKERS = ['a', 'b', 'c']
+
+
+class PlayerSocket(BotSocket):
+    """ Socket of a bot that also keeps the frames received. While holding
+    the frames are not passed to the bot, so the game doesn't go on
+    """
+    def __init__(self, bot: BotPlayer, hold: bool):
+        super().__init__(bot)
+        self.frames = []
+        self.received = asyncio.Event()
+        self.holding = hold
+
+    async def send_text(self, data: str):
+        self.frames.append(json.loads(data))
+        self.received.set()
+        if not self.holding:
+            await super().send_text(data)
+
+    async def release(self):
+        self.holding = False
+        for frame in self.frames:
+            self.bot.receive(frame)
+
+    async def wait_for(self, condition):
+        while not condition():
+            self.received.clear()
+            await self.received.wait()
+
+    def last(self, event: str) -> dict:
+        frames = [frame for frame in self.frames if frame['event'] == event]
+        return frames[-1]['payload'] if frames else None
+
+    def lists(self, game_id: str) -> bool:
+        lobby = self.last('gamesUpdate')
+        return lobby is not None and any(game['id'] == game_id for game in lobby['gamesList'])
+
+
+async def play(role: str, game_id: str, results, signals) -> dict:
+    """ Connects a bot to the worker, that joins the game, and waits until
+    the game is over
+    """
+    socket_controller, connection_manager = dep_socket_controller(), dep_connection_manager()
+
+    finished = asyncio.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        bot = BotPlayer(game_id=game_id, dispatch=socket_controller.call_event, executor=executor,
+                        budget=0.005, on_finish=lambda bot: finished.set())
+        socket = PlayerSocket(bot, hold=not signals['release'].is_set())
+        bot.player_id = await connection_manager.connect(socket)
+
+        # Se une cuando la partida aparece en el lobby
+        while not socket.lists(game_id):
+            await socket_controller.call_event('gamesUpdate', {'playerId': bot.player_id})
+            await asyncio.sleep(0.01)
+        await socket_controller.call_event('joinGame', {'playerId': bot.player_id, 'gameId': game_id})
+
+        if socket.holding:
+            # Con la partida empezada se espera a que el test la deje seguir
+            await socket.wait_for(lambda: socket.last('handUpdated') is not None)
+            results.put(('joined', role, None))
+            await asyncio.to_thread(signals['release'].wait)
+            await socket.release()
+
+        await asyncio.wait_for(finished.wait(), timeout=60)
+        connection_manager.disconnect(socket)
+    return socket.last('gameUpdate')['game']
+
+
+async def worker(path: str, worker_id: str, role: str, workers: int, game_id: str, host: str, results, signals):
+    cluster = Cluster(path=path, worker_id=worker_id)
+    await cluster.start(dep_connection_manager(), dep_socket_controller(), PlayerManager(),
+                        all_repositories(), dep_lock_manager())
+    while len(cluster.ring.workers) < workers:
+        await asyncio.sleep(0.01)
+    if worker_id == host:
+        # Los clientes no eligen el id, la partida se crea con el id del test en el worker que la tiene
+        GameManager().create(rules={'num_players': 2, 'max_score': 15, 'flor': False}, id=game_id)
+        await dep_socket_controller().gamesUpdate()
+    results.put(('ready', worker_id, None))
+    await asyncio.to_thread(signals['go'].wait)
+
+    game = await play(role, game_id, results, signals) if role in ('creator', 'joiner') else None
+    if role == 'owner':
+        await asyncio.to_thread(signals['stop'].wait)
+    results.put((role, worker_id, {
+        'game': game,
+        'games': len(dep_game_repository().get_all()),
+        'hands': len(dep_hand_repository().get_all()),
+        'forwarded': cluster.forwarded,
+        'relayed': cluster.relayed,
+        'migrated_in': cluster.migrated_in,
+        'migrated_out': cluster.migrated_out,
+    }))
+    await cluster.stop()
+
+
+def run_worker(*args):
+    asyncio.run(worker(*args))
+
+
+class Workers:
+    """ Worker processes connected to the broker """
+    def __init__(self, path: str, game_id: str, host: str):
+        self.path = path
+        self.game_id = game_id
+        self.host = host  # Worker en el que se crea la partida
+        self.context = multiprocessing.get_context('spawn')
+        self.results = self.context.Queue()
+        self.signals = {name: self.context.Event() for name in ('go', 'release', 'stop')}
+        self.processes = []
+
+    def start(self, worker_id: str, role: str, workers: int) -> None:
+        process = self.context.Process(target=run_worker, args=(
+                self.path, worker_id, role, workers, self.game_id, self.host, self.results, self.signals))
+        process.start()
+        self.processes.append(process)
+
+    async def get(self, timeout: float = 60):
+        return await asyncio.to_thread(self.results.get, timeout=timeout)
+
+    async def collect(self, count: int) -> dict:
+        """ The results of the next workers that finish, by role """
+        results = {}
+        for _ in range(count):
+            role, _, result = await self.get(timeout=90)
+            results[role] = result
+        return results
+
+    async def close(self) -> None:
+        for signal in self.signals.values():
+            signal.set()
+        for process in self.processes:
+            # Se espera en otro thread, el broker corre en este event loop
+            await asyncio.to_thread(process.join, timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+
+@pytest_asyncio.fixture()
+async def broker(tmp_path):
+    broker = Broker(str(tmp_path / 'bus.sock'))
+    await broker.start()
+    yield broker
+    await broker.stop()
+
+
+def game_owned_by(owner: str, workers: List[str], new_owner: str = None, new_workers: List[str] = None) -> str:
+    """ A game id that belongs to the owner, and to the new owner when the ring grows """
+    for game_id in (f'game{i}' for i in range(1000)):
+        if HashRing(workers).owner(game_id) == owner and (
+                new_owner is None or HashRing(new_workers).owner(game_id) == new_owner):
+            return game_id
+
+
+@pytest.mark.asyncio
+async def test_bus_delivers_in_order_to_the_other_subscribers(broker):
+    """ Test that a message is delivered to the subscribers of its topic except the publisher """
+    received = {'a': [], 'b': []}
+    clients = {name: BusClient(broker.path, handler=lambda topic, data, name=name: received[name].append(data))
+               for name in received}
+    for client in clients.values():
+        await client.connect()
+        client.subscribe('topic')
+        await client.sync()
+
+    for i in range(5):
+        clients['a'].publish('topic', i)
+    clients['a'].publish('other', 'ignored')
+    await clients['a'].sync()
+    await clients['b'].sync()
+
+    assert received == {'a': [], 'b': [0, 1, 2, 3, 4]}
+    for client in clients.values():
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_bus_client_notices_the_broker_stopped_and_reconnects(broker):
+    """ Test that a client whose broker stopped is told, can't send, and gets
+    its subscriptions back when it reconnects
+    """
+    received, lost = [], asyncio.Event()
+    client = BusClient(broker.path, handler=lambda topic, data: received.append(data), on_lost=lost.set)
+    publisher = BusClient(broker.path, handler=lambda topic, data: None)
+    await client.connect()
+    client.subscribe('topic')
+    await client.sync()
+
+    await broker.stop()
+    await asyncio.wait_for(lost.wait(), timeout=1)
+    assert not client.connected
+    with pytest.raises(ConnectionError):
+        client.publish('topic', 'lost')
+
+    await broker.start()
+    await client.reconnect()
+    await publisher.connect()
+    publisher.publish('topic', 'again')
+    await publisher.sync()
+    await client.sync()
+
+    assert received == ['again']
+    for bus_client in (client, publisher):
+        await bus_client.close()
+
+
+@pytest.mark.asyncio
+async def test_broker_drops_a_subscriber_that_doesnt_read(tmp_path):
+    """ Test that the broker cuts a subscriber with too many bytes pending
+    instead of keeping them in memory
+    """
+    broker = Broker(str(tmp_path / 'bus.sock'), max_buffer=2 ** 16)
+    await broker.start()
+    # El suscriptor nunca lee lo que le llega
+    reader, writer = await asyncio.open_unix_connection(broker.path)
+    writer.write(b'{"op":"subscribe","topic":"topic"}\n')
+    await writer.drain()
+    publisher = BusClient(broker.path, handler=lambda topic, data: None)
+    await publisher.connect()
+    await publisher.sync()
+
+    for _ in range(200):
+        publisher.publish('topic', 'x' * 2 ** 14)
+        await publisher.sync()
+        if broker.dropped_subscribers:
+            break
+
+    assert broker.dropped_subscribers == 1
+    assert 'topic' not in broker._subscribers
+    writer.close()
+    await publisher.close()
+    await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_worker_shuts_down_if_it_cant_reconnect_to_the_bus():
+    """ Test that a worker that lost the bus retries, drops what it publishes
+    meanwhile and shuts down when it can't reconnect
+    """
+    on_failure = mock.Mock()
+    cluster = Cluster(path='', worker_id='a', reconnect_attempts=3, reconnect_delay=0, on_failure=on_failure)
+    cluster._bus = mock.Mock(BusClient, connected=False)
+    cluster._bus.reconnect.side_effect = ConnectionRefusedError()
+
+    cluster.broadcast('{}', event='gamesUpdate')
+    cluster._lost()
+    await asyncio.gather(*cluster._tasks)
+
+    assert cluster.unsent == 1
+    assert cluster._bus.reconnect.await_count == 3
+    cluster._bus.publish.assert_not_called()
+    on_failure.assert_called_once_with()
+
+
+def test_new_games_belong_to_the_worker():
+    """ Test that the games created without id are owned by the worker that creates them """
+    cluster = Cluster(path='', worker_id='b')
+    for worker in WORKERS:
+        cluster.ring.add(worker)
+
+    assert all(cluster.owner(cluster.new_game_id()) == 'b' for _ in range(10))
+
+
+def test_ring_only_moves_the_games_of_the_new_worker():
+    """ Test that when a worker joins, the games that change of owner go to
+    the new worker, and are about a third of them
+    """
+    before, after = HashRing(['a', 'b']), HashRing(WORKERS)
+    game_ids = [f'game{i}' for i in range(3000)]
+
+    moved = [game_id for game_id in game_ids if before.owner(game_id) != after.owner(game_id)]
+
+    assert all(after.owner(game_id) == 'c' for game_id in moved)
+    assert 700 < len(moved) < 1300
+
+
+def test_ring_removes_a_worker():
+    """ Test that the games of a worker that leaves are spread among the others """
+    ring = HashRing(WORKERS)
+    ring.remove('c')
+
+    assert ring.workers == ['a', 'b']
+    assert {ring.owner(f'game{i}') for i in range(100)} == {'a', 'b'}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_a_worker_without_heartbeats_is_removed_with_its_players():
+    """ Test that a worker that stops sending heartbeats leaves the ring, and
+    its players are disconnected
+    """
+    clock = FakeClock()
+    cluster = Cluster(path='', worker_id='a', heartbeat_timeout=5, clock=clock)
+    connection_manager = ConnectionManager(player_service=PlayerManager(InMemoryPlayersRepository()))
+    socket_controller = mock.Mock(SocketController)
+    cluster._connection_manager, cluster._socket_controller = connection_manager, socket_controller
+    for worker in ('b', 'c'):
+        cluster.ring.add(worker)
+        player_id = f'player_{worker}'
+        connection_manager.add_remote(player_id, RemoteConnection(cluster, worker=worker, player_id=player_id))
+    cluster.check_workers()
+
+    clock.now = 4
+    cluster._last_seen['c'] = clock.now
+    clock.now = 6
+    cluster.check_workers()
+
+    assert cluster.ring.workers == ['a', 'c']
+    assert cluster.lost_workers == 1
+    assert list(connection_manager.remote_connections) == ['player_c']
+    socket_controller.forget_player.assert_called_once_with(player_id='player_b')
+
+
+@pytest.mark.asyncio
+async def test_events_of_local_players_wait_for_a_migrating_game(fake_games_repository, fake_players_repository):
+    """ Test that an event of a player connected to the new owner of a game
+    waits for the game to arrive instead of failing
+    """
+    games = InMemoryGameRepository()
+    cluster = Cluster(path='', worker_id='a', migration_timeout=5)
+    cluster._repositories = {'game': games}
+    cluster._bus = mock.Mock(BusClient)
+    socket_controller = SocketController(connection_manager=mock.AsyncMock(ConnectionManager),
+                                         game_manager=GameManager(games=games, players=fake_players_repository),
+                                         player_manager=PlayerManager(fake_players_repository))
+    socket_controller.cluster = cluster
+
+    event = asyncio.create_task(socket_controller.call_event('joinGame', {'playerId': 'player1', 'gameId': 'moving'}))
+    await asyncio.sleep(0.01)
+    assert not event.done()
+
+    # Llega la partida migrada
+    GameManager(games=games, players=fake_players_repository).create(
+            rules={'num_players': 2, 'max_score': 15, 'flor': False}, id='moving')
+    cluster._arrivals.pop('moving').set()
+    await asyncio.wait_for(event, timeout=1)
+
+    assert [player.id for player in games.get_by_id(id='moving').players] == ['player1']
+
+
+@pytest.mark.asyncio
+async def test_full_game_across_workers(broker):
+    """ Test that two players connected to different workers play a full
+    game that is kept by a third worker
+    """
+    workers = Workers(broker.path, game_owned_by('c', WORKERS), host='c')
+    try:
+        for worker_id, role in (('a', 'creator'), ('b', 'joiner'), ('c', 'owner')):
+            workers.start(worker_id, role, workers=3)
+        for _ in WORKERS:
+            assert (await workers.get())[0] == 'ready'
+        workers.signals['release'].set()
+        workers.signals['go'].set()
+
+        players = await workers.collect(2)
+        workers.signals['stop'].set()
+        owner = (await workers.collect(1))['owner']
+    finally:
+        await workers.close()
+
+    # Los dos jugadores vieron el mismo final de la partida
+    creator, joiner = players['creator']['game'], players['joiner']['game']
+    assert creator['id'] == joiner['id'] == workers.game_id
+    assert creator['winner'] is not None
+    assert creator['winner'] == joiner['winner']
+    # La partida se jugó y se eliminó en el worker dueño
+    assert owner['games'] == 0
+    assert owner['hands'] == 0
+    assert owner['forwarded'] == 0
+    assert owner['relayed'] > 0
+
+
+@pytest.mark.asyncio
+async def test_game_migrates_to_a_worker_that_joins(broker):
+    """ Test that a started game moves with its hand and score to the worker
+    that owns it after joining, and the players finish it there
+    """
+    workers = Workers(broker.path, game_owned_by('b', ['a', 'b'], new_owner='c', new_workers=WORKERS), host='b')
+    try:
+        workers.start('a', 'creator', workers=2)
+        workers.start('b', 'joiner', workers=2)
+        for _ in range(2):
+            assert (await workers.get())[0] == 'ready'
+        workers.signals['go'].set()
+        for _ in range(2):
+            assert (await workers.get())[0] == 'joined'
+
+        workers.start('c', 'owner', workers=3)
+        assert (await workers.get())[0] == 'ready'
+        workers.signals['release'].set()
+
+        players = await workers.collect(2)
+        workers.signals['stop'].set()
+        owner = (await workers.collect(1))['owner']
+    finally:
+        await workers.close()
+
+    assert players['creator']['game']['winner'] is not None
+    assert players['creator']['game']['winner'] == players['joiner']['game']['winner']
+    assert players['joiner']['migrated_out'] == 1
+    assert owner['migrated_in'] == 1
+    assert owner['games'] == 0
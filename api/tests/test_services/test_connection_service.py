@@ -0,0 +1,343 @@
+import asyncio
+import json
+import pytest
+
+from services.connection_manager import ConnectionManager, SlowConsumerPolicy, LOBBY, game_room
+from services.player_manager import PlayerManager
+from services.session_manager import SessionManager
+from repositories.repository import InMemoryPlayersRepository
+
+pytest_plugins = ('pytest_asyncio',)
+
+
+class FakeWebSocket:
+    """ Websocket that stores the messages sent """
+    def __init__(self):
+        self.messages = []
+        self.closed = False
+        self.closes = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.messages.append(data)
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        self.closes += 1
+
+
+class StalledWebSocket(FakeWebSocket):
+    """ Websocket of a client that never reads its messages """
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def send_text(self, data: str):
+        await self.release.wait()
+        self.messages.append(data)
+
+
+@pytest.fixture()
+def player_service():
+    return PlayerManager(players=InMemoryPlayersRepository())
+
+
+async def connect(manager: ConnectionManager, websocket: FakeWebSocket, token: str = None) -> str:
+    player_id = await manager.connect(websocket, token=token)
+    await asyncio.sleep(0)
+    return player_id
+
+
+@pytest.mark.asyncio
+async def test_broadcast_is_not_blocked_by_a_stalled_client(player_service):
+    """ Test that a client that doesn't read its socket doesn't delay the others """
+    manager = ConnectionManager(player_service=player_service)
+    stalled = StalledWebSocket()
+    fast = FakeWebSocket()
+    await connect(manager, stalled)
+    fast_id = await connect(manager, fast)
+
+    await asyncio.wait_for(manager.broadcast(json_string='lobby'), timeout=0.1)
+    await asyncio.wait_for(manager.active_connections[fast_id].drain(), timeout=0.1)
+
+    assert fast.messages[-1] == 'lobby'
+    assert stalled.messages == []
+
+
+@pytest.mark.asyncio
+async def test_messages_are_sent_in_order(player_service):
+    """ Test that the writer task keeps the order of the messages """
+    manager = ConnectionManager(player_service=player_service)
+    websocket = FakeWebSocket()
+    player_id = await connect(manager, websocket)
+
+    for i in range(10):
+        await manager.send(json_string=str(i), player_id=player_id)
+    await manager.active_connections[player_id].drain()
+
+    assert json.loads(websocket.messages[0])['event'] == 'connect'
+    assert websocket.messages[1:] == [str(i) for i in range(10)]
+
+
+@pytest.mark.asyncio
+async def test_drop_policy_discards_new_messages(player_service):
+    """ Test that with the DROP policy the new messages are discarded when the queue is full """
+    manager = ConnectionManager(max_queue_size=2, slow_consumer_policy=SlowConsumerPolicy.DROP,
+                                player_service=player_service)
+    websocket = StalledWebSocket()
+    player_id = await connect(manager, websocket)  # El writer queda bloqueado con el 'connect'
+
+    for message in ['1', '2', '3', '4']:
+        await manager.send(json_string=message, player_id=player_id)
+    websocket.release.set()
+    await manager.active_connections[player_id].drain()
+
+    assert websocket.messages[1:] == ['1', '2']
+    assert manager.active_connections[player_id].dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_policy_keeps_the_newest_messages(player_service):
+    """ Test that with the DROP_OLDEST policy the oldest messages are discarded """
+    manager = ConnectionManager(max_queue_size=2, slow_consumer_policy=SlowConsumerPolicy.DROP_OLDEST,
+                                player_service=player_service)
+    websocket = StalledWebSocket()
+    player_id = await connect(manager, websocket)
+
+    for message in ['1', '2', '3', '4']:
+        await manager.send(json_string=message, player_id=player_id)
+    websocket.release.set()
+    await manager.active_connections[player_id].drain()
+
+    assert websocket.messages[1:] == ['3', '4']
+
+
+@pytest.mark.asyncio
+async def test_game_state_frames_are_never_dropped(player_service):
+    """ Test that a game update that doesn't fit in the queue, or that would be
+    discarded to make room, closes the socket instead of being lost
+    """
+    game_update = json.dumps({'event': 'gameUpdate', 'payload': {}})
+    for frames in (['1', '2', game_update], [game_update, '1', '2']):
+        manager = ConnectionManager(max_queue_size=2, slow_consumer_policy=SlowConsumerPolicy.DROP_OLDEST,
+                                    player_service=player_service)
+        websocket = StalledWebSocket()
+        player_id = await connect(manager, websocket)
+
+        for message in frames:
+            # El evento se pasa con el frame, no se deduce de su contenido
+            event = 'gameUpdate' if message == game_update else 'message'
+            await manager.send(json_string=message, player_id=player_id, event=event)
+        await asyncio.sleep(0)
+
+        assert websocket.closed
+        assert manager.active_connections[player_id].dropped == 0
+
+
+@pytest.mark.asyncio
+async def test_coalesce_policy_replaces_the_queued_frame_of_the_event(player_service):
+    """ Test that a lobby update takes the place of the one still queued, and
+    the other frames are dropped as with DROP_OLDEST when the queue is full
+    """
+    manager = ConnectionManager(max_queue_size=3, slow_consumer_policy=SlowConsumerPolicy.COALESCE,
+                                player_service=player_service)
+    websocket = StalledWebSocket()
+    player_id = await connect(manager, websocket)
+
+    await manager.send(json_string='games 1', player_id=player_id, event='gamesUpdate')
+    for message in ['chat 1', 'chat 2', 'chat 3']:
+        await manager.send(json_string=message, player_id=player_id, event='message')
+    await manager.send(json_string='games 2', player_id=player_id, event='gamesUpdate')
+    websocket.release.set()
+    connection = manager.active_connections[player_id]
+    await connection.drain()
+
+    assert websocket.messages[1:] == ['chat 2', 'chat 3', 'games 2']
+    assert connection.dropped == 2
+
+    websocket.release.clear()
+    await manager.send(json_string='games 3', player_id=player_id, event='gamesUpdate')
+    await asyncio.sleep(0)
+    await manager.send(json_string='chat 4', player_id=player_id, event='message')
+    await manager.send(json_string='games 4', player_id=player_id, event='gamesUpdate')
+    await manager.send(json_string='games 5', player_id=player_id, event='gamesUpdate')
+    websocket.release.set()
+    await connection.drain()
+
+    assert websocket.messages[4:] == ['games 3', 'chat 4', 'games 5']
+    assert connection.coalesced == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_client_is_closed_once_and_keeps_its_rooms(player_service):
+    """ Test that the frames to a connection being closed are ignored, without
+    closing it again, and that it keeps its rooms to resume the session
+    """
+    manager = ConnectionManager(max_queue_size=1, slow_consumer_policy=SlowConsumerPolicy.DISCONNECT,
+                                player_service=player_service)
+    websocket = StalledWebSocket()
+    player_id = await connect(manager, websocket)
+    manager.subscribe(room=game_room('game1'), player_id=player_id)
+
+    for _ in range(5):
+        await manager.publish(room=game_room('game1'), json_string='hand', event='handUpdated')
+    await asyncio.sleep(0)
+
+    assert websocket.closes == 1
+    assert manager.active_connections[player_id].closing
+    assert manager.games_of(player_id) == ['game1']
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_closes_the_slow_client(player_service):
+    """ Test that with the DISCONNECT policy the socket of the slow client is closed """
+    manager = ConnectionManager(max_queue_size=1, slow_consumer_policy=SlowConsumerPolicy.DISCONNECT,
+                                player_service=player_service)
+    websocket = StalledWebSocket()
+    player_id = await connect(manager, websocket)
+
+    await manager.broadcast(json_string='1')
+    await manager.broadcast(json_string='2')
+    await asyncio.sleep(0)
+
+    assert websocket.closed
+    manager.disconnect(websocket)
+    assert player_id not in manager.active_connections
+
+
+@pytest.mark.asyncio
+async def test_publish_only_reaches_the_members_of_the_room(player_service):
+    """ Test that a message to a game room is only sent to the players that joined it """
+    manager = ConnectionManager(player_service=player_service)
+    in_game, other = FakeWebSocket(), FakeWebSocket()
+    in_game_id = await connect(manager, in_game)
+    await connect(manager, other)
+    manager.subscribe(room=game_room('game1'), player_id=in_game_id)
+
+    await manager.publish(room=game_room('game1'), json_string='hand')
+    await asyncio.sleep(0)
+
+    assert in_game.messages[-1] == 'hand'
+    assert 'hand' not in other.messages
+
+
+@pytest.mark.asyncio
+async def test_connected_players_are_in_the_lobby(player_service):
+    """ Test that the players join the lobby on connect and leave it on disconnect """
+    manager = ConnectionManager(player_service=player_service)
+    websocket = FakeWebSocket()
+    player_id = await connect(manager, websocket)
+    other_id = await connect(manager, FakeWebSocket())
+
+    assert manager.members(LOBBY) == {player_id, other_id}
+
+    manager.disconnect(websocket)
+    await manager.broadcast(json_string='lobby')
+    await asyncio.sleep(0)
+
+    assert manager.members(LOBBY) == {other_id}
+    assert 'lobby' not in websocket.messages
+
+
+@pytest.mark.asyncio
+async def test_disconnect_removes_the_player_from_its_rooms(player_service):
+    """ Test that a disconnected player is no longer indexed by socket nor by room """
+    manager = ConnectionManager(player_service=player_service)
+    websocket, partner = FakeWebSocket(), FakeWebSocket()
+    player_id = await connect(manager, websocket)
+    partner_id = await connect(manager, partner)
+    for game_id in ('game1', 'game2'):
+        manager.subscribe(room=game_room(game_id), player_id=player_id)
+    manager.subscribe(room=game_room('game1'), player_id=partner_id)
+
+    assert manager.player_of(websocket) == player_id
+    manager.disconnect(websocket)
+
+    assert manager.player_of(websocket) is None
+    assert manager.members(game_room('game1')) == {partner_id}
+    assert manager.members(game_room('game2')) == set()
+    assert player_service.find_player(player_id=player_id) is None
+
+
+@pytest.mark.asyncio
+async def test_close_room_removes_its_members(player_service):
+    """ Test that the room of a removed game is dropped, keeping the lobby """
+    manager = ConnectionManager(player_service=player_service)
+    player_id = await connect(manager, FakeWebSocket())
+    manager.subscribe(room=game_room('game1'), player_id=player_id)
+
+    manager.close_room(room=game_room('game1'))
+
+    assert manager.members(game_room('game1')) == set()
+    assert manager._rooms_of == {player_id: {LOBBY}}
+
+
+@pytest.mark.asyncio
+async def test_player_resumes_its_session_within_the_grace_window(player_service):
+    """ Test that a socket that connects with the token of a disconnected
+    player keeps its id and its game rooms
+    """
+    manager = ConnectionManager(player_service=player_service, sessions=SessionManager(grace=60))
+    websocket = FakeWebSocket()
+    player_id = await connect(manager, websocket)
+    token = json.loads(websocket.messages[0])['payload']['token']
+    manager.subscribe(room=game_room('game1'), player_id=player_id)
+
+    manager.disconnect(websocket)
+    assert manager.is_reserved(player_id)
+    assert player_service.find_player(player_id=player_id) is not None
+
+    reconnected = FakeWebSocket()
+    assert await connect(manager, reconnected, token=token) == player_id
+    assert json.loads(reconnected.messages[0])['payload']['resumed'] is True
+    assert manager.members(game_room('game1')) == {player_id}
+    assert manager.games_of(player_id) == ['game1']
+    assert not manager.is_reserved(player_id)
+
+
+@pytest.mark.asyncio
+async def test_reserved_player_that_never_connected_here_resumes_its_session(player_service):
+    """ Test that a player reserved without a previous connection, ie. after a
+    restart, takes its id and rooms back with a token of the same secret
+    """
+    sessions = SessionManager(secret=b'secret', grace=60)
+    manager = ConnectionManager(player_service=player_service, sessions=sessions)
+    player = player_service.create()
+    manager.reserve(player.id, {game_room('game1')})
+
+    websocket = FakeWebSocket()
+    assert await connect(manager, websocket, token=SessionManager(secret=b'secret').issue(player.id)) == player.id
+    assert json.loads(websocket.messages[0])['payload']['resumed'] is True
+    assert manager.games_of(player.id) == ['game1']
+    assert manager.reserved_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_player_is_removed_when_the_grace_window_ends(player_service):
+    """ Test that a player that doesn't come back is removed, and its token no longer resumes it """
+    manager = ConnectionManager(player_service=player_service, sessions=SessionManager(grace=0.01))
+    websocket = FakeWebSocket()
+    player_id = await connect(manager, websocket)
+    token = json.loads(websocket.messages[0])['payload']['token']
+
+    manager.disconnect(websocket)
+    await asyncio.sleep(0.02)
+
+    assert player_service.find_player(player_id=player_id) is None
+    assert await connect(manager, FakeWebSocket(), token=token) != player_id
+
+
+@pytest.mark.asyncio
+async def test_forged_token_does_not_resume_a_session(player_service):
+    """ Test that a token not signed by the server creates a new player """
+    manager = ConnectionManager(player_service=player_service, sessions=SessionManager(grace=60))
+    websocket = FakeWebSocket()
+    player_id = await connect(manager, websocket)
+    manager.disconnect(websocket)
+
+    forged = SessionManager(secret=b'other').issue(player_id)
+
+    assert await connect(manager, FakeWebSocket(), token=forged) != player_id
+    assert manager.is_reserved(player_id)
@@ -1,6 +1,7 @@
 import pytest
 
-from models.models import Game, Player
+from models.models import Game, Hand, Player, Score
+from repositories.repository import InMemoryHandRepository, InMemoryScoreRepository
 from services.game_manager import GameManager
 from services.exceptions import GameException
 
@@ -50,3 +51,29 @@ def test_can_retrieve_all_available_games(fake_games_repository, fake_players_re
 
     # In fake repository there is already an empty game, so it should be 3 availables games
     assert len(game_manager.get_available_games()) == 3
+
+
+def test_remove_game_removes_its_hand_and_score(fake_games_repository, fake_players_repository):
+    """ Test that removing a game also removes its hand and score """
+    hands = InMemoryHandRepository()
+    scores = InMemoryScoreRepository()
+    game_manager: GameManager = GameManager(games=fake_games_repository, players=fake_players_repository,
+                                            hands=hands, scores=scores)
+    hands.save(Hand(id='game1'))
+    scores.save(Score(id='game1'))
+
+    game_manager.remove_game(gameId='game1')
+
+    assert game_manager.get_game(id='game1') is None
+    assert hands.get_by_id(id='game1') is None
+    assert scores.get_by_id(id='game1') is None
+
+
+def test_remove_a_game_that_did_not_start(fake_games_repository):
+    """ Test that a game without hand nor score can be removed """
+    game_manager: GameManager = GameManager(games=fake_games_repository, hands=InMemoryHandRepository(),
+                                            scores=InMemoryScoreRepository())
+
+    game_manager.remove_game(gameId='game0')
+
+    assert game_manager.get_game(id='game0') is None
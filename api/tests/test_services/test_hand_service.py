@@ -8,7 +8,7 @@ from services.exceptions import GameException
 def test_create_new_hand(fake_hands_repository, fake_games_repository):
     """ Test that a new hand is created """
     hand_manager = HandManager(hands=fake_hands_repository)
-    game_id = fake_games_repository.get_by_id(id='game1')
+    game_id = fake_games_repository.get_by_id(id='game1').id
 
     hand_manager.new_hand(game_id=game_id)
 
@@ -171,6 +171,29 @@ def test_cannot_play_a_card_when_its_not_player_turn(
     assert hand.rounds[0].cards_played[player_dealer] is None
 
 
+def test_cannot_play_a_card_twice(fake_hands_repository, fake_players_repository, fake_games_repository):
+    """ Test that a card already played in the hand can't be played again """
+    hand_manager = HandManager(
+            hands=fake_hands_repository,
+            players=fake_players_repository,
+            games=fake_games_repository
+    )
+    hand: Hand = hand_manager.get_hand(id='game1')
+    cards_dealed = hand_manager.deal_cards(player_id=hand.player_dealer, hand_id=hand.id)
+    first, second = hand.player_hand, hand.player_dealer
+    hand_manager.play_card(player_id=first, hand_id=hand.id,
+                           suit=cards_dealed[first][0].suit, rank=cards_dealed[first][0].rank)
+    hand_manager.play_card(player_id=second, hand_id=hand.id,
+                           suit=cards_dealed[second][0].suit, rank=cards_dealed[second][0].rank)
+    card = cards_dealed[hand.player_turn][0]
+
+    with pytest.raises(GameException) as excep:
+        hand_manager.play_card(player_id=hand.player_turn, hand_id=hand.id, suit=card.suit, rank=card.rank)
+
+    assert 'No tienes ésa carta' in str(excep)
+    assert all(card is None for card in hand.rounds[1].cards_played.values())
+
+
 def test_go_to_deck(
             fake_hands_repository, fake_players_repository, fake_games_repository
         ):
@@ -0,0 +1,46 @@
+import asyncio
+import pytest
+
+from services.lock_manager import GameLockManager
+
+pytest_plugins = ('pytest_asyncio',)
+
+
+async def handler(lock_manager: GameLockManager, game_id: str, log: list, name: str):
+    async with lock_manager.lock(game_id):
+        log.append(f'{name} start')
+        await asyncio.sleep(0.01)
+        log.append(f'{name} end')
+
+
+@pytest.mark.asyncio
+async def test_events_of_the_same_game_do_not_interleave():
+    """ Test that two handlers of the same game run one after the other """
+    lock_manager = GameLockManager()
+    log = []
+
+    await asyncio.gather(handler(lock_manager, 'game1', log, 'a'), handler(lock_manager, 'game1', log, 'b'))
+
+    assert log == ['a start', 'a end', 'b start', 'b end']
+
+
+@pytest.mark.asyncio
+async def test_events_of_different_games_run_concurrently():
+    """ Test that handlers of different games are not serialized """
+    lock_manager = GameLockManager()
+    log = []
+
+    await asyncio.gather(handler(lock_manager, 'game1', log, 'a'), handler(lock_manager, 'game2', log, 'b'))
+
+    assert log[:2] == ['a start', 'b start']
+
+
+@pytest.mark.asyncio
+async def test_unused_locks_are_removed():
+    """ Test that the lock of a game is removed when no handler is using it """
+    lock_manager = GameLockManager()
+
+    await handler(lock_manager, 'game1', [], 'a')
+
+    assert lock_manager._locks == {}
+    assert not lock_manager.locked('game1')
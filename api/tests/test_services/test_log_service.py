@@ -0,0 +1,81 @@
+import io
+import json
+import logging
+import threading
+import pytest
+
+from services import log
+
+
+@pytest.fixture()
+def output():
+    stream = io.StringIO()
+    log.setup_logging(level='INFO', sample_every=1, stream=stream)
+    yield stream
+    log.stop_logging()
+    logging.getLogger(log.ROOT_LOGGER).handlers.clear()
+    logging.getLogger(log.ROOT_LOGGER).propagate = True
+
+
+def records(stream: io.StringIO):
+    log.stop_logging()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_records_are_json_lines_with_the_event_fields(output):
+    """ Test that a record is written as json with its structured fields """
+    logging.getLogger('truco.test').info("Event handled in %s", 'game1',
+                                         extra={'game_id': 'game1', 'player_id': 'player1',
+                                                'event': 'playCard', 'duration': 0.5})
+
+    [record] = records(output)
+    assert record['message'] == 'Event handled in game1'
+    assert record['level'] == 'INFO'
+    assert record['logger'] == 'truco.test'
+    assert (record['game_id'], record['player_id'], record['event'], record['duration']) == \
+        ('game1', 'player1', 'playCard', 0.5)
+
+
+def test_records_are_written_by_a_background_thread(output, monkeypatch):
+    """ Test that the thread that logs doesn't write the record """
+    writers = []
+    original = logging.StreamHandler.emit
+
+    def emit(handler, record):
+        if handler.stream is output:
+            writers.append(threading.current_thread())
+        original(handler, record)
+    monkeypatch.setattr(logging.StreamHandler, 'emit', emit)
+
+    logging.getLogger('truco.test').warning("Slow event")
+    records(output)
+
+    assert writers and threading.current_thread() not in writers
+
+
+def test_debug_records_are_sampled(output):
+    """ Test that only one of every sample_every debug records is logged, and all the others """
+    log.set_level('DEBUG')
+    log.sampling.sample_every = 10
+    logger = logging.getLogger('truco.test')
+    for i in range(30):
+        logger.debug("Received message %d", i)
+    logger.error("Event failed")
+
+    assert [record['message'] for record in records(output)] == \
+        ['Received message 0', 'Received message 10', 'Received message 20', 'Event failed']
+
+
+def test_levels_change_at_runtime(output):
+    """ Test that a logger can be made more or less verbose, and only the server loggers """
+    logger = logging.getLogger('truco.test')
+    logger.debug("Hidden")
+    log.set_level('debug', name='truco.test')
+    logger.debug("Shown")
+
+    assert [record['message'] for record in records(output)] == ['Shown']
+    with pytest.raises(ValueError):
+        log.set_level('LOUD')
+    with pytest.raises(ValueError):
+        log.set_level('DEBUG', name='uvicorn')
+    logger.setLevel(logging.NOTSET)
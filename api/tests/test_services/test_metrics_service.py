@@ -0,0 +1,59 @@
+from models.models import Game
+from repositories.repository import InMemoryGameRepository
+from services.metrics import MetricsRegistry, instrument_repositories
+
+
+def test_histogram_renders_cumulative_buckets():
+    """ Test that the values observed are counted in the buckets up to +Inf, with their sum """
+    registry = MetricsRegistry()
+    histogram = registry.histogram('truco_event_seconds', 'Time of the events', ('event',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, 'playCard')
+
+    lines = registry.render().splitlines()
+
+    assert lines[:2] == ['# HELP truco_event_seconds Time of the events', '# TYPE truco_event_seconds histogram']
+    assert lines[2:] == [
+        'truco_event_seconds_bucket{event="playCard",le="0.1"} 2',
+        'truco_event_seconds_bucket{event="playCard",le="1"} 3',
+        'truco_event_seconds_bucket{event="playCard",le="+Inf"} 4',
+        'truco_event_seconds_sum{event="playCard"} 3.65',
+        'truco_event_seconds_count{event="playCard"} 4',
+    ]
+
+
+def test_collected_metrics_are_read_when_rendered():
+    """ Test that gauges and counters call their function on each render, and escape the labels """
+    registry = MetricsRegistry()
+    sockets = []
+    registry.gauge('truco_connected_sockets', 'Websockets connected', lambda: len(sockets))
+    registry.counter('truco_event_errors_total', 'Events that failed',
+                     lambda: {('say "hi"',): 2}, ('event',))
+
+    sockets.append('socket')
+    text = registry.render()
+
+    assert 'truco_connected_sockets 1\n' in text
+    assert '# TYPE truco_event_errors_total counter' in text
+    assert 'truco_event_errors_total{event="say \\"hi\\""} 2\n' in text
+
+
+def test_instrumented_repository_counts_its_operations():
+    """ Test that the operations of an instrumented repository are timed, and
+    that other repositories of the same class are not
+    """
+    registry = MetricsRegistry()
+    games, other = InMemoryGameRepository(), InMemoryGameRepository()
+    instrument_repositories({'game': games}, registry)
+    instrument_repositories({'game': games}, registry)
+    game = Game(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+
+    games.save(game)
+    assert games.get_by_id(id=game.id) is game
+    games.get_by_id(id='missing')
+    other.save(game)
+
+    seconds = registry.get('truco_repository_operation_seconds')
+    assert seconds.count('game', 'save') == 1
+    assert seconds.count('game', 'get_by_id') == 2
+    assert 'save' not in vars(other)
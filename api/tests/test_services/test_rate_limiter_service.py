@@ -0,0 +1,147 @@
+import asyncio
+import pytest
+
+from services.rate_limiter import RateLimiter, Decision
+
+pytest_plugins = ('pytest_asyncio',)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Dispatcher:
+    """ Keeps the events dispatched """
+    def __init__(self):
+        self.events = []
+
+    async def __call__(self, event, payload):
+        self.events.append((event, payload))
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+@pytest.mark.asyncio
+async def test_fan_out_events_have_their_own_budget(clock):
+    """ Test that flooding the chat drops the messages over its budget without
+    using the budget of the moves
+    """
+    limiter = RateLimiter(fan_out_limits={'message': (1, 2)}, game_limit=(1, 3), clock=clock)
+    dispatch = Dispatcher()
+
+    decisions = [await limiter.submit('player1', 'message', {'n': n}, dispatch) for n in range(10)]
+    moves = [await limiter.submit('player1', 'playCard', {'n': n}, dispatch) for n in range(3)]
+
+    assert decisions.count(Decision.ALLOWED) == 2
+    assert decisions.count(Decision.DROPPED) == 8
+    assert moves == [Decision.ALLOWED] * 3
+    assert limiter.throttled == {'player1': {'message': 8}}
+    # Otro jugador tiene su propio saldo
+    assert await limiter.submit('player2', 'message', {}, dispatch) == Decision.ALLOWED
+
+
+@pytest.mark.asyncio
+async def test_dropped_moves_are_notified_once_until_allowed_again(clock):
+    """ Test that the sender is told that its moves are dropped, without a
+    notice for each message of a flood, and that the stats have no player ids
+    """
+    limiter = RateLimiter(fan_out_limits={}, game_limit=(1, 1), clock=clock)
+    dispatch = Dispatcher()
+    notices = []
+
+    async def on_dropped(event):
+        notices.append(event)
+
+    for event in ('playCard', 'playCard', 'chantTruco', 'playCard'):
+        await limiter.submit('player1', event, {}, dispatch, on_dropped)
+    clock.now += 1
+    for event in ('playCard', 'playCard'):
+        await limiter.submit('player1', event, {}, dispatch, on_dropped)
+
+    assert notices == ['playCard', 'playCard']
+    assert limiter.stats()['throttled_players'] == 1
+    assert limiter.stats()['throttled_events'] == {'*': 4}
+    assert 'player1' not in str(limiter.stats())
+
+
+@pytest.mark.asyncio
+async def test_stats_show_the_most_throttled_connections_by_key(clock):
+    """ Test that the stats list the connections with the most messages
+    throttled first, identified by a key that is not their player id
+    """
+    limiter = RateLimiter(fan_out_limits={}, game_limit=(1, 1), top_throttled=2, clock=clock)
+    dispatch = Dispatcher()
+    for player_id, messages in (('player1', 2), ('player2', 5), ('player3', 3)):
+        for _ in range(messages):
+            await limiter.submit(player_id, 'playCard', {}, dispatch)
+
+    top = limiter.stats()['top_connections']
+
+    assert top == [{'connection': limiter.connection_key('player2'), 'throttled': 4, 'events': {'*': 4}},
+                   {'connection': limiter.connection_key('player3'), 'throttled': 2, 'events': {'*': 2}}]
+    assert not any(player_id in str(limiter.stats()) for player_id in ('player1', 'player2', 'player3'))
+    assert limiter.connection_key('player2') != RateLimiter().connection_key('player2')
+
+
+@pytest.mark.asyncio
+async def test_budget_refills_over_time(clock):
+    """ Test that the tokens come back at the rate of the bucket """
+    limiter = RateLimiter(fan_out_limits={'message': (2, 1)}, clock=clock)
+    dispatch = Dispatcher()
+
+    assert await limiter.submit('player1', 'message', {}, dispatch) == Decision.ALLOWED
+    assert await limiter.submit('player1', 'message', {}, dispatch) == Decision.DROPPED
+    clock.now += 0.5
+    assert await limiter.submit('player1', 'message', {}, dispatch) == Decision.ALLOWED
+
+
+@pytest.mark.asyncio
+async def test_connection_budget_limits_all_the_events(clock):
+    """ Test that the connection budget applies to the sum of every event """
+    limiter = RateLimiter(fan_out_limits={}, game_limit=(100, 100), connection_limit=(1, 4), clock=clock)
+    dispatch = Dispatcher()
+
+    for event in ('dealCards', 'playCard', 'chantTruco', 'playCard', 'playCard', 'unknown'):
+        await limiter.submit('player1', event, {}, dispatch)
+
+    assert [event for event, _ in dispatch.events] == ['dealCards', 'playCard', 'chantTruco', 'playCard']
+    assert limiter.dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_coalesced_events_dispatch_only_the_last_one():
+    """ Test that the lobby requests over the limit are joined and the last one
+    is dispatched when there is budget again
+    """
+    limiter = RateLimiter(fan_out_limits={'gamesUpdate': (50, 1)})
+    dispatch = Dispatcher()
+
+    decisions = [await limiter.submit('player1', 'gamesUpdate', {'n': n}, dispatch) for n in range(5)]
+    await asyncio.sleep(0.1)
+
+    assert decisions == [Decision.ALLOWED] + [Decision.COALESCED] * 4
+    assert dispatch.events == [('gamesUpdate', {'n': 0}), ('gamesUpdate', {'n': 4})]
+    assert limiter.stats()['coalesced'] == 4
+
+
+@pytest.mark.asyncio
+async def test_forget_cancels_the_pending_events(clock):
+    """ Test that the coalesced events of a player that disconnects are not dispatched """
+    limiter = RateLimiter(fan_out_limits={'gamesUpdate': (1, 1)}, clock=clock)
+    dispatch = Dispatcher()
+
+    await limiter.submit('player1', 'gamesUpdate', {}, dispatch)
+    await limiter.submit('player1', 'gamesUpdate', {}, dispatch)
+    limiter.forget('player1')
+    clock.now += 10
+    await asyncio.sleep(0)
+
+    assert len(dispatch.events) == 1
+    assert limiter.throttled == {}
@@ -0,0 +1,195 @@
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from models.models import Game, Hand, Player, Score
+from repositories.repository import (
+    InMemoryGameRepository, InMemoryHandRepository, InMemoryScoreRepository, InMemoryPlayersRepository
+)
+from services.bot_manager import BotManager
+from services.connection_manager import ConnectionManager
+from services.game_manager import GameManager
+from services.lock_manager import GameLockManager
+from services.reaper import GameReaper
+
+pytest_plugins = ('pytest_asyncio',)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture()
+def repositories():
+    return InMemoryGameRepository(), InMemoryHandRepository(), InMemoryScoreRepository()
+
+
+@pytest.fixture()
+def connection_manager():
+    return ConnectionManager()
+
+
+@pytest.fixture()
+def bot_manager(connection_manager):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        yield BotManager(connection_manager=connection_manager, executor=executor)
+
+
+@pytest.fixture()
+def reaper(repositories, connection_manager, bot_manager, clock):
+    games, hands, scores = repositories
+    game_manager = GameManager(games=games, players=InMemoryPlayersRepository(), hands=hands, scores=scores)
+    return GameReaper(game_manager=game_manager, games=games, hands=hands, scores=scores,
+                      connection_manager=connection_manager, lock_manager=GameLockManager(),
+                      bot_manager=bot_manager, idle_ttl=100, orphan_ttl=10, finished_ttl=0, clock=clock)
+
+
+def new_game(repositories, connection_manager, id: str, players=('player1', 'player2')) -> Game:
+    """ Saves a started game, with its hand and score, and connects its players """
+    games, hands, scores = repositories
+    game = Game(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+    game.id = id
+    for player_id in players:
+        player = Player()
+        player.id = player_id
+        game.players.append(player)
+        connection_manager.active_connections[player_id] = object()
+    game.status = 'STARTED'
+    games.save(game)
+    hands.save(Hand(id=id))
+    scores.save(Score(id=id))
+    return game
+
+
+@pytest.mark.asyncio
+async def test_finished_games_are_removed_with_their_hand_and_score(reaper, repositories, connection_manager):
+    """ Test that a game with a winner is removed together with its hand and score """
+    games, hands, scores = repositories
+    game = new_game(repositories, connection_manager, 'game1')
+    game.winner = game.players[0]
+
+    assert await reaper.sweep() == ['game1']
+    assert games.get_by_id(id='game1') is None
+    assert hands.get_by_id(id='game1') is None
+    assert scores.get_by_id(id='game1') is None
+    assert reaper.reclaimed['games'] == 1
+    assert reaper.reclaimed['hands'] == 1
+    assert reaper.reclaimed['scores'] == 1
+    assert reaper.removed_by_reason['finished'] == 1
+
+
+@pytest.mark.asyncio
+async def test_games_without_connected_players_are_removed_after_the_orphan_ttl(
+        reaper, repositories, connection_manager, clock):
+    """ Test that a game is kept while a player is connected, and removed
+    orphan_ttl seconds after the last one disconnected
+    """
+    games, _, _ = repositories
+    new_game(repositories, connection_manager, 'game1')
+    del connection_manager.active_connections['player1']
+
+    assert await reaper.sweep() == []
+
+    del connection_manager.active_connections['player2']
+    assert await reaper.sweep() == []
+
+    clock.now = 10
+    assert await reaper.sweep() == ['game1']
+    assert reaper.removed_by_reason['orphaned'] == 1
+
+
+@pytest.mark.asyncio
+async def test_a_game_left_only_with_its_bot_is_orphaned_and_the_bot_removed(
+        reaper, repositories, connection_manager, bot_manager, clock):
+    """ Test that a connected bot doesn't keep a game alive, and that it's
+    removed with the game
+    """
+    async def dispatch(event, payload):
+        pass
+
+    bot_id = await bot_manager.add_bot(game_id='game1', dispatch=dispatch)
+    game = new_game(repositories, connection_manager, 'game1', players=('player1',))
+    bot = Player()
+    bot.id = bot_id
+    game.players.append(bot)
+    del connection_manager.active_connections['player1']
+
+    assert await reaper.sweep() == []
+    clock.now = 10
+    assert await reaper.sweep() == ['game1']
+
+    assert bot_manager.bots == {}
+    assert bot_id not in connection_manager.active_connections
+
+
+@pytest.mark.asyncio
+async def test_a_player_reconnecting_resets_the_orphan_time(reaper, repositories, connection_manager, clock):
+    """ Test that the orphan time starts again if a player comes back """
+    new_game(repositories, connection_manager, 'game1')
+    connection_manager.active_connections.clear()
+    await reaper.sweep()
+
+    clock.now = 5
+    connection_manager.active_connections['player1'] = object()
+    await reaper.sweep()
+    del connection_manager.active_connections['player1']
+    await reaper.sweep()
+
+    clock.now = 12
+    assert await reaper.sweep() == []
+
+
+@pytest.mark.asyncio
+async def test_idle_games_are_removed_unless_touched(reaper, repositories, connection_manager, clock):
+    """ Test that only the games without events for idle_ttl seconds are removed """
+    new_game(repositories, connection_manager, 'idle')
+    new_game(repositories, connection_manager, 'active', players=('player3', 'player4'))
+    await reaper.sweep()
+
+    clock.now = 60
+    reaper.touch('active')
+    clock.now = 100
+
+    assert await reaper.sweep() == ['idle']
+    assert reaper.removed_by_reason['idle'] == 1
+
+
+@pytest.mark.asyncio
+async def test_hands_and_scores_without_a_game_are_removed(reaper, repositories):
+    """ Test that the hands and scores of games that don't exist are removed """
+    _, hands, scores = repositories
+    hands.save(Hand(id='removed'))
+    scores.save(Score(id='removed'))
+
+    await reaper.sweep()
+
+    assert hands.get_all() == []
+    assert scores.get_all() == []
+    assert reaper.reclaimed['hands'] == 1
+    assert reaper.reclaimed['scores'] == 1
+
+
+@pytest.mark.asyncio
+async def test_removed_games_are_notified(reaper, repositories, connection_manager):
+    """ Test that the callback receives the ids of the removed games """
+    notified = []
+
+    async def on_removed(game_ids):
+        notified.extend(game_ids)
+
+    reaper.on_removed = on_removed
+    game = new_game(repositories, connection_manager, 'game1')
+    game.winner = game.players[0]
+
+    await reaper.sweep()
+
+    assert notified == ['game1']
+    assert reaper.sweeps == 1
@@ -0,0 +1,187 @@
+import asyncio
+import copy
+import json
+import pytest
+
+from unittest import mock
+from events.hand_sync import HandSync, diff
+from events.socket_events import SocketController
+from services.connection_manager import ConnectionManager, Connection, SlowConsumerPolicy
+from services.exceptions import GameException
+from services.game_manager import GameManager
+from services.hand_manager import HandManager
+from models.models import Card, Player
+
+pytest_plugins = ('pytest_asyncio',)
+
+
+def apply_patch(document, operations):
+    """ Minimal JSON-patch implementation, like the one a client would use """
+    document = copy.deepcopy(document)
+    for operation in operations:
+        if operation['path'] == '':
+            document = operation['value']
+            continue
+
+        *parents, last = [key.replace('~1', '/').replace('~0', '~') for key in operation['path'][1:].split('/')]
+        target = document
+        for key in parents:
+            target = target[int(key)] if isinstance(target, list) else target[key]
+
+        if isinstance(target, list):
+            last = int(last)
+        if operation['op'] == 'remove':
+            del target[last]
+        elif operation['op'] == 'add' and isinstance(target, list):
+            target.insert(last, operation['value'])
+        else:
+            target[last] = operation['value']
+    return document
+
+
+def test_diff_transforms_old_into_new():
+    """ Test that applying the diff to the old document results in the new one """
+    old = {'a': 1, 'b': {'c': [1, 2, 3]}, 'd/e': None, 'f': 'x'}
+    new = {'a': 2, 'b': {'c': [1, 5]}, 'd/e': {'g': True}, 'h': []}
+
+    assert apply_patch(old, diff(old, new)) == new
+
+
+def test_diff_of_equal_documents_is_empty():
+    """ Test that there are no operations when nothing changed """
+    assert diff({'a': [1, {'b': None}]}, {'a': [1, {'b': None}]}) == []
+
+
+def test_first_message_is_a_snapshot_and_then_patches():
+    """ Test that a subscribed player receives a snapshot and then only the changes """
+    sync = HandSync()
+    sync.subscribe(player_id='player1', hand_id='game1', revision=None)
+
+    sync.next_revision(hand_id='game1')
+    snapshot = json.loads(sync.message(player_id='player1', hand_id='game1', state={'turn': 'player1'}))
+    sync.next_revision(hand_id='game1')
+    patch = json.loads(sync.message(player_id='player1', hand_id='game1', state={'turn': 'player2'}))
+
+    assert snapshot['event'] == 'handSnapshot'
+    assert snapshot['payload']['revision'] == 1
+    assert patch['event'] == 'handPatch'
+    assert patch['payload']['base'] == 1
+    assert patch['payload']['revision'] == 2
+    assert patch['payload']['ops'] == [{'op': 'replace', 'path': '/turn', 'value': 'player2'}]
+
+
+def test_resubscribe_with_unknown_revision_sends_a_snapshot():
+    """ Test that a player with an unknown revision receives the full hand """
+    sync = HandSync()
+    sync.subscribe(player_id='player1', hand_id='game1', revision=None)
+    sync.next_revision(hand_id='game1')
+    sync.message(player_id='player1', hand_id='game1', state={'turn': 'player1'})
+
+    known_base = sync.subscribe(player_id='player1', hand_id='game1', revision=1)
+    unknown_base = sync.subscribe(player_id='player1', hand_id='game1', revision=7)
+
+    assert known_base == 1
+    assert unknown_base is None
+
+
+@pytest.mark.asyncio
+async def test_subscribed_players_receive_patches(fake_hands_repository, fake_players_repository, fake_games_repository):
+    """ Test that after syncHand the hand updates are sent as patches """
+    connection_manager = mock.AsyncMock(ConnectionManager)
+    hand_manager = HandManager(hands=fake_hands_repository, players=fake_players_repository,
+                               games=fake_games_repository)
+    socket = SocketController(
+            connection_manager=connection_manager,
+            game_manager=GameManager(games=fake_games_repository, players=fake_players_repository),
+            hand_manager=hand_manager
+            )
+    hand = fake_hands_repository.get_by_id(id='game1')
+    hand.cards_dealed['player1'] = [Card(suit='E', rank='1')]
+
+    await socket.syncHand(playerId='player1', handId='game1')
+    snapshot = json.loads(connection_manager.send.call_args.kwargs['json_string'])
+    hand.player_turn = 'player1'
+    await socket.handUpdate(hand_id='game1')
+    sent = {call.kwargs['player_id']: json.loads(call.kwargs['json_string'])
+            for call in connection_manager.send.call_args_list[1:]}
+
+    assert snapshot['event'] == 'handSnapshot'
+    assert sent['player1']['event'] == 'handPatch'
+    assert apply_patch(snapshot['payload']['hand'], sent['player1']['payload']['ops'])['player_turn'] == 'player1'
+    assert sent['player2']['event'] == 'handUpdated'
+
+
+class StalledWebSocket:
+    """ Websocket of a client that never reads its messages """
+    def __init__(self):
+        self.closed = False
+
+    async def send_text(self, data: str):
+        await asyncio.Event().wait()
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_a_patch_that_cant_be_delivered_disconnects_the_player(fake_hands_repository, fake_players_repository,
+                                                                     fake_games_repository):
+    """ Test that a patch is never discarded: the slow player is disconnected
+    and then gets a snapshot instead of a patch against a state it doesn't have
+    """
+    connection_manager = ConnectionManager(max_queue_size=1, slow_consumer_policy=SlowConsumerPolicy.DROP_OLDEST)
+    websocket = StalledWebSocket()
+    connection_manager.active_connections['player1'] = Connection(websocket, 1, SlowConsumerPolicy.DROP_OLDEST)
+    socket = SocketController(
+            connection_manager=connection_manager,
+            game_manager=GameManager(games=fake_games_repository, players=fake_players_repository),
+            hand_manager=HandManager(hands=fake_hands_repository, players=fake_players_repository,
+                                     games=fake_games_repository)
+            )
+
+    await socket.syncHand(playerId='player1', handId='game1')
+    await asyncio.sleep(0)  # El writer queda bloqueado con el snapshot
+    await socket.handUpdate(hand_id='game1')
+    await socket.handUpdate(hand_id='game1')
+    await asyncio.sleep(0)
+    assert websocket.closed
+
+    # Al desconectarse se olvida la revisión que tenía
+    socket.forget_player(player_id='player1')
+    assert not socket._hand_sync.is_subscribed('player1')
+
+
+@pytest.mark.asyncio
+async def test_sync_of_an_unknown_hand_is_rejected(fake_hands_repository, fake_players_repository,
+                                                   fake_games_repository):
+    """ Test that syncHand of a hand that doesn't exist fails with a game error """
+    socket = SocketController(
+            connection_manager=mock.AsyncMock(ConnectionManager),
+            game_manager=GameManager(games=fake_games_repository, players=fake_players_repository),
+            hand_manager=HandManager(hands=fake_hands_repository, players=fake_players_repository,
+                                     games=fake_games_repository)
+            )
+
+    with pytest.raises(GameException, match='La mano no existe'):
+        await socket.call_event(event='syncHand', payload={'playerId': 'player1', 'handId': 'unknown'})
+
+
+@pytest.mark.asyncio
+async def test_sync_of_a_hand_of_another_game_is_rejected(fake_hands_repository, fake_players_repository,
+                                                          fake_games_repository):
+    """ Test that a player that doesn't play the game can't sync its hand """
+    player3 = Player()
+    player3.id = 'player3'
+    fake_players_repository.save(player3)
+    connection_manager = mock.AsyncMock(ConnectionManager)
+    socket = SocketController(
+            connection_manager=connection_manager,
+            game_manager=GameManager(games=fake_games_repository, players=fake_players_repository),
+            hand_manager=HandManager(hands=fake_hands_repository, players=fake_players_repository,
+                                     games=fake_games_repository)
+            )
+
+    with pytest.raises(GameException, match='La mano no existe'):
+        await socket.call_event(event='syncHand', payload={'playerId': 'player3', 'handId': 'game1'})
+    assert not socket._hand_sync.is_subscribed('player3')
+    connection_manager.send.assert_not_called()
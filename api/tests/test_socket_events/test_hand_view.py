@@ -0,0 +1,34 @@
+import json
+
+from fastapi.encoders import jsonable_encoder
+from events.hand_view import HandView
+from models.models import Card, HandStatus
+
+
+def test_each_player_only_receives_own_cards(fake_full_hand):
+    """ Test that the message of each player is the full hand with only the cards of that player """
+    hand = fake_full_hand
+    hand.cards_dealed['player1'] = [Card(suit='E', rank='1'), Card(suit='O', rank='7')]
+    hand.cards_dealed['player2'] = [Card(suit='C', rank='12')]
+    hand.rounds[0].cards_played['player1'] = Card(suit='O', rank='7')
+
+    view = HandView(hand)
+
+    for player_id in ['player1', 'player2']:
+        expected = jsonable_encoder(hand)
+        expected['cards_dealed'] = jsonable_encoder(hand.cards_dealed[player_id])
+        expected['winner'] = hand.check_winner
+        expected_message = json.dumps({'event': 'handUpdated', 'payload': {'hand': expected}})
+
+        assert view.message(player_id) == expected_message
+
+
+def test_cards_are_hidden_before_dealing(fake_full_hand):
+    """ Test that no cards are sent while the hand has not started """
+    hand = fake_full_hand
+    hand.cards_dealed['player1'] = [Card(suit='E', rank='1')]
+    hand.status = HandStatus.NOT_STARTED
+
+    message = json.loads(HandView(hand).message('player1'))
+
+    assert message['payload']['hand']['cards_dealed'] == []
@@ -9,6 +9,7 @@ from events.socket_events import SocketController
 from services.hand_manager import HandManager
 from services.player_manager import PlayerManager
 from services.game_manager import GameManager
+from services.exceptions import GameException
 
 pytest_plugins = ('pytest_asyncio',)
 
@@ -56,7 +57,7 @@ async def test_send_message(mock_connection_manager, fake_player_manager, fake_h
             'time': str(datetime.now().strftime('%H:%M:%S'))
             }
         }})
-    mock_connection_manager.broadcast.assert_called_once_with(json_string=expected_message)
+    mock_connection_manager.broadcast.assert_called_once_with(json_string=expected_message, event='message')
 
 
 @pytest.mark.asyncio
@@ -66,13 +67,32 @@ async def test_games_update(mock_connection_manager, fake_game_manager):
             connection_manager=mock_connection_manager,
             game_manager=fake_game_manager
             )
-    await socket.call_event(event='gamesUpdate', payload={})
+    await socket.gamesUpdate()
 
     expected_message = json.dumps({
         'event': 'gamesUpdate',
         'payload': {'gamesList': [{"id": "game0", "name": "Nueva partida", "currentPlayers": 0}]}
         })
-    mock_connection_manager.broadcast.assert_called_once_with(json_string=expected_message)
+    mock_connection_manager.broadcast.assert_called_once_with(json_string=expected_message, event='gamesUpdate')
+
+
+@pytest.mark.asyncio
+async def test_games_update_reuses_message_until_lobby_changes(mock_connection_manager, fake_game_manager):
+    """ Tests that the lobby message is only rebuilt when the available games change """
+    socket = SocketController(
+            connection_manager=mock_connection_manager,
+            game_manager=fake_game_manager
+            )
+    await socket.gamesUpdate()
+    await socket.gamesUpdate()
+    first, second = [call.kwargs['json_string'] for call in mock_connection_manager.broadcast.call_args_list]
+
+    fake_game_manager.create(rules={'num_players': 2, 'max_score': 15, 'flor': False})
+    await socket.gamesUpdate()
+    third = mock_connection_manager.broadcast.call_args.kwargs['json_string']
+
+    assert first is second
+    assert len(json.loads(third)['payload']['gamesList']) == 2
 
 
 @pytest.mark.asyncio
@@ -84,7 +104,7 @@ async def test_hand_update(mock_connection_manager, fake_player_manager, fake_ha
             hand_manager=fake_hand_manager,
             player_manager=fake_player_manager
             )
-    await socket.call_event(event='handUpdate', payload={'hand_id': 'game1'})
+    await socket.handUpdate(hand_id='game1')
 
     expected_message = json.dumps({
         "event": "handUpdated",
@@ -104,7 +124,8 @@ async def test_hand_update(mock_connection_manager, fake_player_manager, fake_ha
                 }
             }
         })
-    mock_connection_manager.send.assert_called_with(json_string=expected_message, player_id='player2')
+    mock_connection_manager.send.assert_called_with(json_string=expected_message, player_id='player2',
+                                                    event='handUpdated')
 
 
 @pytest.mark.asyncio
@@ -119,4 +140,97 @@ async def test_join_hand(mock_connection_manager, fake_player_manager, fake_hand
     """ Tests that a player can join a hand """
     expected_message = json.dumps({'event': 'joinedHand'})
 
-    mock_connection_manager.send.assert_any_call(json_string=expected_message, player_id='player1')
+    mock_connection_manager.send.assert_any_call(json_string=expected_message, player_id='player1', event='joinedHand')
+
+
+@pytest.mark.asyncio
+async def test_resume_game_sends_a_snapshot_to_the_player(mock_connection_manager, fake_player_manager,
+                                                          fake_hand_manager, fake_game_manager):
+    """ Test that a player that resumes its session gets the game and its hand, only for itself """
+    socket = SocketController(
+            connection_manager=mock_connection_manager,
+            game_manager=fake_game_manager,
+            hand_manager=fake_hand_manager,
+            player_manager=fake_player_manager
+            )
+    fake_game_manager.get_game(id='game1').status = 'STARTED'
+
+    await socket.call_event(event='resumeGame', payload={'playerId': 'player2', 'gameId': 'game1'})
+
+    sent = [json.loads(call.kwargs['json_string'])['event'] for call in mock_connection_manager.send.call_args_list
+            if call.kwargs['player_id'] == 'player2']
+    assert sent[:2] == ['gameUpdate', 'handUpdated']
+    mock_connection_manager.subscribe.assert_called_with(room='game:game1', player_id='player2')
+    mock_connection_manager.publish.assert_not_called()
+
+    with pytest.raises(Exception):
+        await socket.call_event(event='resumeGame', payload={'playerId': 'player1', 'gameId': 'game0'})
+
+
+@pytest.mark.asyncio
+async def test_internal_and_unknown_events_are_rejected(mock_connection_manager, fake_game_manager):
+    """ Test that a client can't call the methods that notify the players nor unknown events """
+    socket = SocketController(connection_manager=mock_connection_manager, game_manager=fake_game_manager)
+
+    for event in ('handUpdate', 'gameUpdate', 'notifyPlayers', 'forget_games', '__init__', 'unknown'):
+        with pytest.raises(GameException, match='Evento desconocido'):
+            await socket.call_event(event=event, payload={'gameId': 'game1', 'hand_id': 'game1'})
+    # Sin playerId el gamesUpdate sería un broadcast a todos los usuarios
+    with pytest.raises(GameException, match='playerId'):
+        await socket.call_event(event='gamesUpdate', payload={})
+
+    mock_connection_manager.publish.assert_not_called()
+    mock_connection_manager.broadcast.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_malformed_payloads_are_rejected_before_the_managers(mock_connection_manager, fake_game_manager):
+    """ Test that a payload that doesn't match the schema of the event doesn't reach the game """
+    socket = SocketController(connection_manager=mock_connection_manager, game_manager=fake_game_manager)
+
+    for payload in ({'playerId': 'player1'},
+                    {'playerId': 'player1', 'gameId': 'game0', 'extra': 1},
+                    {'playerId': 'player1', 'gameId': ['game0']},
+                    None):
+        with pytest.raises(GameException, match='Evento inválido'):
+            await socket.call_event(event='joinGame', payload=payload)
+
+    assert fake_game_manager.get_game(id='game0').players == []
+    assert socket.event_costs['joinGame'].rejected == 4
+    assert socket.event_costs['joinGame'].calls == 0
+
+
+@pytest.mark.asyncio
+async def test_event_costs_are_counted_per_event(mock_connection_manager, fake_player_manager, fake_game_manager):
+    """ Test that every event executed adds its calls, errors and time """
+    socket = SocketController(
+            connection_manager=mock_connection_manager,
+            game_manager=fake_game_manager,
+            player_manager=fake_player_manager
+            )
+    await socket.call_event(event='message', payload={'playerId': 'player1', 'message': 'hola'})
+    with pytest.raises(Exception):
+        await socket.call_event(event='addBot', payload={'playerId': 'player1', 'gameId': 'game1'})
+
+    assert socket.event_costs['message'].calls == 1
+    assert socket.event_costs['message'].seconds > 0
+    assert socket.event_costs['addBot'].dict()['errors'] == 1
+    assert socket.event_costs['joinGame'].calls == 0
+
+
+@pytest.mark.asyncio
+async def test_clients_cannot_choose_the_id_of_a_new_game(mock_connection_manager, fake_player_manager,
+                                                          fake_game_manager):
+    """ Test that the id of a new game is generated by the server """
+    socket = SocketController(
+            connection_manager=mock_connection_manager,
+            game_manager=fake_game_manager,
+            player_manager=fake_player_manager
+            )
+
+    with pytest.raises(GameException, match='gameId'):
+        await socket.call_event(event='createNewGame', payload={'playerId': 'player1', 'gameId': 'mine'})
+    await socket.call_event(event='createNewGame', payload={'playerId': 'player1'})
+
+    assert fake_game_manager.get_game(id='mine') is None
+    assert [game.id for game in fake_game_manager.get_available_games() if game.id not in ('game0', 'game1')]